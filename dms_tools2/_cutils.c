@@ -1,46 +1,118 @@
 // Fast C versions of some functions in dms_tools2.utils
 // Written by Jesse Bloom.
 //
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 #include <math.h>
+#include <ctype.h>
 
 
-static PyObject *
-alignSubamplicon(PyObject *self, PyObject *args)
+// Packed reads: each read is a record with a 2-byte little-endian header
+// holding the length `L` in the low 15 bits and a flag in the high bit
+// indicating if the read has any N. Then there are (L + 3) / 4 bytes of
+// 2-bit codes (A=0, C=1, G=2, T=3) with nucleotide `i` in bits
+// 2 * (i % 4) of byte i / 4. If the read has any N, this is followed by
+// (L + 7) / 8 bytes of N mask with nucleotide `i` in bit i % 8 of
+// byte i / 8. Packed groups of reads are concatenated records.
+static const char PACKED_NTS[4] = {'A', 'C', 'G', 'T'};
+
+#define PACKED_CODES_START 2
+#define PACKED_HAS_N 0x80
+
+// Gets length `*rlen` and total bytes `*recsize` of the record at the
+// start of `buf`. Returns 0 if valid, -1 (Python error set) if truncated.
+static int
+packedRecordInfo(const unsigned char *buf, Py_ssize_t buflen,
+        Py_ssize_t *rlen, Py_ssize_t *recsize)
 {
-    // define variables
-    const char *refseq, *r1, *r2, *chartype;
-    double maxmuts, maxN;
-    long refseqstart, refseqend, i, j;
-    long startcodon, nmuts, codonshift;
-    char mutnt;
-    int hasN, hasmut;
-    PyObject *py_subamplicon;
+    if (buflen < PACKED_CODES_START) {
+        PyErr_SetString(PyExc_ValueError, "truncated packed read");
+        return -1;
+    }
+    *rlen = buf[0] | ((buf[1] & ~PACKED_HAS_N) << 8);
+    *recsize = PACKED_CODES_START + (*rlen + 3) / 4;
+    if (buf[1] & PACKED_HAS_N) {
+        *recsize += (*rlen + 7) / 8;
+    }
+    if (*recsize > buflen) {
+        PyErr_SetString(PyExc_ValueError, "truncated packed read");
+        return -1;
+    }
+    return 0;
+}
 
-    // parse arguments
-    if (! PyArg_ParseTuple(args, "ssslldds", &refseq, &r1, &r2,
-            &refseqstart, &refseqend, &maxmuts, &maxN, &chartype)) {
-        return NULL;
+// Returns nucleotide `i` of packed record `rec` of length `rlen`.
+static char
+packedNt(const unsigned char *rec, Py_ssize_t rlen, Py_ssize_t i)
+{
+    const unsigned char *nmask = rec + PACKED_CODES_START + (rlen + 3) / 4;
+    if ((rec[1] & PACKED_HAS_N) && (nmask[i / 8] & (1 << (i % 8)))) {
+        return 'N';
     }
-    if (strcmp(chartype, "codon")) {
-        PyErr_SetString(PyExc_ValueError, "chartype not codon");
-        return NULL;
+    return PACKED_NTS[(rec[PACKED_CODES_START + i / 4] >> (2 * (i % 4))) & 3];
+}
+
+// Gets sequence of `obj` as characters. If `obj` is a str, `*seq` points
+// to its characters. Otherwise `obj` must support the buffer protocol and
+// begin with a packed read, which is unpacked into `*allocated` (which
+// the caller frees with PyMem_Free). Returns 0 on success, -1 on error.
+static int
+getReadChars(PyObject *obj, const char **seq, Py_ssize_t *len,
+        char **allocated)
+{
+    Py_buffer buf;
+    Py_ssize_t recsize, i;
+
+    *allocated = NULL;
+    if (PyUnicode_Check(obj)) {
+        *seq = PyUnicode_AsUTF8AndSize(obj, len);
+        return (*seq == NULL) ? -1 : 0;
+    }
+    if (PyObject_GetBuffer(obj, &buf, PyBUF_SIMPLE) < 0) {
+        return -1;
+    }
+    if (packedRecordInfo((const unsigned char *) buf.buf, buf.len, len,
+            &recsize) < 0) {
+        PyBuffer_Release(&buf);
+        return -1;
     }
+    *allocated = PyMem_New(char, *len + 1);
+    if (*allocated == NULL) {
+        PyBuffer_Release(&buf);
+        PyErr_NoMemory();
+        return -1;
+    }
+    for (i = 0; i < *len; i++) {
+        (*allocated)[i] = packedNt((const unsigned char *) buf.buf, *len, i);
+    }
+    (*allocated)[*len] = '\0';
+    *seq = *allocated;
+    PyBuffer_Release(&buf);
+    return 0;
+}
+
+
+
+// Builds into `subamplicon` (of length `refseqend - refseqstart + 1`)
+// the subamplicon from `r1` and the already reverse complemented `r2`
+// as described for `dms_tools2.utils.alignSubamplicon` for codons.
+// Returns 1 if it aligns, 0 if it does not, and -1 (Python error set)
+// on error.
+static int
+buildSubamplicon(const char *refseq, const char *r1, Py_ssize_t len_r1,
+        const char *r2, Py_ssize_t len_r2, long refseqstart,
+        long refseqend, double maxmuts, double maxN, char *subamplicon)
+{
+    long i, j, startcodon, nmuts, codonshift;
+    char mutnt;
+    int hasN, hasmut;
     long len_subamplicon = refseqend - refseqstart + 1;
-    long len_r1 = strlen(r1);
-    long len_r2 = strlen(r2);
     long len_subamplicon_minus_len_r2 = len_subamplicon - len_r2;
 
     // build subamplicon
-    char *subamplicon = PyMem_New(char, len_subamplicon + 1);
-    if (subamplicon == NULL) {
-        PyErr_SetString(PyExc_MemoryError, "cannot allocate subamplicon");
-        return NULL;
-    }
-    subamplicon[len_subamplicon] = '\0'; // string termination character
     long nN = 0;
     for (i = 0; i < len_subamplicon; i++) {
         if (i < len_subamplicon_minus_len_r2) { // site not in r2
@@ -67,71 +139,163 @@ alignSubamplicon(PyObject *self, PyObject *args)
         if (subamplicon[i] == 'N') {
             nN++;
             if (nN > maxN) {
-                Py_RETURN_FALSE;
+                return 0;
             }
         }
     }
 
     // look for excessive mutations
-    if (! strcmp(chartype, "codon")) {
-        switch (refseqstart % 3) {
-            case 1 : startcodon = (refseqstart + 2) / 3;
-                     codonshift = 0;
-                     break;
-            case 2 : startcodon = (refseqstart + 1) / 3 + 1;
-                     codonshift = 2;
-                     break;
-            case 0 : startcodon = refseqstart / 3 + 1;
-                     codonshift = 1;
-                     break;
-            default : PyErr_SetString(PyExc_ValueError, "invalid case");
-                      return NULL;
-        }
-        nmuts = 0;
-        for (i = startcodon; i < (refseqend / 3 + 1); i++) {
-            hasN = 0;
-            hasmut = 0;
-            for (j = 0; j < 3; j++) {
-                mutnt = subamplicon[3 * (i - startcodon) + codonshift + j];
-                if (mutnt == 'N') {
-                    hasN = 1;
-                    break;
-                } else if (mutnt != refseq[3 * i - 3 + j]) {
-                    hasmut = 1;
-                }
+    switch (refseqstart % 3) {
+        case 1 : startcodon = (refseqstart + 2) / 3;
+                 codonshift = 0;
+                 break;
+        case 2 : startcodon = (refseqstart + 1) / 3 + 1;
+                 codonshift = 2;
+                 break;
+        case 0 : startcodon = refseqstart / 3 + 1;
+                 codonshift = 1;
+                 break;
+        default : PyErr_SetString(PyExc_ValueError, "invalid case");
+                  return -1;
+    }
+    nmuts = 0;
+    for (i = startcodon; i < (refseqend / 3 + 1); i++) {
+        hasN = 0;
+        hasmut = 0;
+        for (j = 0; j < 3; j++) {
+            mutnt = subamplicon[3 * (i - startcodon) + codonshift + j];
+            if (mutnt == 'N') {
+                hasN = 1;
+                break;
+            } else if (mutnt != refseq[3 * i - 3 + j]) {
+                hasmut = 1;
             }
-            if (hasmut && (! hasN)) {
-                nmuts++;
-                if (nmuts > maxmuts) {
-                    Py_RETURN_FALSE;
-                }
+        }
+        if (hasmut && (! hasN)) {
+            nmuts++;
+            if (nmuts > maxmuts) {
+                return 0;
             }
         }
-    } else {
-        PyErr_SetString(PyExc_ValueError, "invalid chartype");
+    }
+    return 1;
+}
+
+
+static PyObject *
+alignSubamplicon(PyObject *self, PyObject *args)
+{
+    // define variables
+    const char *refseq, *r1, *r2, *chartype;
+    char *r1alloc = NULL, *r2alloc = NULL, *subamplicon = NULL;
+    double maxmuts, maxN;
+    long refseqstart, refseqend;
+    Py_ssize_t len_r1, len_r2;
+    int aligns;
+    PyObject *py_r1, *py_r2, *py_subamplicon = NULL;
+
+    // parse arguments, reads can be str or packed reads
+    if (! PyArg_ParseTuple(args, "sOOlldds", &refseq, &py_r1, &py_r2,
+            &refseqstart, &refseqend, &maxmuts, &maxN, &chartype)) {
+        return NULL;
+    }
+    if (strcmp(chartype, "codon")) {
+        PyErr_SetString(PyExc_ValueError, "chartype not codon");
         return NULL;
     }
+    if ((getReadChars(py_r1, &r1, &len_r1, &r1alloc) < 0) ||
+            (getReadChars(py_r2, &r2, &len_r2, &r2alloc) < 0)) {
+        goto cleanup;
+    }
+    long len_subamplicon = refseqend - refseqstart + 1;
 
-    // return subamplicon
-    py_subamplicon = PyUnicode_FromString(subamplicon);
-    PyMem_Del(subamplicon);
+    subamplicon = PyMem_New(char, len_subamplicon + 1);
+    if (subamplicon == NULL) {
+        PyErr_SetString(PyExc_MemoryError, "cannot allocate subamplicon");
+        goto cleanup;
+    }
+    subamplicon[len_subamplicon] = '\0'; // string termination character
+    aligns = buildSubamplicon(refseq, r1, len_r1, r2, len_r2, refseqstart,
+            refseqend, maxmuts, maxN, subamplicon);
+    if (aligns < 0) {
+        goto cleanup;
+    } else if (aligns) {
+        py_subamplicon = PyUnicode_FromString(subamplicon);
+    } else {
+        Py_INCREF(Py_False);
+        py_subamplicon = Py_False;
+    }
+
+cleanup:
+    PyMem_Free(subamplicon);
+    PyMem_Free(r1alloc);
+    PyMem_Free(r2alloc);
     return py_subamplicon;
 }
 
 
+// Reverse complement of packed read record in `obj`, returns new record.
+static PyObject *
+packedReverseComplement(PyObject *obj)
+{
+    Py_buffer buf;
+    Py_ssize_t rlen, recsize, i, isrc;
+    const unsigned char *rec, *srcmask;
+    unsigned char *rc;
+    PyObject *py_rc;
+
+    if (PyObject_GetBuffer(obj, &buf, PyBUF_SIMPLE) < 0) {
+        return NULL;
+    }
+    rec = (const unsigned char *) buf.buf;
+    if (packedRecordInfo(rec, buf.len, &rlen, &recsize) < 0) {
+        PyBuffer_Release(&buf);
+        return NULL;
+    }
+    py_rc = PyBytes_FromStringAndSize(NULL, recsize);
+    if (py_rc == NULL) {
+        PyBuffer_Release(&buf);
+        return NULL;
+    }
+    rc = (unsigned char *) PyBytes_AS_STRING(py_rc);
+    memset(rc, 0, recsize);
+    rc[0] = rec[0];
+    rc[1] = rec[1];
+    srcmask = rec + PACKED_CODES_START + (rlen + 3) / 4;
+    for (i = 0; i < rlen; i++) {
+        isrc = rlen - 1 - i;
+        if ((rec[1] & PACKED_HAS_N) && (srcmask[isrc / 8] & (1 << (isrc % 8)))) {
+            rc[PACKED_CODES_START + (rlen + 3) / 4 + i / 8] |= 1 << (i % 8);
+        } else {
+            // complement of code c is 3 - c
+            rc[PACKED_CODES_START + i / 4] |= (3 - ((rec[PACKED_CODES_START
+                    + isrc / 4] >> (2 * (isrc % 4))) & 3)) << (2 * (i % 4));
+        }
+    }
+    PyBuffer_Release(&buf);
+    return py_rc;
+}
+
+
 static PyObject *
 reverseComplement(PyObject *self, PyObject *args)
 {
     // define variables
-    PyObject *py_rc;
+    PyObject *py_s, *py_rc;
     const char *s;
-    size_t slen, i;
+    Py_ssize_t slen, i;
 
     // parse arguments
-    if (! PyArg_ParseTuple(args, "s", &s)) {
+    if (! PyArg_ParseTuple(args, "O", &py_s)) {
+        return NULL;
+    }
+    if (! PyUnicode_Check(py_s)) {
+        return packedReverseComplement(py_s);
+    }
+    s = PyUnicode_AsUTF8AndSize(py_s, &slen);
+    if (s == NULL) {
         return NULL;
     }
-    slen = strlen(s);
 
     // build up new string
     char *rc = PyMem_New(char, slen + 1);
@@ -153,6 +317,7 @@ reverseComplement(PyObject *self, PyObject *args)
             case 'N' : rc[i] = 'N';
                        break;
             default : PyErr_SetString(PyExc_ValueError, "invalid nt");
+                      PyMem_Del(rc);
                       return NULL;
         }
     }
@@ -200,38 +365,167 @@ lowQtoN(PyObject *self, PyObject *args)
     return py_newr;
 }
 
+// Maximum read length for which a consensus can be built.
+#define MAX_CONSENSUS_LEN 2000
+
+// Counts of each nucleotide at each site of reads for a consensus.
+typedef struct {
+    long A[MAX_CONSENSUS_LEN], C[MAX_CONSENSUS_LEN];
+    long G[MAX_CONSENSUS_LEN], T[MAX_CONSENSUS_LEN];
+    long tot[MAX_CONSENSUS_LEN];
+} ntCounts;
+
+// Zeros the first `len` sites of `counts`.
+static void
+zeroNtCounts(ntCounts *counts, Py_ssize_t len)
+{
+    Py_ssize_t i;
+    for (i = 0; i < len; i++) {
+        counts->A[i] = 0;
+        counts->C[i] = 0;
+        counts->G[i] = 0;
+        counts->T[i] = 0;
+        counts->tot[i] = 0;
+    }
+}
+
+// Fills the first `len` characters of `consensus` from `counts` with
+// the meaning of `minreads` and `minconcur` in `buildReadConsensus`.
+static void
+callConsensus(const ntCounts *counts, Py_ssize_t len, long minreads,
+        double minconcur, char *consensus)
+{
+    Py_ssize_t i;
+    double mincount;
+    for (i = 0; i < len; i++) {
+        mincount = minconcur * counts->tot[i];
+        if (mincount < minreads) {
+            mincount = minreads;
+        }
+        if (counts->A[i] >= mincount) {
+            consensus[i] = 'A';
+        } else if (counts->C[i] >= mincount) {
+            consensus[i] = 'C';
+        } else if (counts->G[i] >= mincount) {
+            consensus[i] = 'G';
+        } else if (counts->T[i] >= mincount) {
+            consensus[i] = 'T';
+        } else {
+            consensus[i] = 'N';
+        }
+    }
+}
+
+// Builds into `consensus` (which holds MAX_CONSENSUS_LEN characters)
+// the consensus of every `step` record beginning with record `start`
+// of the packed reads in `buf`, and sets `*len` to its length. Returns
+// 0 on success, -1 (Python error set) on failure. Uses static storage
+// for the counts, so must be called with the GIL held.
+static int
+packedConsensus(const unsigned char *buf, Py_ssize_t buflen,
+        Py_ssize_t start, Py_ssize_t step, long minreads, double minconcur,
+        char *consensus, Py_ssize_t *len)
+{
+    static ntCounts counts;
+    Py_ssize_t pos, iread, nreads, maxrlen, rlen, recsize, i;
+    const unsigned char *rec;
+
+    if ((start < 0) || (step < 1)) {
+        PyErr_SetString(PyExc_ValueError, "invalid start or step");
+        return -1;
+    }
+    nreads = 0;
+    maxrlen = 0;
+    for (pos = 0, iread = 0; pos < buflen; pos += recsize, iread++) {
+        if (packedRecordInfo(buf + pos, buflen - pos, &rlen, &recsize) < 0) {
+            return -1;
+        }
+        if ((iread >= start) && ((iread - start) % step == 0)) {
+            nreads++;
+            if (rlen > maxrlen) {
+                maxrlen = rlen;
+            }
+        }
+    }
+    if (nreads < 1) {
+        PyErr_SetString(PyExc_ValueError, "reads has no reads");
+        return -1;
+    }
+    if (maxrlen > MAX_CONSENSUS_LEN) {
+        PyErr_SetString(PyExc_ValueError, "reads too long");
+        return -1;
+    }
+
+    // Count nucleotide occurrences
+    zeroNtCounts(&counts, maxrlen);
+    for (pos = 0, iread = 0; pos < buflen; pos += recsize, iread++) {
+        rec = buf + pos;
+        packedRecordInfo(rec, buflen - pos, &rlen, &recsize);
+        if ((iread < start) || ((iread - start) % step != 0)) {
+            continue;
+        }
+        for (i = 0; i < rlen; i++) {
+            switch (packedNt(rec, rlen, i)) {
+                case 'A' : counts.A[i]++;
+                           break;
+                case 'C' : counts.C[i]++;
+                           break;
+                case 'G' : counts.G[i]++;
+                           break;
+                case 'T' : counts.T[i]++;
+                           break;
+                default : continue; // N is not a called identity
+            }
+            counts.tot[i]++;
+        }
+    }
+
+    callConsensus(&counts, maxrlen, minreads, minconcur, consensus);
+    *len = maxrlen;
+    return 0;
+}
+
+
 static PyObject *
 buildReadConsensus(PyObject *self, PyObject *args)
 {
     // define variables
-    PyObject *r, *py_consensus;
-    PyListObject *reads;
+    static ntCounts counts;
+    static char rconsensus[MAX_CONSENSUS_LEN];
+    PyObject *r, *reads;
+    Py_buffer buf;
     long minreads;
-    double minconcur, mincount;
-    Py_ssize_t nreads, iread, maxrlen, rlen, i;
+    double minconcur;
+    Py_ssize_t nreads, iread, maxrlen, rlen, i, start = 0, step = 1;
     const char *rchar;
+    int status;
 
-    // arrays to hold counts
-    const int maxallowrlen = 2000; // allow reads up to this length
-    long countsA[maxallowrlen], countsC[maxallowrlen];
-    long countsG[maxallowrlen], countsT[maxallowrlen];
-    long countstot[maxallowrlen];
-
-    // parse arguments
-    if (! PyArg_ParseTuple(args, "O!ld", &PyList_Type, &reads, 
-            &minreads, &minconcur)) {
+    // parse arguments, `reads` is list of str or packed reads from which
+    // we use every `step` record beginning with record `start`
+    if (! PyArg_ParseTuple(args, "Old|nn", &reads, &minreads, &minconcur,
+            &start, &step)) {
         return NULL;
     }
-    nreads = PyList_GET_SIZE(reads);
-    if (nreads < 1) {
-        PyErr_SetString(PyExc_ValueError, "reads has no reads");
-        return NULL;
+    if (! PyList_Check(reads)) {
+        if (PyObject_GetBuffer(reads, &buf, PyBUF_SIMPLE) < 0) {
+            return NULL;
+        }
+        status = packedConsensus((const unsigned char *) buf.buf, buf.len,
+                start, step, minreads, minconcur, rconsensus, &maxrlen);
+        PyBuffer_Release(&buf);
+        if (status < 0) {
+            return NULL;
+        }
+        return PyUnicode_FromStringAndSize(rconsensus, maxrlen);
     }
+
+    nreads = PyList_GET_SIZE(reads);
     maxrlen = 0;
     for (iread = 0; iread < nreads; iread++) {
         r = PyList_GET_ITEM(reads, iread);
         if (! PyUnicode_Check(r)) {
-            PyErr_SetString(PyExc_ValueError, "entry in reads not unicode");
+            PyErr_SetString(PyExc_ValueError,
+                    "entry in reads not unicode");
             return NULL;
         }
         rlen = PyUnicode_GET_LENGTH(r);
@@ -239,63 +533,772 @@ buildReadConsensus(PyObject *self, PyObject *args)
             maxrlen = rlen;
         }
     }
+    if (nreads < 1) {
+        PyErr_SetString(PyExc_ValueError, "reads has no reads");
+        return NULL;
+    }
+    if (maxrlen > MAX_CONSENSUS_LEN) {
+        PyErr_SetString(PyExc_ValueError, "reads too long");
+        return NULL;
+    }
 
     // Count nucleotide occurrences
-    for (i = 0; i < maxrlen; i++) {
-        countsA[i] = 0;
-        countsC[i] = 0;
-        countsG[i] = 0;
-        countsT[i] = 0;
-        countstot[i] = 0;
-    }
+    zeroNtCounts(&counts, maxrlen);
     for (iread = 0; iread < nreads; iread++) {
-        rchar = PyUnicode_AsUTF8AndSize(PyList_GET_ITEM(reads, iread), &rlen);
+        rchar = PyUnicode_AsUTF8AndSize(PyList_GET_ITEM(reads, iread),
+                &rlen);
         for (i = 0; i < rlen; i++) {
-            countstot[i]++;
+            counts.tot[i]++;
             switch (rchar[i]) {
-                case 'A' : countsA[i]++;
+                case 'A' : counts.A[i]++;
                            break;
-                case 'C' : countsC[i]++;
+                case 'C' : counts.C[i]++;
                            break;
-                case 'G' : countsG[i]++;
+                case 'G' : counts.G[i]++;
                            break;
-                case 'T' : countsT[i]++;
+                case 'T' : counts.T[i]++;
                            break;
-                case 'N' : countstot[i]--;
+                case 'N' : counts.tot[i]--;
                            break;
-                default : PyErr_SetString(PyExc_ValueError, "invalid nt");
+                default : PyErr_SetString(PyExc_ValueError,
+                                  "invalid nt");
                           return NULL;
             }
         }
     }
-        
-    // build consensus sequence
-    char *rconsensus = PyMem_New(char, maxrlen + 1);
-    if (rconsensus == NULL) {
-        PyErr_SetString(PyExc_MemoryError, "cannot allocate rconsensus");
+
+    callConsensus(&counts, maxrlen, minreads, minconcur, rconsensus);
+    return PyUnicode_FromStringAndSize(rconsensus, maxrlen);
+}
+
+
+static PyObject *
+unpackReads(PyObject *self, PyObject *args)
+{
+    // define variables
+    PyObject *py_packed, *reads, *read;
+    Py_buffer buf;
+    Py_ssize_t start = 0, step = 1, pos, iread, rlen, recsize, i;
+    const unsigned char *rec;
+    char *rchar;
+
+    // parse arguments
+    if (! PyArg_ParseTuple(args, "O|nn", &py_packed, &start, &step)) {
+        return NULL;
+    }
+    if ((start < 0) || (step < 1)) {
+        PyErr_SetString(PyExc_ValueError, "invalid start or step");
         return NULL;
     }
-    rconsensus[maxrlen] = '\0'; // string termination character
-    for (i = 0; i < maxrlen; i++) {
-        mincount = minconcur * countstot[i];
-        if (mincount < minreads) {
-            mincount = minreads;
+    if (PyObject_GetBuffer(py_packed, &buf, PyBUF_SIMPLE) < 0) {
+        return NULL;
+    }
+    reads = PyList_New(0);
+    if (reads == NULL) {
+        goto error;
+    }
+    for (pos = 0, iread = 0; pos < buf.len; pos += recsize, iread++) {
+        rec = (const unsigned char *) buf.buf + pos;
+        if (packedRecordInfo(rec, buf.len - pos, &rlen, &recsize) < 0) {
+            goto error;
+        }
+        if ((iread < start) || ((iread - start) % step != 0)) {
+            continue;
+        }
+        read = PyUnicode_New(rlen, 127);
+        if (read == NULL) {
+            goto error;
+        }
+        rchar = (char *) PyUnicode_DATA(read);
+        for (i = 0; i < rlen; i++) {
+            rchar[i] = packedNt(rec, rlen, i);
+        }
+        if (PyList_Append(reads, read) < 0) {
+            Py_DECREF(read);
+            goto error;
+        }
+        Py_DECREF(read);
+    }
+    PyBuffer_Release(&buf);
+    return reads;
+
+error:
+    Py_XDECREF(reads);
+    PyBuffer_Release(&buf);
+    return NULL;
+}
+
+
+static PyObject *
+countPackedReads(PyObject *self, PyObject *args)
+{
+    // define variables
+    PyObject *py_packed;
+    Py_buffer buf;
+    Py_ssize_t pos, nreads, rlen, recsize;
+
+    // parse arguments
+    if (! PyArg_ParseTuple(args, "O", &py_packed)) {
+        return NULL;
+    }
+    if (PyObject_GetBuffer(py_packed, &buf, PyBUF_SIMPLE) < 0) {
+        return NULL;
+    }
+    for (pos = 0, nreads = 0; pos < buf.len; pos += recsize, nreads++) {
+        if (packedRecordInfo((const unsigned char *) buf.buf + pos,
+                buf.len - pos, &rlen, &recsize) < 0) {
+            PyBuffer_Release(&buf);
+            return NULL;
+        }
+    }
+    PyBuffer_Release(&buf);
+    return PyLong_FromSsize_t(nreads);
+}
+
+
+// Index of nucleotide in `dms_tools2.CODONS` order, -1 for N, -2 if invalid.
+static int
+ntIndex(char nt)
+{
+    switch (nt) {
+        case 'A' : return 0;
+        case 'C' : return 1;
+        case 'G' : return 2;
+        case 'T' : return 3;
+        case 'N' : return -1;
+        default : return -2;
+    }
+}
+
+// Gets writable (nsites, 64) int64 buffer of codon counts `obj` into
+// `*buf`. Returns 0 on success, -1 (Python error set) on failure.
+static int
+getCountsBuffer(PyObject *obj, Py_buffer *buf)
+{
+    if (PyObject_GetBuffer(obj, buf, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS
+            | PyBUF_FORMAT) < 0) {
+        return -1;
+    }
+    if (buf->ndim != 2 || buf->shape[1] != 64 || buf->itemsize != 8 ||
+            ! (strcmp(buf->format, "l") == 0 ||
+               strcmp(buf->format, "q") == 0)) {
+        PyErr_SetString(PyExc_ValueError,
+                "counts not (nsites, 64) array of int64");
+        PyBuffer_Release(buf);
+        return -1;
+    }
+    return 0;
+}
+
+// Adds `increment` to `counts` (an nsites by 64 array) for each codon of
+// subamplicon `s` of length `slen` aligned at `refseqstart` (1, 2, ...
+// numbering). Codons with N are ignored. Returns 0 on success, -1
+// (Python error set) for an invalid nucleotide or site out of range.
+static int
+addCodonCounts(long long *counts, Py_ssize_t nsites, long refseqstart,
+        const char *s, Py_ssize_t slen, long long increment)
+{
+    Py_ssize_t startcodon, codonshift, i, j;
+    int icodon, nti;
+
+    if (refseqstart < 1) {
+        PyErr_SetString(PyExc_ValueError, "refseqstart < 1");
+        return -1;
+    }
+    if (refseqstart % 3 == 1) {
+        startcodon = (refseqstart + 2) / 3 - 1;
+        codonshift = 0;
+    } else if (refseqstart % 3 == 2) {
+        startcodon = (refseqstart + 1) / 3;
+        codonshift = 2;
+    } else {
+        startcodon = refseqstart / 3;
+        codonshift = 1;
+    }
+    s += codonshift;
+    slen = (slen > codonshift) ? slen - codonshift : 0;
+    for (i = 0; i < slen / 3; i++) {
+        icodon = 0;
+        for (j = 0; j < 3; j++) {
+            nti = ntIndex(s[3 * i + j]);
+            if (nti == -2) {
+                PyErr_SetString(PyExc_ValueError, "invalid nt");
+                return -1;
+            }
+            if (nti == -1 || icodon < 0) {
+                icodon = -1;
+            } else {
+                icodon = 4 * icodon + nti;
+            }
+        }
+        if (icodon >= 0) {
+            if (startcodon + i >= nsites) {
+                PyErr_SetString(PyExc_IndexError,
+                        "subamplicon extends past end of counts");
+                return -1;
+            }
+            counts[64 * (startcodon + i) + icodon] += increment;
+        }
+    }
+    return 0;
+}
+
+
+static PyObject *
+incrementCounts(PyObject *self, PyObject *args)
+{
+    // define variables
+    PyObject *py_counts;
+    Py_buffer buf;
+    const char *s;
+    Py_ssize_t slen;
+    long refseqstart;
+    long long increment = 1;
+    int status;
+
+    // parse arguments
+    if (! PyArg_ParseTuple(args, "ls#O|L", &refseqstart, &s, &slen,
+            &py_counts, &increment)) {
+        return NULL;
+    }
+    if (getCountsBuffer(py_counts, &buf) < 0) {
+        return NULL;
+    }
+    status = addCodonCounts((long long *) buf.buf, buf.shape[0],
+            refseqstart, s, slen, increment);
+    PyBuffer_Release(&buf);
+    if (status < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+
+// Fates returned by `alignBarcode`, in the order of
+// `dms_tools2.bcsubamp.BARCODE_FATES`.
+enum {FATE_TOO_FEW_READS, FATE_NOT_ALIGNABLE, FATE_ALIGNED};
+
+// One entry of alignspecs with its trims.
+typedef struct {
+    long refseqstart, refseqend;
+    Py_ssize_t r1start, r2start, r1trim, r2trim;
+    double maxN;
+} alignSpec;
+
+// Gets trim from `obj`, which is None (no trim) or an integer.
+static Py_ssize_t
+getTrim(PyObject *obj)
+{
+    return (obj == Py_None) ? PY_SSIZE_T_MAX : PyLong_AsSsize_t(obj);
+}
+
+// Parses `alignspecs` and `trims` into newly allocated `*specs`, which
+// the caller frees with PyMem_Free. Returns the number of specs, or -1
+// (Python error set) on failure.
+static Py_ssize_t
+getAlignSpecs(PyObject *alignspecs, PyObject *trims, alignSpec **specs)
+{
+    PyObject *spec, *trim;
+    Py_ssize_t nspecs, i;
+    int ok;
+
+    nspecs = PySequence_Size(alignspecs);
+    if (nspecs < 0) {
+        return -1;
+    }
+    if (PySequence_Size(trims) != nspecs) {
+        PyErr_SetString(PyExc_ValueError,
+                "alignspecs and trims differ in length");
+        return -1;
+    }
+    *specs = PyMem_New(alignSpec, nspecs);
+    if (*specs == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    for (i = 0; i < nspecs; i++) {
+        spec = PySequence_GetItem(alignspecs, i);
+        trim = PySequence_GetItem(trims, i);
+        ok = spec && trim &&
+                PyArg_ParseTuple(spec, "llnnd", &(*specs)[i].refseqstart,
+                    &(*specs)[i].refseqend, &(*specs)[i].r1start,
+                    &(*specs)[i].r2start, &(*specs)[i].maxN) &&
+                PyTuple_Check(trim) && PyTuple_GET_SIZE(trim) == 2;
+        if (ok) {
+            (*specs)[i].r1trim = getTrim(PyTuple_GET_ITEM(trim, 0));
+            (*specs)[i].r2trim = getTrim(PyTuple_GET_ITEM(trim, 1));
+            ok = ! PyErr_Occurred();
+        } else if (spec && trim && ! PyErr_Occurred()) {
+            PyErr_SetString(PyExc_ValueError, "trims not 2-tuples");
         }
-        if (countsA[i] >= mincount) {
-            rconsensus[i] = 'A';
-        } else if (countsC[i] >= mincount) {
-            rconsensus[i] = 'C';
-        } else if (countsG[i] >= mincount) {
-            rconsensus[i] = 'G';
-        } else if (countsT[i] >= mincount) {
-            rconsensus[i] = 'T';
+        Py_XDECREF(spec);
+        Py_XDECREF(trim);
+        if (! ok) {
+            PyMem_Free(*specs);
+            return -1;
+        }
+    }
+    return nspecs;
+}
+
+// Sets `*b` and `*e` so that `[*b : *e]` is the Python slice
+// `[start : stop]` of a sequence of length `len`.
+static void
+sliceBounds(Py_ssize_t len, Py_ssize_t start, Py_ssize_t stop,
+        Py_ssize_t *b, Py_ssize_t *e)
+{
+    if (start < 0) {
+        start = (start + len < 0) ? 0 : start + len;
+    }
+    if (stop < 0) {
+        stop = (stop + len < 0) ? 0 : stop + len;
+    }
+    *e = (stop < len) ? stop : len;
+    *b = (start < *e) ? start : *e;
+}
+
+
+static PyObject *
+alignBarcode(PyObject *self, PyObject *args)
+{
+    // define variables
+    static char r1cons[MAX_CONSENSUS_LEN], r2cons[MAX_CONSENSUS_LEN];
+    static char r2rc[MAX_CONSENSUS_LEN];
+    PyObject *reads, *alignspecs, *trims, *py_counts;
+    PyObject *py_refseqstart = NULL, *py_subamplicon = NULL;
+    PyObject *result = NULL;
+    Py_buffer buf, countsbuf;
+    const char *refseq;
+    char *subamplicon = NULL;
+    const unsigned char *rec;
+    long minreads;
+    double minconcur, maxmuts;
+    int keepsubamplicon = 1, fate, aligns, hascounts;
+    Py_ssize_t nspecs = 0, ispec, pos, recsize, rlen, nrecs, nreads;
+    Py_ssize_t len1, len2, b1, e1, b2, e2, i, maxlen;
+    alignSpec *specs = NULL, *spec = NULL;
+
+    // parse arguments, `reads` are packed R1 / R2 pairs
+    if (! PyArg_ParseTuple(args, "OsOOlddO|p", &reads, &refseq,
+            &alignspecs, &trims, &minreads, &minconcur, &maxmuts,
+            &py_counts, &keepsubamplicon)) {
+        return NULL;
+    }
+    hascounts = (py_counts != Py_None);
+    if (hascounts && (getCountsBuffer(py_counts, &countsbuf) < 0)) {
+        return NULL;
+    }
+    if (PyObject_GetBuffer(reads, &buf, PyBUF_SIMPLE) < 0) {
+        goto cleanup_counts;
+    }
+    nspecs = getAlignSpecs(alignspecs, trims, &specs);
+    if (nspecs < 0) {
+        goto cleanup;
+    }
+
+    // count the read pairs
+    rec = (const unsigned char *) buf.buf;
+    for (pos = 0, nrecs = 0; pos < buf.len; pos += recsize, nrecs++) {
+        if (packedRecordInfo(rec + pos, buf.len - pos, &rlen, &recsize) < 0) {
+            goto cleanup;
+        }
+    }
+    if (nrecs % 2) {
+        PyErr_SetString(PyExc_ValueError, "reads not in R1 / R2 pairs");
+        goto cleanup;
+    }
+    nreads = nrecs / 2;
+
+    if (nreads < minreads) {
+        fate = FATE_TOO_FEW_READS;
+    } else {
+        if ((packedConsensus(rec, buf.len, 0, 2, minreads, minconcur,
+                r1cons, &len1) < 0) ||
+                (packedConsensus(rec, buf.len, 1, 2, minreads, minconcur,
+                r2cons, &len2) < 0)) {
+            goto cleanup;
+        }
+        maxlen = 0;
+        for (ispec = 0; ispec < nspecs; ispec++) {
+            if (specs[ispec].refseqend - specs[ispec].refseqstart + 1
+                    > maxlen) {
+                maxlen = specs[ispec].refseqend - specs[ispec].refseqstart + 1;
+            }
+        }
+        subamplicon = PyMem_New(char, maxlen + 1);
+        if (subamplicon == NULL) {
+            PyErr_SetString(PyExc_MemoryError, "cannot allocate subamplicon");
+            goto cleanup;
+        }
+        fate = FATE_NOT_ALIGNABLE;
+        for (ispec = 0; ispec < nspecs; ispec++) {
+            spec = &specs[ispec];
+            // trim, then slice from the read start
+            sliceBounds(len1, 0, spec->r1trim, &b1, &e1);
+            sliceBounds(e1, spec->r1start - 1, PY_SSIZE_T_MAX, &b1, &e1);
+            sliceBounds(len2, 0, spec->r2trim, &b2, &e2);
+            sliceBounds(e2, spec->r2start - 1, PY_SSIZE_T_MAX, &b2, &e2);
+            for (i = 0; i < e2 - b2; i++) {
+                switch (r2cons[e2 - 1 - i]) {
+                    case 'A' : r2rc[i] = 'T';
+                               break;
+                    case 'C' : r2rc[i] = 'G';
+                               break;
+                    case 'G' : r2rc[i] = 'C';
+                               break;
+                    case 'T' : r2rc[i] = 'A';
+                               break;
+                    default : r2rc[i] = 'N';
+                }
+            }
+            aligns = buildSubamplicon(refseq, r1cons + b1, e1 - b1, r2rc,
+                    e2 - b2, spec->refseqstart, spec->refseqend, maxmuts,
+                    spec->maxN, subamplicon);
+            if (aligns < 0) {
+                goto cleanup;
+            } else if (aligns) {
+                fate = FATE_ALIGNED;
+                break;
+            }
+        }
+    }
+
+    if (fate == FATE_ALIGNED) {
+        rlen = spec->refseqend - spec->refseqstart + 1;
+        if (hascounts && (addCodonCounts((long long *) countsbuf.buf,
+                countsbuf.shape[0], spec->refseqstart, subamplicon, rlen,
+                1) < 0)) {
+            goto cleanup;
+        }
+        py_refseqstart = PyLong_FromLong(spec->refseqstart);
+        if (keepsubamplicon) {
+            py_subamplicon = PyUnicode_FromStringAndSize(subamplicon, rlen);
         } else {
-            rconsensus[i] = 'N';
+            Py_INCREF(Py_None);
+            py_subamplicon = Py_None;
         }
+    } else {
+        Py_INCREF(Py_None);
+        py_refseqstart = Py_None;
+        Py_INCREF(Py_None);
+        py_subamplicon = Py_None;
+    }
+    if (py_refseqstart && py_subamplicon) {
+        result = Py_BuildValue("(niOO)", nreads, fate, py_refseqstart,
+                py_subamplicon);
+    }
+    Py_XDECREF(py_refseqstart);
+    Py_XDECREF(py_subamplicon);
+
+cleanup:
+    PyMem_Free(subamplicon);
+    PyMem_Free(specs);
+    PyBuffer_Release(&buf);
+cleanup_counts:
+    if (hascounts) {
+        PyBuffer_Release(&countsbuf);
+    }
+    return result;
+}
+
+
+// holds the location of one FASTQ record in a buffer
+typedef struct {
+    const char *name, *flag, *seq, *qual;
+    Py_ssize_t namelen, flaglen, seqlen, quallen;
+} fastqRecord;
+
+
+// Locates the next FASTQ record in `buf` starting at `*pos`.
+// Returns 1 if record found (and advances `*pos`), 0 if there is
+// no complete record, and -1 (with `*errmsg` set) if invalid.
+// If `final`, the last line may lack a terminal newline.
+// Does not use the Python API, so can be called without the GIL.
+static int
+nextFASTQRecord(const char *buf, Py_ssize_t buflen, Py_ssize_t *pos,
+        int final, fastqRecord *rec, const char **errmsg)
+{
+    const char *lines[4];
+    Py_ssize_t linelens[4], i, j, start, end;
+
+    start = *pos;
+    for (i = 0; i < 4; i++) {
+        if (start >= buflen) {
+            return 0;
+        }
+        end = start;
+        while ((end < buflen) && (buf[end] != '\n')) {
+            end++;
+        }
+        if ((end >= buflen) && !(final && (i == 3))) {
+            return 0; // incomplete line
+        }
+        lines[i] = buf + start;
+        linelens[i] = end - start;
+        if ((linelens[i] > 0) && (lines[i][linelens[i] - 1] == '\r')) {
+            linelens[i]--;
+        }
+        start = end + 1;
+    }
+    if ((linelens[0] < 1) || (lines[0][0] != '@')) {
+        *errmsg = "Primary ID line in FASTQ file does not start with "
+                "'@'. Either this is not FASTQ data or the parser got "
+                "out of sync.";
+        return -1;
+    }
+    if ((linelens[2] < 1) || (lines[2][0] != '+')) {
+        *errmsg = "Secondary ID line in FASTQ file does not start "
+                "with '+'. Maybe got out of sync.";
+        return -1;
+    }
+    if ((linelens[2] > 1) && ((linelens[2] != linelens[0]) ||
+            memcmp(lines[0] + 1, lines[2] + 1, linelens[0] - 1))) {
+        *errmsg = "Primary and secondary ID line in FASTQ disagree.";
+        return -1;
+    }
+
+    // name is first whitespace-delimited token of header, flag second
+    i = 1;
+    while ((i < linelens[0]) && isspace((unsigned char) lines[0][i])) {
+        i++;
+    }
+    j = i;
+    while ((j < linelens[0]) && !isspace((unsigned char) lines[0][j])) {
+        j++;
+    }
+    rec->name = lines[0] + i;
+    rec->namelen = j - i;
+    if (rec->namelen < 1) {
+        *errmsg = "FASTQ record has no name";
+        return -1;
+    }
+    i = j;
+    while ((i < linelens[0]) && isspace((unsigned char) lines[0][i])) {
+        i++;
+    }
+    j = i;
+    while ((j < linelens[0]) && !isspace((unsigned char) lines[0][j])) {
+        j++;
+    }
+    rec->flag = lines[0] + i;
+    rec->flaglen = j - i;
+    rec->seq = lines[1];
+    rec->seqlen = linelens[1];
+    rec->qual = lines[3];
+    rec->quallen = linelens[3];
+    *pos = (start > buflen) ? buflen : start;
+    return 1;
+}
+
+
+// Finds all complete pairs of FASTQ records in `buf1` and `buf2`
+// (`buf2` is NULL if no R2). On success returns 0, sets `*nrecs` to the
+// number of pairs stored in the newly allocated `*recs1` and `*recs2`,
+// and `*pos1` and `*pos2` to the bytes consumed through the last pair.
+// Returns -1 (with `*errmsg` set) if invalid, -2 if out of memory.
+// Does not use the Python API, so can be called without the GIL.
+static int
+scanFASTQPairs(const char *buf1, Py_ssize_t len1, const char *buf2,
+        Py_ssize_t len2, int final, fastqRecord **recs1,
+        fastqRecord **recs2, Py_ssize_t *nrecs, Py_ssize_t *pos1,
+        Py_ssize_t *pos2, const char **errmsg)
+{
+    Py_ssize_t maxrecs = 0, next1 = 0, next2 = 0;
+    fastqRecord rec1, rec2, *newrecs;
+    int status;
+
+    *nrecs = *pos1 = *pos2 = 0;
+    while (1) {
+        status = nextFASTQRecord(buf1, len1, &next1, final, &rec1, errmsg);
+        if (status <= 0) {
+            return status;
+        }
+        if (buf2 != NULL) {
+            status = nextFASTQRecord(buf2, len2, &next2, final, &rec2,
+                    errmsg);
+            if (status <= 0) {
+                return status;
+            }
+        }
+        if (*nrecs >= maxrecs) {
+            maxrecs = (maxrecs > 0) ? 2 * maxrecs : 1024;
+            newrecs = PyMem_RawRealloc(*recs1, maxrecs * sizeof(fastqRecord));
+            if (newrecs == NULL) {
+                return -2;
+            }
+            *recs1 = newrecs;
+            if (buf2 != NULL) {
+                newrecs = PyMem_RawRealloc(*recs2,
+                        maxrecs * sizeof(fastqRecord));
+                if (newrecs == NULL) {
+                    return -2;
+                }
+                *recs2 = newrecs;
+            }
+        }
+        (*recs1)[*nrecs] = rec1;
+        if (buf2 != NULL) {
+            (*recs2)[*nrecs] = rec2;
+        }
+        (*nrecs)++;
+        *pos1 = next1;
+        *pos2 = next2;
+    }
+}
+
+
+static PyObject *
+parseFASTQPairs(PyObject *self, PyObject *args)
+{
+    // define variables
+    Py_buffer buf1, buf2;
+    PyObject *py_r2buf, *result = NULL;
+    PyObject *names = NULL, *r1s = NULL, *r2s = NULL, *q1s = NULL;
+    PyObject *q2s = NULL, *fails = NULL, *item, *fail;
+    long r1trim, r2trim;
+    int final, hasr2, status;
+    Py_ssize_t pos1, pos2, nrecs, irec, namelen1, namelen2;
+    fastqRecord *recs1 = NULL, *recs2 = NULL;
+    const char *errmsg = NULL;
+    char f1, f2;
+
+    // parse arguments
+    if (! PyArg_ParseTuple(args, "y*Ollp", &buf1, &py_r2buf, &r1trim,
+            &r2trim, &final)) {
+        return NULL;
+    }
+    hasr2 = (py_r2buf != Py_None);
+    if (hasr2) {
+        if (PyObject_GetBuffer(py_r2buf, &buf2, PyBUF_SIMPLE) < 0) {
+            PyBuffer_Release(&buf1);
+            return NULL;
+        }
+    }
+
+    // find all complete records present in both buffers, releasing
+    // the GIL so other threads can decompress or use the reads
+    Py_BEGIN_ALLOW_THREADS
+    status = scanFASTQPairs((const char *) buf1.buf, buf1.len,
+            hasr2 ? (const char *) buf2.buf : NULL, hasr2 ? buf2.len : 0,
+            final, &recs1, &recs2, &nrecs, &pos1, &pos2, &errmsg);
+    Py_END_ALLOW_THREADS
+    if (status == -1) {
+        PyErr_SetString(PyExc_ValueError, errmsg);
+        goto cleanup;
+    } else if (status == -2) {
+        PyErr_NoMemory();
+        goto cleanup;
+    }
+
+    // build Python lists from records
+    names = PyList_New(nrecs);
+    r1s = PyList_New(nrecs);
+    q1s = PyList_New(nrecs);
+    fails = PyList_New(nrecs);
+    if (hasr2) {
+        r2s = PyList_New(nrecs);
+        q2s = PyList_New(nrecs);
+    } else {
+        Py_INCREF(Py_None);
+        r2s = Py_None;
+        Py_INCREF(Py_None);
+        q2s = Py_None;
+    }
+    if (!names || !r1s || !q1s || !fails || !r2s || !q2s) {
+        goto cleanup;
+    }
+    for (irec = 0; irec < nrecs; irec++) {
+        namelen1 = recs1[irec].namelen;
+        if (hasr2) {
+            namelen2 = recs2[irec].namelen;
+            // trims last two chars, need for SRA downloaded files
+            if ((namelen1 >= 2) && (namelen2 >= 2) &&
+                    (recs1[irec].name[namelen1 - 2] == '.') &&
+                    (recs1[irec].name[namelen1 - 1] == '1') &&
+                    (recs2[irec].name[namelen2 - 2] == '.') &&
+                    (recs2[irec].name[namelen2 - 1] == '2')) {
+                namelen1 -= 2;
+                namelen2 -= 2;
+            }
+            if ((namelen1 != namelen2) || memcmp(recs1[irec].name,
+                    recs2[irec].name, namelen1)) {
+                PyErr_Format(PyExc_ValueError, "name mismatch %.*s vs %.*s",
+                        (int) namelen1, recs1[irec].name,
+                        (int) namelen2, recs2[irec].name);
+                goto cleanup;
+            }
+        }
+        item = PyUnicode_FromStringAndSize(recs1[irec].name, namelen1);
+        if (item == NULL) {
+            goto cleanup;
+        }
+        PyList_SET_ITEM(names, irec, item);
+
+        // parse chastity filter assuming CASAVA 1.8 header
+        fail = Py_None;
+        if ((recs1[irec].flaglen >= 3) &&
+                ((!hasr2) || (recs2[irec].flaglen >= 3))) {
+            f1 = recs1[irec].flag[2];
+            f2 = hasr2 ? recs2[irec].flag[2] : 'N';
+            if ((f1 == 'N') && (f2 == 'N')) {
+                fail = Py_False;
+            } else if (((f1 == 'N') || (f1 == 'Y')) &&
+                    ((f2 == 'N') || (f2 == 'Y'))) {
+                fail = Py_True;
+            }
+        }
+        Py_INCREF(fail);
+        PyList_SET_ITEM(fails, irec, fail);
+
+        item = PyUnicode_FromStringAndSize(recs1[irec].seq,
+                ((r1trim >= 0) && (r1trim < recs1[irec].seqlen)) ?
+                r1trim : recs1[irec].seqlen);
+        if (item == NULL) {
+            goto cleanup;
+        }
+        PyList_SET_ITEM(r1s, irec, item);
+        item = PyUnicode_FromStringAndSize(recs1[irec].qual,
+                ((r1trim >= 0) && (r1trim < recs1[irec].quallen)) ?
+                r1trim : recs1[irec].quallen);
+        if (item == NULL) {
+            goto cleanup;
+        }
+        PyList_SET_ITEM(q1s, irec, item);
+        if (hasr2) {
+            item = PyUnicode_FromStringAndSize(recs2[irec].seq,
+                    ((r2trim >= 0) && (r2trim < recs2[irec].seqlen)) ?
+                    r2trim : recs2[irec].seqlen);
+            if (item == NULL) {
+                goto cleanup;
+            }
+            PyList_SET_ITEM(r2s, irec, item);
+            item = PyUnicode_FromStringAndSize(recs2[irec].qual,
+                    ((r2trim >= 0) && (r2trim < recs2[irec].quallen)) ?
+                    r2trim : recs2[irec].quallen);
+            if (item == NULL) {
+                goto cleanup;
+            }
+            PyList_SET_ITEM(q2s, irec, item);
+        }
+    }
+
+    result = Py_BuildValue("(OOOOOOnn)", names, r1s, r2s, q1s, q2s,
+            fails, pos1, pos2);
+
+cleanup:
+    Py_XDECREF(names);
+    Py_XDECREF(r1s);
+    Py_XDECREF(r2s);
+    Py_XDECREF(q1s);
+    Py_XDECREF(q2s);
+    Py_XDECREF(fails);
+    PyMem_RawFree(recs1);
+    PyMem_RawFree(recs2);
+    PyBuffer_Release(&buf1);
+    if (hasr2) {
+        PyBuffer_Release(&buf2);
     }
-    py_consensus = PyUnicode_FromString(rconsensus);    
-    PyMem_Del(rconsensus);
-    return py_consensus;
+    return result;
 }
 
 
@@ -309,6 +1312,19 @@ static PyMethodDef cutilsMethods[] = {
             "Same as `dms_tools2.utils.lowQtoN`."},
     {"reverseComplement", reverseComplement, METH_VARARGS,
             "Same as `dms_tools2.utils.reverseComplement`."},
+    {"unpackReads", unpackReads, METH_VARARGS,
+            "Same as `dms_tools2.utils.unpackReads`."},
+    {"countPackedReads", countPackedReads, METH_VARARGS,
+            "Number of reads in packed reads."},
+    {"incrementCounts", incrementCounts, METH_VARARGS,
+            "Same as `dms_tools2.utils.incrementCounts` for codon "
+            "counts in an array."},
+    {"alignBarcode", alignBarcode, METH_VARARGS,
+            "Builds, aligns, and counts the subamplicon for a barcode "
+            "for `dms_tools2.bcsubamp.alignBarcode`."},
+    {"parseFASTQPairs", parseFASTQPairs, METH_VARARGS,
+            "Parses complete FASTQ records from R1 and R2 buffers "
+            "for `dms_tools2.utils.iteratePairedFASTQBatches`."},
     {NULL, NULL, 0, NULL}
 };
 
@@ -780,6 +780,24 @@ class IlluminaBarcodeParser:
         self._matches = {'R1':{}, 'R2':{}} # saves match object by read length
 
 
+    @staticmethod
+    def _iterateReads(r1files, r2files):
+        """Like `dms_tools2.utils.iteratePairedFASTQ` but Q scores as arrays.
+
+        Reads are parsed in batches, and the Q-score strings for each
+        batch are converted to one `numpy.uint8` array by
+        `dms_tools2.utils.readsToArray`. Each yielded `q1` and `q2`
+        is a row of that array (`q2` is `None` if no R2).
+        """
+        for (names, r1s, r2s, q1s, q2s, fails) in \
+                dms_tools2.utils.iteratePairedFASTQBatches(r1files, r2files):
+            q1s = dms_tools2.utils.readsToArray(q1s)
+            if r2s is None:
+                r2s = q2s = itertools.repeat(None)
+            else:
+                q2s = dms_tools2.utils.readsToArray(q2s)
+            yield from zip(names, r1s, r2s, q1s, q2s, fails)
+
     def parse(self, r1files, r2files=None):
         """Parses barcodes from files.
 
@@ -825,8 +843,8 @@ class IlluminaBarcodeParser:
 
         fates = collections.defaultdict(int)
 
-        for name, r1, r2, q1, q2, fail in \
-                dms_tools2.utils.iteratePairedFASTQ(r1files, r2files):
+        for name, r1, r2, q1, q2, fail in self._iterateReads(r1files,
+                                                             r2files):
 
             if fail and self.chastity_filter:
                 fates['failed chastity filter'] += 1
@@ -876,11 +894,9 @@ class IlluminaBarcodeParser:
                 bc_q = {}
                 for read, q in zip(reads, [q1, q2]):
                     bc[read] = matches[read].group('bc')
-                    bc_q[read] = numpy.array([
-                                 ord(qi) - 33 for qi in
-                                 q[matches[read].start('bc') :
-                                   matches[read].end('bc')]],
-                                 dtype='int')
+                    bc_q[read] = (q[matches[read].start('bc') :
+                                    matches[read].end('bc')]
+                                  .astype('int') - 33)
                 if self.rc_barcode and 'R2' in reads:
                     bc['R2'] = dms_tools2.utils.reverseComplement(bc['R2'])
                     bc_q['R2'] = numpy.flip(bc_q['R2'], axis=0)
@@ -0,0 +1,600 @@
+"""
+===================
+batch
+===================
+
+Running the per-sample programs of the ``dms2_batch_*`` programs.
+
+The batch programs run a per-sample program such as ``dms2_prefs``
+on each sample. Rather than launching a new process for each sample
+(which has to import `dms_tools2` and its dependencies, and re-read
+inputs shared by the samples), `runScripts` calls the ``main`` function
+of the per-sample program in a pool of reused worker processes. The
+per-sample programs read shared inputs with the functions in this
+module, which read each input only once per process.
+"""
+
+
+import os
+import sys
+import math
+import shutil
+import logging
+import traceback
+import functools
+import contextlib
+import subprocess
+import importlib.util
+import importlib.machinery
+import queue
+import pickle
+import weakref
+import itertools
+import collections
+import multiprocessing
+
+import pandas
+import Bio.SeqIO
+
+import dms_tools2.utils
+
+#: In workers of `runScripts`, the tuple `(iworker, units, resultqueues,
+#: generations, current)` of the worker index, the queues and counters
+#: shared by the workers, and the value `current` that holds the index
+#: of the worker whose unit of work this worker is running, or -1.
+_scheduler = None
+
+#: Seconds `runScripts` waits for a sample before checking that all of
+#: its worker processes are still alive.
+_WORKER_CHECK_INTERVAL = 1
+
+
+def runScripts(argslist, ncpus, logger=None):
+    """Runs per-sample programs sharing a pool of worker processes.
+
+    There are `ncpus` worker processes that are reused for all samples.
+    The per-sample programs do their parallel work (such as inferring
+    preferences at each site) with `Pool`, which puts the units of work
+    for all samples into one queue shared by all workers. Workers take
+    these units before starting new samples, and a sample waiting for its
+    own units runs other queued units. So once fewer samples than
+    `ncpus` remain, the idle workers help finish them, and no more than
+    `ncpus` units of work ever run at once. Logging and output of the
+    programs go only to their own log files, as when they are run from
+    the command line. If a worker process dies (for instance if it runs
+    out of memory), the sample it was running and the sample owning any
+    unit of work it was running fail. As the dead worker may have left
+    the shared queues unusable, the other workers are then stopped and
+    replaced by new ones, which start their samples again.
+    A program that is not a Python script with a ``main`` function (such
+    as a shell wrapper) is instead run as a subprocess in a worker.
+
+    Args:
+        `argslist` (list)
+            Each entry is a list of command-line arguments, with the
+            first being the name of the program such as ``dms2_prefs``.
+            An entry can instead be a function taking no arguments
+            (such as a `functools.partial`) that runs one or more
+            samples, which must be picklable if `ncpus` > 1.
+        `ncpus` (int)
+            Number of worker processes.
+        `logger` (`logging.Logger` or `None`)
+            If not `None`, log a warning for each program that fails.
+
+    Returns:
+        A list with an entry for each entry in `argslist` that is `None`
+        if that program ran successfully, or a str describing the error
+        otherwise. As for the command-line programs, errors in
+        processing a sample are written to the log file for the sample.
+    """
+    if ncpus > 1:
+        errors = [None] * len(argslist)
+        pending = list(enumerate(argslist))[ : : -1]
+        while pending:
+            _runWorkers(pending, ncpus, errors)
+    else:
+        errors = list(map(_runScript, argslist))
+    if logger:
+        for (args, error) in zip(argslist, errors):
+            if error:
+                logger.warning("Error running {0}:\n{1}".format(
+                        _describe(args), error))
+    return errors
+
+
+def _runWorkers(pending, ncpus, errors):
+    """Runs samples in `ncpus` new worker processes for `runScripts`.
+
+    Samples are popped from the end of the list `pending` of
+    `(index, args)` tuples, and their errors set in `errors`. Returns
+    once all have finished, or after a worker process dies. In that case
+    the samples that were running in the other workers are put back on
+    `pending`.
+    """
+    # each worker gets its next sample from its own queue, so we
+    # know which sample each worker is running
+    samplequeues = [multiprocessing.Queue() for i in range(ncpus)]
+    done = multiprocessing.Queue()
+    units = multiprocessing.Queue()
+    resultqueues = [multiprocessing.Queue() for i in range(ncpus)]
+    generations = [multiprocessing.Value('l', 0) for i in range(ncpus)]
+    current = [multiprocessing.Value('l', -1) for i in range(ncpus)]
+    stop = multiprocessing.Event()
+    running = [None] * ncpus
+
+    def nextSample(iworker):
+        """Gives worker `iworker` the next sample if there is one."""
+        running[iworker] = pending.pop() if pending else None
+        if running[iworker] is not None:
+            samplequeues[iworker].put(running[iworker])
+
+    workers = [multiprocessing.Process(target=_worker, args=(iworker,
+            samplequeues[iworker], done, units, resultqueues, generations,
+            current[iworker], stop)) for iworker in range(ncpus)]
+    for (iworker, worker) in enumerate(workers):
+        worker.start()
+        nextSample(iworker)
+    dead = []
+    try:
+        while any(running) and not dead:
+            try:
+                (iworker, i, error) = done.get(timeout=_WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                dead = [iworker for (iworker, worker) in enumerate(workers)
+                        if not worker.is_alive()]
+                continue
+            errors[i] = error
+            nextSample(iworker)
+    finally:
+        if dead:
+            for worker in workers:
+                worker.terminate()
+        stop.set()
+        for worker in workers:
+            worker.join()
+    for iworker in dead:
+        error = 'worker process exited with code {0} while running {1}'\
+                .format(workers[iworker].exitcode, _describe(
+                running[iworker][1]) if running[iworker] else 'no sample')
+        # fail the sample of the dead worker, and of any unit it ran
+        for jworker in {iworker, current[iworker].value} - {-1}:
+            if running[jworker] is not None:
+                errors[running[jworker][0]] = error
+                running[jworker] = None
+    # start samples of the stopped workers again
+    pending.extend(sample for sample in running[ : : -1] if sample)
+
+
+def chunkSamples(samples, ncpus, key=None):
+    """Splits samples into chunks to run as entries of `runScripts`.
+
+    Samples with the same value of `key` go in the same chunks, so they
+    can share work. But no chunk has more than its share of the samples
+    for `ncpus` CPUs, so all CPUs are used when there are enough samples.
+
+    Args:
+        `samples` (list)
+            The samples.
+        `ncpus` (int)
+            Number of CPUs.
+        `key` (function or `None`)
+            Function of a sample giving the value used to group samples.
+            If `None`, all samples are in one group.
+
+    Returns:
+        A list of chunks, each a list of samples in the order they
+        are in `samples`.
+
+    >>> chunkSamples(list(range(7)), 2, key=lambda i: i % 2)
+    [[0, 2, 4, 6], [1, 3, 5]]
+    >>> chunkSamples(list(range(7)), 3)
+    [[0, 1, 2], [3, 4, 5], [6]]
+    """
+    maxsize = max(1, math.ceil(len(samples) / ncpus))
+    groups = collections.OrderedDict()
+    for sample in samples:
+        groups.setdefault(key(sample) if key else None, []).append(sample)
+    return [group[i : i + maxsize] for group in groups.values() for i in
+            range(0, len(group), maxsize)]
+
+
+def Pool(ncpus):
+    """Process pool for the parallel work of a per-sample program.
+
+    Args:
+        `ncpus` (int)
+            Number of processes if not run by `runScripts`.
+
+    Returns:
+        When the program is run by `runScripts`, a pool that puts work
+        in the queue shared by all samples as described there, ignoring
+        `ncpus`. Otherwise a `multiprocessing.Pool` with `ncpus`
+        processes. Both support the `apply_async`, `map`, `close`,
+        `join`, and `terminate` methods, and use as a context manager.
+        Use `CompletionQueue` to get results as they complete.
+    """
+    if _scheduler is None:
+        return multiprocessing.Pool(ncpus)
+    else:
+        return _SharedPool()
+
+
+class CompletionQueue:
+    """Gets results of tasks run by a `Pool` in the order they complete.
+
+    Rather than polling each task to see if it is ready, `get` waits for
+    whichever task completes next, so new tasks (such as retries of
+    failed ones) can be submitted as soon as a result is available.
+
+    Args:
+        `pool`
+            A pool returned by `Pool`.
+
+    Attributes:
+        `pending` (int)
+            Number of tasks submitted whose results have not been
+            returned by `get`.
+
+    >>> import operator
+    >>> with Pool(2) as pool:
+    ...     completed = CompletionQueue(pool)
+    ...     completed.submit('a', operator.add, (1, 2))
+    ...     completed.submit('b', operator.mul, (2, 3))
+    ...     results = {}
+    ...     while completed.pending:
+    ...         (key, result) = completed.get()
+    ...         results[key] = result
+    >>> results == {'a':3, 'b':6}
+    True
+    """
+
+    def __init__(self, pool):
+        """See main class docstring."""
+        self._pool = pool
+        self._queue = queue.Queue()
+        self.pending = 0
+
+    def submit(self, key, func, args=(), kwds={}):
+        """Runs `func(*args, **kwds)`, returned with `key` by `get`."""
+        self.pending += 1
+        self._pool.apply_async(func, args, kwds,
+                callback=functools.partial(self._done, key, True),
+                error_callback=functools.partial(self._done, key, False))
+
+    def get(self):
+        """Waits for the next task to complete.
+
+        Returns:
+            The tuple `(key, result)` for the task. If the task raised
+            an exception, it is raised here.
+        """
+        assert self.pending > 0, "no tasks pending"
+        while True:
+            if isinstance(self._pool, _SharedPool):
+                self._pool._collect()
+                try:
+                    (key, success, value) = self._queue.get_nowait()
+                except queue.Empty:
+                    # rather than sit idle, help with the shared queue
+                    _runUnit(timeout=0.05)
+                    continue
+            else:
+                (key, success, value) = self._queue.get()
+            self.pending -= 1
+            if success:
+                return (key, value)
+            else:
+                raise value
+
+    def _done(self, key, success, value):
+        """Callback for completed tasks."""
+        self._queue.put((key, success, value))
+
+
+def readCSV(filename):
+    """Reads table `filename` with `dms_tools2.utils.readTable`.
+
+    The table can be CSV or any other format written by
+    `dms_tools2.utils.writeTable`.
+
+    The file is only read again in the same process if it has changed.
+
+    Returns:
+        A copy of the data frame, so it can be modified by the caller.
+    """
+    return _readCSV(os.path.abspath(filename),
+            _fileSignature(filename)).copy()
+
+
+def readFasta(filename):
+    """Returns list of the sequences (as str) in FASTA file `filename`.
+
+    The file is only read again in the same process if it has changed.
+    """
+    return list(_readFasta(os.path.abspath(filename),
+            _fileSignature(filename)))
+
+
+@functools.lru_cache(maxsize=None)
+def stanModel(modelclass):
+    """Returns instance of `modelclass`, compiled once per process.
+
+    Args:
+        `modelclass` (class)
+            A class such as `dms_tools2.prefs.StanModelNoneErr`
+            that compiles a ``pystan`` model when initialized.
+    """
+    return modelclass()
+
+
+def _fileSignature(filename):
+    """Modification time and size of `filename`."""
+    stat = os.stat(filename)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=64)
+def _readCSV(filename, signature):
+    """Cached `dms_tools2.utils.readTable` for `readCSV`."""
+    return dms_tools2.utils.readTable(filename)
+
+
+@functools.lru_cache(maxsize=64)
+def _readFasta(filename, signature):
+    """Cached reading of sequences for `readFasta`."""
+    return tuple(str(s.seq) for s in Bio.SeqIO.parse(filename, 'fasta'))
+
+
+@functools.lru_cache(maxsize=None)
+def _scriptMain(script):
+    """Returns the ``main`` function of the installed program `script`.
+
+    Returns `None` if the program is not a Python script that defines
+    ``main``, such as a shell wrapper, so it must be run as a subprocess.
+    """
+    path = shutil.which(script)
+    if path is None:
+        raise RuntimeError("Cannot find program {0}".format(script))
+    try:
+        with open(path) as f:
+            source = f.read()
+        firstline = source.split('\n', 1)[0]
+        if firstline.startswith('#!') and 'python' not in firstline:
+            return None
+        code = compile(source, path, 'exec')
+    except (UnicodeDecodeError, SyntaxError, ValueError):
+        return None
+    modname = '_dms_tools2_script_{0}'.format(script)
+    loader = importlib.machinery.SourceFileLoader(modname, path)
+    spec = importlib.util.spec_from_loader(modname, loader)
+    module = importlib.util.module_from_spec(spec)
+    exec(code, module.__dict__)
+    return getattr(module, 'main', None)
+
+
+def _runSubprocess(args):
+    """Runs program `args` as a subprocess, returns error or `None`."""
+    result = subprocess.run(args, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        return '{0} exited with status {1}:\n{2}'.format(_describe(args),
+                result.returncode, result.stderr)
+    return None
+
+
+def _worker(iworker, samples, done, units, resultqueues, generations,
+        current, stop):
+    """Worker process for `runScripts`.
+
+    The generation of a worker is incremented each time it finishes a
+    sample, so units of work left over from that sample are skipped.
+    """
+    global _scheduler
+    _scheduler = (iworker, units, resultqueues, generations, current)
+    for q in [units] + resultqueues:
+        # units and results of samples that failed may never be read
+        q.cancel_join_thread()
+    while not stop.is_set():
+        if _runUnit(timeout=0.05):
+            continue
+        try:
+            (i, args) = samples.get_nowait()
+        except queue.Empty:
+            continue
+        error = _runScript(args)
+        generations[iworker].value += 1
+        done.put((iworker, i, error))
+
+
+def _runUnit(timeout):
+    """Runs a unit of work queued by `_SharedPool` if there is one.
+
+    Returns `True` if a unit was taken from the queue, `False` if
+    `timeout` seconds passed with none queued.
+    """
+    (_, units, resultqueues, generations, current) = _scheduler
+    try:
+        (iworker, generation, taskid, unit) = units.get(timeout=timeout)
+    except queue.Empty:
+        return False
+    if generation != generations[iworker].value:
+        return True
+    # record the unit so it fails rather than hangs if this worker dies
+    previous = current.value
+    current.value = iworker
+    # pickle ourselves so any error is returned rather than lost
+    try:
+        (func, args, kwds) = pickle.loads(unit)
+        result = pickle.dumps((taskid, True, func(*args, **kwds)))
+    except Exception as e:
+        try:
+            result = pickle.dumps((taskid, False, e))
+        except Exception:
+            result = pickle.dumps((taskid, False, RuntimeError(repr(e))))
+    resultqueues[iworker].put(result)
+    current.value = previous
+    return True
+
+
+class _SharedPool:
+    """Pool returned by `Pool` in workers of `runScripts`."""
+
+    _taskids = itertools.count()
+
+    #: Pools of this worker keyed by ID of their pending tasks, as all
+    #: pools of a worker get results from the same queue.
+    _pools = weakref.WeakValueDictionary()
+
+    def __init__(self):
+        """See `Pool`."""
+        (self._iworker, self._units, resultqueues, generations, _) = \
+                _scheduler
+        self._resultqueue = resultqueues[self._iworker]
+        self._generation = generations[self._iworker].value
+        self._tasks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.terminate()
+
+    def apply_async(self, func, args=(), kwds={}, callback=None,
+            error_callback=None):
+        """Queues `func(*args, **kwds)`, returns a `_SharedResult`.
+
+        As for `multiprocessing.Pool.apply_async`, `callback` or
+        `error_callback` is called with the result or exception, here
+        when results are collected while waiting for any result.
+        """
+        taskid = next(self._taskids)
+        result = _SharedResult(self, callback, error_callback)
+        self._tasks[taskid] = result
+        self._pools[taskid] = self
+        self._units.put((self._iworker, self._generation, taskid,
+                pickle.dumps((func, tuple(args), dict(kwds)))))
+        return result
+
+    def map(self, func, iterable, chunksize=None):
+        """Like `multiprocessing.Pool.map`."""
+        items = list(iterable)
+        chunksize = chunksize or 1
+        chunks = [self.apply_async(_mapChunk, (func, items[i : i + chunksize]))
+                for i in range(0, len(items), chunksize)]
+        return [result for chunk in chunks for result in chunk.get()]
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def _collect(self):
+        """Delivers results returned to this worker to their tasks.
+
+        Each result is only held by its `_SharedResult`, so it is freed
+        along with that once used.
+        """
+        while True:
+            try:
+                result = self._resultqueue.get_nowait()
+            except queue.Empty:
+                return
+            (taskid, success, value) = pickle.loads(result)
+            pool = self._pools.pop(taskid, None)
+            if pool is None:
+                continue # unit of a sample that has already finished
+            pool._tasks.pop(taskid)._deliver(success, value)
+
+
+class _SharedResult:
+    """Result of `_SharedPool.apply_async`."""
+
+    def __init__(self, pool, callback=None, error_callback=None):
+        self._pool = pool
+        self._callbacks = (callback, error_callback)
+        self._value = None
+
+    def ready(self):
+        """Is the result ready? If not, may run another queued unit."""
+        self._pool._collect()
+        if self._value is None:
+            # rather than sit idle, help with the shared queue
+            _runUnit(timeout=0)
+            self._pool._collect()
+        return self._value is not None
+
+    def get(self):
+        """Returns the result, running queued units until it is ready."""
+        while not self.ready():
+            _runUnit(timeout=0.05)
+        (success, value) = self._value
+        if success:
+            return value
+        else:
+            raise value
+
+    def _deliver(self, success, value):
+        """Stores the result and calls the callbacks."""
+        self._value = (success, value)
+        (callback, error_callback) = self._callbacks
+        self._callbacks = (None, None)
+        if success and callback:
+            callback(value)
+        elif not success and error_callback:
+            error_callback(value)
+
+
+def _mapChunk(func, items):
+    """Applies `func` to each of `items` for `_SharedPool.map`."""
+    return [func(item) for item in items]
+
+
+def _describe(args):
+    """Describes entry `args` of `runScripts` for messages."""
+    if callable(args):
+        return getattr(args, 'func', args).__name__
+    else:
+        return ' '.join(args)
+
+
+def _runScript(args):
+    """Runs entry `args` of `runScripts`, returns error or `None`."""
+    argv = sys.argv
+    handlers = {name:list(getattr(logger, 'handlers', [])) for (name, logger)
+            in logging.Logger.manager.loggerDict.items()}
+    # programs log to their log file, not the standard error of the caller
+    root = logging.getLogger()
+    roothandlers = root.handlers
+    root.handlers = [logging.NullHandler()]
+    try:
+        if callable(args):
+            main = args
+        else:
+            main = _scriptMain(args[0])
+            if main is None:
+                return _runSubprocess(args)
+            sys.argv = list(args)
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull), \
+                contextlib.redirect_stderr(devnull):
+            main()
+    except SystemExit as e:
+        if e.code:
+            return '{0} exited with status {1}'.format(_describe(args),
+                    e.code)
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        sys.argv = argv
+        root.handlers = roothandlers
+        # programs add a file handler to their logger each time they run
+        for (name, logger) in list(logging.Logger.manager.loggerDict.items()):
+            for handler in list(getattr(logger, 'handlers', [])):
+                if handler not in handlers.get(name, []):
+                    logger.removeHandler(handler)
+                    handler.close()
+    return None
@@ -0,0 +1,908 @@
+"""
+===================
+bcsubamp
+===================
+
+Building and aligning barcoded subamplicons.
+
+These functions implement the steps of ``dms2_bcsubamp`` that are
+applied to reads after they have been grouped by barcode. They are
+in a module (rather than the script) so that they can be run on
+disjoint barcode shards in separate processes.
+"""
+
+
+import os
+import time
+import zlib
+import gzip
+import heapq
+import pickle
+import sqlite3
+import shutil
+import random
+import tempfile
+import operator
+import itertools
+import functools
+
+import numpy
+import pandas
+
+import dms_tools2
+import dms_tools2.utils
+import dms_tools2.batch
+import dms_tools2._cutils
+from dms_tools2 import CODONS
+
+#: Fates of barcodes indexed by the codes from `_cutils.alignBarcode`.
+BARCODE_FATES = ('too few reads', 'not alignable', 'aligned')
+
+
+def bcInfo(bc, bcreads, retained, consensus, desc):
+    """Returns string for writing to `bcinfofile`.
+
+    Creates a string summarizing the barcode.
+
+    Args:
+        `bc` (str):
+            The barcode.
+        `bcreads` (list)
+            dict of `{'R1':r1list, 'R2':r2list}`
+        `retained` (bool)
+            Is the barcode retained?
+        `consensus` (str or `None`)
+            The consensus sequence for the barcode if created.
+        `desc` (str)
+            String describing the barcode and its fate.
+
+    Returns:
+        A string summarizing the barcode.
+
+    >>> info = bcInfo('ACGT', {'R1':['GGA', 'GGC'], 'R2':['TTC', 'TTA']},
+    ...         False, None, 'too few reads')
+    >>> info.split('R2 READS:')[1].split() == ['TTC', 'TTA']
+    True
+    """
+    return '\n'.join([
+            'BARCODE: {0}'.format(bc),
+            'RETAINED: {0}'.format(retained),
+            'DESCRIPTION: {0}'.format(desc),
+            'CONSENSUS: {0}'.format(consensus),
+            'R1 READS:\n\t{0}'.format('\n\t'.join(bcreads['R1'])),
+            'R2 READS:\n\t{0}'.format('\n\t'.join(bcreads['R2'])),
+            '',
+            ])
+
+
+def barcodeShard(barcode, nshards):
+    """Assigns a barcode to one of `nshards` shards.
+
+    The assignment uses a checksum rather than the built-in `hash`
+    so that it is the same in every process and every run.
+
+    Args:
+        `barcode` (str or int)
+            The barcode, or an integer barcode from
+            `dms_tools2.utils.encodeBarcodes`.
+        `nshards` (int)
+            Number of shards.
+
+    Returns:
+        An integer in `range(nshards)`.
+
+    >>> barcodeShard('ACGTACGT', 1)
+    0
+    >>> barcodeShard('ACGTACGT', 4) == barcodeShard('ACGTACGT', 4)
+    True
+    >>> sorted(set(barcodeShard(bc, 3) for bc in
+    ...         ['AAAA', 'CCCC', 'GGGG', 'TTTT', 'ACGT', 'TGCA']))
+    [0, 1, 2]
+    >>> sorted(set(barcodeShard(bc, 3) for bc in range(256, 270)))
+    [0, 1, 2]
+    """
+    if isinstance(barcode, str):
+        data = barcode.encode()
+    else:
+        barcode = int(barcode)
+        data = barcode.to_bytes((barcode.bit_length() + 7) // 8, 'little')
+    return zlib.crc32(data) % nshards
+
+
+class SpilledBarcodes:
+    """Reads grouped by barcode, spilled to sorted files on disk.
+
+    Reads are held in memory until their approximate size exceeds
+    `maxbytes`, and are then written as a run sorted by barcode to a
+    temporary file. The `items` method merges all runs so that reads
+    are streamed one barcode at a time, which means that memory usage
+    is set by `maxbytes` rather than by the total number of reads.
+
+    Reads are packed as by `dms_tools2.utils.packReadArrays`, and an
+    instance can be passed to `alignBarcodes` in place of a dict.
+
+    Args:
+        `tmpdir` (str)
+            Directory for the temporary files, which are deleted
+            by `cleanup`.
+        `maxbytes` (int or float)
+            Approximate memory used for reads before spilling.
+
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     barcodes = SpilledBarcodes(tmpdir, maxbytes=300)
+    ...     for (bc, r1, r2) in [(15, 'ACG', 'GGA'), (0, 'ACC', 'GGT'),
+    ...             (15, 'ACN', 'GGA'), (5, 'AAA', 'TTT'),
+    ...             (0, 'ACG', 'NGT'), (15, 'ACG', 'GGG')]:
+    ...         barcodes.add(bc, dms_tools2.utils.packReads([r1, r2]))
+    ...     nruns = len(barcodes.runfiles)
+    ...     bcitems = list(barcodes.items())
+    ...     barcodes.cleanup()
+    >>> nruns > 1
+    True
+    >>> for (bc, bcreads) in bcitems:
+    ...     print(bc, dms_tools2.utils.unpackReads(bcreads, 0, 2),
+    ...           dms_tools2.utils.unpackReads(bcreads, 1, 2))
+    0 ['ACC', 'ACG'] ['GGT', 'NGT']
+    5 ['AAA'] ['TTT']
+    15 ['ACG', 'ACN', 'ACG'] ['GGA', 'GGA', 'GGG']
+    """
+
+    #: approximate bytes used by each read pair beyond its packed size
+    READ_BYTES = 16
+
+    #: approximate bytes used by each new barcode
+    BARCODE_BYTES = 150
+
+    def __init__(self, tmpdir, maxbytes):
+        """See main class doc string."""
+        self.tmpdir = tmpdir
+        self.maxbytes = maxbytes
+        self.runfiles = []
+        self.barcodes = {}
+        self.nbytes = 0
+
+    def add(self, barcode, packedreads):
+        """Adds `packedreads` for `barcode`, spilling if needed."""
+        if barcode in self.barcodes:
+            self.barcodes[barcode] += packedreads
+        else:
+            self.barcodes[barcode] = bytearray(packedreads)
+            self.nbytes += self.BARCODE_BYTES
+        self.nbytes += self.READ_BYTES + len(packedreads)
+        if self.nbytes > self.maxbytes:
+            self.spill()
+
+    def spill(self):
+        """Writes reads in memory to a new run sorted by barcode."""
+        if not self.barcodes:
+            return
+        (fd, runfile) = tempfile.mkstemp(dir=self.tmpdir, suffix='.pickle')
+        with os.fdopen(fd, 'wb') as f:
+            for bc in sorted(self.barcodes):
+                pickle.dump((bc, self.barcodes[bc]), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        self.runfiles.append(runfile)
+        self.barcodes = {}
+        self.nbytes = 0
+
+    def items(self):
+        """Iterates over `(barcode, packedreads)`.
+
+        Barcodes are in sorted order, and the reads for each barcode
+        are in the order they were added.
+        """
+        runs = [self._iterRun(f) for f in self.runfiles]
+        runs.append((bc, self.barcodes[bc]) for bc in sorted(self.barcodes))
+        for (bc, bcreads) in itertools.groupby(
+                heapq.merge(*runs, key=operator.itemgetter(0)),
+                key=operator.itemgetter(0)):
+            yield (bc, b''.join(tup[1] for tup in bcreads))
+
+    def cleanup(self):
+        """Removes the temporary files holding spilled runs."""
+        for runfile in self.runfiles:
+            if os.path.isfile(runfile):
+                os.remove(runfile)
+        self.runfiles = []
+
+    @staticmethod
+    def _iterRun(runfile):
+        """Iterates over `(barcode, packedreads)` in a spilled run."""
+        with open(runfile, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+
+
+def writeCheckpoint(checkpoint, state):
+    """Saves `state` to the file `checkpoint`.
+
+    The state is pickled to a temporary file that then replaces
+    `checkpoint`, so an interrupted write never leaves a partial file.
+
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     checkpoint = os.path.join(tmpdir, 'checkpoint.pickle')
+    ...     writeCheckpoint(checkpoint, {'nbarcodes':2})
+    ...     readCheckpoint(checkpoint)
+    {'nbarcodes': 2}
+    """
+    tmpfile = checkpoint + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpfile, checkpoint)
+
+
+def readCheckpoint(checkpoint):
+    """Returns the state saved by `writeCheckpoint` in `checkpoint`."""
+    with open(checkpoint, 'rb') as f:
+        return pickle.load(f)
+
+
+def fileSignatures(filenames):
+    """Identifies files by name, size, and modification time.
+
+    Used to check that input files are unchanged when resuming
+    from a checkpoint.
+
+    Args:
+        `filenames` (list)
+            Names of files.
+
+    Returns:
+        A list of tuples `(abspath, size, mtime)` for each file.
+    """
+    signatures = []
+    for f in filenames:
+        stat = os.stat(f)
+        signatures.append((os.path.abspath(f), stat.st_size,
+                           stat.st_mtime))
+    return signatures
+
+
+def initCounts(refseq, chartype):
+    """Initializes array of counts at each site of `refseq`.
+
+    Args:
+        `refseq` (str)
+            The reference sequence.
+        `chartype` (str)
+            Character type, currently must be 'codon'.
+
+    Returns:
+        An `int64` array with a row for each site and a column for
+        each character in the order of `CODONS`. This is incremented
+        in place by `utils.incrementCounts`, and converted to a data
+        frame by `countsToDataFrame`.
+
+    >>> counts = initCounts('ATGGGA', 'codon')
+    >>> counts.shape
+    (2, 64)
+    >>> counts.dtype
+    dtype('int64')
+    """
+    if chartype == 'codon':
+        return numpy.zeros((len(refseq) // 3, len(CODONS)), dtype='int64')
+    else:
+        raise ValueError("Invalid chartype")
+
+
+def countsToDataFrame(counts, refseq, chartype):
+    """Converts counts from `initCounts` to a data frame.
+
+    Args:
+        `counts` (`numpy.ndarray`)
+            Counts in the format returned by `initCounts`.
+        `refseq` (str)
+            The reference sequence.
+        `chartype` (str)
+            Character type, currently must be 'codon'.
+
+    Returns:
+        A `pandas.DataFrame` indexed by `site` with columns
+        `wildtype` and each character, as written to the
+        ``_codoncounts.csv`` file by ``dms2_bcsubamp``.
+
+    >>> counts = initCounts('ATGGGA', 'codon')
+    >>> dms_tools2.utils.incrementCounts(4, 'GGC', 'codon', counts)
+    >>> df = countsToDataFrame(counts, 'ATGGGA', 'codon')
+    >>> df.index.tolist(), df['wildtype'].tolist(), df['GGC'].tolist()
+    ([1, 2], ['ATG', 'GGA'], [0, 1])
+    """
+    if chartype == 'codon':
+        nsites = len(refseq) // 3
+        assert counts.shape == (nsites, len(CODONS))
+        df = pandas.DataFrame(counts, columns=CODONS,
+                index=pandas.Index(range(1, nsites + 1), name='site'))
+        df.insert(0, 'wildtype', [refseq[3 * i : 3 * i + 3]
+                for i in range(nsites)])
+        return df
+    else:
+        raise ValueError("Invalid chartype")
+
+
+def alignBarcodes(barcodes, refseq, alignspecs, trims, *, minreads,
+        minconcur, maxmuts, chartype, purgebc=0, seed=1, bcinfo=None,
+        checkpoint=None, checkpoint_interval=600):
+    """Builds and aligns subamplicons for reads grouped by barcode.
+
+    Args:
+        `barcodes` (dict or `SpilledBarcodes`)
+            Keyed by barcodes encoded by `dms_tools2.utils.encodeBarcodes`,
+            values are the R1 / R2 pairs of reads for that barcode
+            (with the barcodes already trimmed) as packed by
+            `dms_tools2.utils.packReadArrays`.
+        `refseq` (str)
+            Sequence to which we align.
+        `alignspecs` (list)
+            List of `(refseqstart, refseqend, r1start, r2start, maxN)`
+            with `r1start` and `r2start` adjusted for barcode trimming.
+        `trims` (list)
+            List of `(r1trim, r2trim)` for each entry in `alignspecs`.
+        `minreads`, `minconcur`, `maxmuts`, `chartype`
+            Meaning as for ``dms2_bcsubamp``.
+        `purgebc` (float)
+            Purge each barcode with this probability. Whether a barcode
+            is purged depends only on its sequence and `seed`, so the
+            same barcodes are purged however the barcodes are split
+            into shards.
+        `seed` (int)
+            Random number seed for `purgebc`.
+        `bcinfo` (str or `None`)
+            If a filename, write gzipped information on each barcode
+            here in the format returned by `bcInfo`.
+        `checkpoint` (str or `None`)
+            If a filename, save progress here every `checkpoint_interval`
+            seconds and when done. If this file already exists, resume
+            from it, skipping the barcodes it has already processed.
+            The barcodes must be iterated in the same order as before.
+        `checkpoint_interval` (int or float)
+            Seconds between checkpoints.
+
+    Returns:
+        The 3-tuple `(counts, nbcs, readsperbc)` where `counts`
+        is an array as returned by `initCounts` with the counts from
+        the aligned barcodes, `nbcs` is a dict with the number of
+        barcodes with each fate, and `readsperbc` is a dict keyed
+        by number of reads with values the number of barcodes
+        with that many reads.
+    """
+    if checkpoint and os.path.isfile(checkpoint):
+        state = readCheckpoint(checkpoint)
+        if state['done']:
+            return state['results']
+        (counts, nbcs, readsperbc) = state['results']
+        nskip = state['nbarcodes']
+        if bcinfo:
+            # discard anything written after the checkpoint
+            with open(bcinfo, 'r+b') as f:
+                f.truncate(state['bcinfosize'])
+            bcinfofile = gzip.open(bcinfo, 'at')
+    else:
+        counts = initCounts(refseq, chartype)
+        nbcs = {
+                'total':0,
+                'too few reads':0,
+                'not alignable':0,
+                'aligned':0,
+               }
+        if purgebc:
+            nbcs['purged'] = 0
+        readsperbc = {}
+        nskip = 0
+        if bcinfo:
+            bcinfofile = gzip.open(bcinfo, 'wt')
+    lastcheckpoint = time.time()
+
+    try:
+        for (ibc, (bc, packedreads)) in enumerate(itertools.islice(
+                barcodes.items(), nskip, None), start=nskip):
+
+            if checkpoint and (time.time() - lastcheckpoint >=
+                    checkpoint_interval):
+                if bcinfo:
+                    # close gzip member so file can be truncated here
+                    bcinfofile.close()
+                    bcinfofile = gzip.open(bcinfo, 'at')
+                writeCheckpoint(checkpoint, {
+                        'done':False,
+                        'nbarcodes':ibc,
+                        'results':(counts, nbcs, readsperbc),
+                        'bcinfosize':(os.path.getsize(bcinfo) if bcinfo
+                                      else None),
+                        })
+                lastcheckpoint = time.time()
+
+            result = alignBarcode(bc, packedreads, refseq, alignspecs,
+                    trims, minreads=minreads, minconcur=minconcur,
+                    maxmuts=maxmuts, chartype=chartype, purgebc=purgebc,
+                    seed=seed, counts=counts, keepsubamplicon=bool(bcinfo))
+            addBarcodeResult(result, None, nbcs, readsperbc, chartype)
+            if bcinfo:
+                writeBarcodeInfo(bcinfofile, bc, packedreads, result)
+    finally:
+        if bcinfo:
+            bcinfofile.close()
+
+    if checkpoint:
+        writeCheckpoint(checkpoint, {'done':True,
+                'results':(counts, nbcs, readsperbc)})
+
+    return (counts, nbcs, readsperbc)
+
+
+def alignBarcode(bc, packedreads, refseq, alignspecs, trims, *, minreads,
+        minconcur, maxmuts, chartype, purgebc=0, seed=1, counts=None,
+        keepsubamplicon=True):
+    """Builds and aligns the subamplicon for a single barcode.
+
+    The consensus of the R1 and R2 reads, the alignment for each of
+    `alignspecs`, and the increment of `counts` are all done in one
+    call to compiled code.
+
+    Args:
+        `bc` (int)
+            Barcode encoded by `dms_tools2.utils.encodeBarcodes`.
+        `packedreads` (bytes)
+            R1 / R2 pairs of reads for the barcode packed by
+            `dms_tools2.utils.packReadArrays`.
+        `refseq`, `alignspecs`, `trims`, `minreads`, `minconcur`,
+        `maxmuts`, `chartype`, `purgebc`, `seed`
+            Meaning as for `alignBarcodes`.
+        `counts` (`numpy.ndarray` or `None`)
+            If an array returned by `initCounts`, an aligned subamplicon
+            is counted here, so `addBarcodeResult` should then be called
+            with `counts` of `None`.
+        `keepsubamplicon` (bool)
+            Return the subamplicon for aligned barcodes. If `False`,
+            `subamplicon` is `None` for all barcodes, which saves
+            building a string when it is only needed for `counts`.
+
+    Returns:
+        The 4-tuple `(nreads, fate, refseqstart, subamplicon)` where
+        `nreads` is the number of read pairs, `fate` is 'purged' or
+        one of `BARCODE_FATES`, and `refseqstart` and `subamplicon`
+        give the alignment for aligned barcodes and are `None`
+        otherwise.
+
+    >>> refseq = 'ATGGACTTCGGG'
+    >>> reads = [refseq, dms_tools2.utils.reverseComplement(refseq)]
+    >>> packedreads = dms_tools2.utils.packReads(reads * 2)
+    >>> kwargs = dict(minreads=2, minconcur=0.75, maxmuts=4,
+    ...         chartype='codon')
+    >>> alignBarcode(0, packedreads, refseq, [(1, 12, 1, 1, 1)],
+    ...         [(None, None)], **kwargs)
+    (2, 'aligned', 1, 'ATGGACTTCGGG')
+    >>> alignBarcode(0, packedreads[ : len(packedreads) // 2], refseq,
+    ...         [(1, 12, 1, 1, 1)], [(None, None)], **kwargs)
+    (1, 'too few reads', None, None)
+    >>> counts = initCounts(refseq, 'codon')
+    >>> alignBarcode(0, packedreads, refseq, [(1, 12, 4, 1, 1),
+    ...         (1, 12, 1, 1, 1)], [(None, None)] * 2, counts=counts,
+    ...         keepsubamplicon=False, **kwargs)
+    (2, 'aligned', 1, None)
+    >>> int(counts.sum())
+    4
+    """
+    if chartype != 'codon':
+        raise ValueError("Invalid chartype")
+
+    if purgebc and (random.Random('{0}-{1}'.format(seed,
+            dms_tools2.utils.decodeBarcode(bc))).random() < purgebc):
+        nreads = dms_tools2.utils.countPackedReads(packedreads)
+        assert nreads % 2 == 0, "reads not in R1 / R2 pairs"
+        return (nreads // 2, 'purged', None, None)
+
+    (nreads, fate, refseqstart, subamplicon) = \
+            dms_tools2._cutils.alignBarcode(packedreads, refseq,
+            alignspecs, trims, minreads, minconcur, maxmuts, counts,
+            keepsubamplicon)
+    return (nreads, BARCODE_FATES[fate], refseqstart, subamplicon)
+
+
+def addBarcodeResult(result, counts, nbcs, readsperbc, chartype,
+        increment=1):
+    """Adds result of `alignBarcode` to the totals.
+
+    Args:
+        `result` (tuple)
+            Tuple returned by `alignBarcode`.
+        `counts`, `nbcs`, `readsperbc`
+            Totals in the format returned by `alignBarcodes`, which
+            are updated by this function. `counts` is `None` if the
+            result was already counted by `alignBarcode`.
+        `chartype` (str)
+            Character type of `counts`.
+        `increment` (int)
+            Use -1 to remove a result that was previously added.
+
+    >>> counts = initCounts('ATGGGA', 'codon')
+    >>> nbcs = {'total':0, 'aligned':0}
+    >>> readsperbc = {}
+    >>> result = (3, 'aligned', 4, 'GGC')
+    >>> addBarcodeResult(result, counts, nbcs, readsperbc, 'codon')
+    >>> counts[:, CODONS.index('GGC')].tolist(), nbcs['aligned'], readsperbc
+    ([0, 1], 1, {3: 1})
+    >>> addBarcodeResult(result, counts, nbcs, readsperbc, 'codon', -1)
+    >>> counts[:, CODONS.index('GGC')].tolist(), nbcs['aligned'], readsperbc
+    ([0, 0], 0, {})
+    """
+    (nreads, fate, refseqstart, subamplicon) = result
+    nbcs['total'] += increment
+    nbcs[fate] += increment
+    readsperbc[nreads] = readsperbc.get(nreads, 0) + increment
+    if not readsperbc[nreads]:
+        del readsperbc[nreads]
+    if fate == 'aligned' and counts is not None:
+        dms_tools2.utils.incrementCounts(refseqstart, subamplicon,
+                chartype, counts, increment=increment)
+
+
+def writeBarcodeInfo(bcinfofile, bc, packedreads, result):
+    """Writes information on a barcode to `bcinfofile`.
+
+    Args:
+        `bcinfofile` (file-like object)
+            Information in the format returned by `bcInfo` is written
+            here, unless the barcode was purged.
+        `bc`, `packedreads`
+            Barcode and reads passed to `alignBarcode`.
+        `result` (tuple)
+            Tuple returned by `alignBarcode`.
+    """
+    (nreads, fate, refseqstart, subamplicon) = result
+    if fate == 'purged':
+        return
+    bc = dms_tools2.utils.decodeBarcode(bc)
+    bcreads = {'R1':dms_tools2.utils.unpackReads(packedreads, 0, 2),
+               'R2':dms_tools2.utils.unpackReads(packedreads, 1, 2)}
+    if fate == 'aligned':
+        bcinfofile.write(bcInfo(bc, bcreads, retained=True,
+                consensus=subamplicon, desc='aligned at position {0}'
+                .format(refseqstart)))
+    elif fate == 'too few reads':
+        bcinfofile.write(bcInfo(bc, bcreads, retained=False,
+                consensus=None, desc='too few reads'))
+    else:
+        bcinfofile.write(bcInfo(bc, bcreads, retained=False,
+                consensus=None, desc='could not align'))
+
+
+def sumAlignedBarcodes(results):
+    """Sums results of `alignBarcodes` over several shards.
+
+    Args:
+        `results` (list)
+            List of 3-tuples returned by `alignBarcodes`.
+
+    Returns:
+        A 3-tuple `(counts, nbcs, readsperbc)` like that returned
+        by `alignBarcodes`, but summed over all of `results`.
+
+    >>> r1 = (numpy.array([[1, 0]]), {'total':2, 'aligned':1}, {1:1, 2:1})
+    >>> r2 = (numpy.array([[2, 1]]), {'total':1, 'aligned':1}, {2:1})
+    >>> (counts, nbcs, readsperbc) = sumAlignedBarcodes([r1, r2])
+    >>> counts
+    array([[3, 1]])
+    >>> nbcs == {'total':3, 'aligned':2}
+    True
+    >>> readsperbc == {1:1, 2:2}
+    True
+    """
+    (counts, nbcs, readsperbc) = results[0]
+    counts = counts.copy()
+    nbcs = dict(nbcs)
+    readsperbc = dict(readsperbc)
+    for (icounts, inbcs, ireadsperbc) in results[1 : ]:
+        counts += icounts
+        for (key, val) in inbcs.items():
+            nbcs[key] += val
+        for (key, val) in ireadsperbc.items():
+            readsperbc[key] = readsperbc.get(key, 0) + val
+    return (counts, nbcs, readsperbc)
+
+
+def alignBarcodeShards(shards, refseq, alignspecs, trims, *, ncpus=1,
+        bcinfo=None, checkpoint=None, **kwargs):
+    """Runs `alignBarcodes` on barcode shards, possibly in parallel.
+
+    Args:
+        `shards` (list)
+            List of barcode dicts or `SpilledBarcodes` as passed to
+            `alignBarcodes`. Each barcode should be in only one shard,
+            such as by assigning shards with `barcodeShard`.
+        `refseq`, `alignspecs`, `trims`
+            Passed to `alignBarcodes`.
+        `ncpus` (int)
+            Number of processes over which the shards are spread. Each
+            `SpilledBarcodes` shard first spills its reads that are
+            still in memory, so that the processes read their shards
+            from disk rather than receiving the reads from this one.
+            Dict shards are sent to the processes, so their reads are
+            held in both this process and the one aligning them.
+        `bcinfo` (str or `None`)
+            If a filename, per-barcode information for all shards is
+            written to this gzipped file.
+        `checkpoint` (str or `None`)
+            If a filename, each shard is checkpointed as described for
+            `alignBarcodes` to a file with this name suffixed by
+            ``.shard`` and the shard number, and resumed if that file
+            exists. Per-shard `bcinfo` files are also kept next to these
+            files. The caller removes all of them once done.
+        `kwargs`
+            Other keyword arguments for `alignBarcodes`.
+
+    Returns:
+        The summed results as returned by `sumAlignedBarcodes`.
+    """
+    if checkpoint:
+        shardcheckpoints = ['{0}.shard{1}'.format(checkpoint, i)
+                for i in range(len(shards))]
+    else:
+        shardcheckpoints = [None] * len(shards)
+    shardfiles = bcinfo and (len(shards) > 1 or checkpoint)
+    if shardfiles and checkpoint:
+        # kept with checkpoints until the caller removes them
+        shardinfo = [f + '.bcinfo.txt.gz' for f in shardcheckpoints]
+    elif shardfiles:
+        shardinfo = ['{0}.shard{1}'.format(bcinfo, i)
+                for i in range(len(shards))]
+    else:
+        shardinfo = [bcinfo] * len(shards)
+    func = functools.partial(_alignBarcodesShard, refseq=refseq,
+            alignspecs=alignspecs, trims=trims, **kwargs)
+    shard_tups = list(zip(shards, shardinfo, shardcheckpoints))
+    if ncpus > 1 and len(shards) > 1:
+        for shard in shards:
+            if isinstance(shard, SpilledBarcodes):
+                # now only the names of its run files are sent
+                shard.spill()
+        with dms_tools2.batch.Pool(min(ncpus, len(shards))) as pool:
+            results = pool.map(func, shard_tups, chunksize=1)
+    else:
+        results = list(map(func, shard_tups))
+    if shardfiles:
+        # gzip allows concatenated members in one file
+        with open(bcinfo, 'wb') as fout:
+            for f in shardinfo:
+                with open(f, 'rb') as fin:
+                    shutil.copyfileobj(fin, fout)
+        if not checkpoint:
+            for f in shardinfo:
+                os.remove(f)
+    return sumAlignedBarcodes(results)
+
+
+def _alignBarcodesShard(shard_tup, refseq, alignspecs, trims, **kwargs):
+    """Calls `alignBarcodes` on `(barcodes, bcinfo, checkpoint)`."""
+    (barcodes, bcinfo, checkpoint) = shard_tup
+    return alignBarcodes(barcodes, refseq, alignspecs, trims,
+            bcinfo=bcinfo, checkpoint=checkpoint, **kwargs)
+
+
+class BarcodeState:
+    """Reads and results for each barcode, persisted to add new lanes.
+
+    Sequencing of a sample often arrives in several lanes. This class
+    stores the packed reads for each barcode along with the result of
+    building and aligning its subamplicon in an SQLite database. When
+    reads from a new lane are added with `update`, only barcodes that
+    gain reads are rebuilt, and their old results are subtracted from
+    the totals before the new results are added. So the cost of adding
+    a lane scales with the new reads rather than all reads for the
+    sample. The database is only changed when `update` succeeds.
+
+    Args:
+        `statefile` (str)
+            The SQLite database. Created if it does not exist.
+        `refseq`, `alignspecs`, `trims`, `minreads`, `minconcur`,
+        `maxmuts`, `chartype`, `purgebc`, `seed`
+            Meaning as for `alignBarcodes`.
+        `settings` (dict)
+            Any other settings that must be the same for all lanes,
+            such as those used to parse the reads.
+
+    It is an error to open an existing `statefile` with different
+    settings.
+
+    Attributes:
+        `lanes` (list)
+            Signatures of the FASTQ files that have been added as
+            returned by `fileSignatures`.
+        `nreads` (dict)
+            Number of reads with each fate summed over all lanes.
+        `counts`, `nbcs`, `readsperbc`
+            Totals over all barcodes as returned by `alignBarcodes`.
+
+    >>> refseq = 'ATGGACTTCGGG'
+    >>> bc = dms_tools2.utils.encodeBarcodes(
+    ...         dms_tools2.utils.readsToArray(['ACGT']))[0].tolist()[0]
+    >>> def lane(r1s):
+    ...     return {bc:b''.join(dms_tools2.utils.packReadArrays(
+    ...             dms_tools2.utils.readsToArray(r1s),
+    ...             dms_tools2.utils.readsToArray(
+    ...             [dms_tools2.utils.reverseComplement(r) for r in r1s])))}
+    >>> kwargs = dict(refseq=refseq, alignspecs=[(1, 12, 1, 1, 1)],
+    ...         trims=[(None, None)], minreads=2, minconcur=0.75,
+    ...         maxmuts=4, chartype='codon')
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     statefile = os.path.join(tmpdir, 'state.sqlite')
+    ...     state = BarcodeState(statefile, **kwargs)
+    ...     state.update([lane([refseq])], lanes=[('lane1',)],
+    ...             nreads={'total':1})
+    ...     state.close()
+    ...     print(state.nbcs['too few reads'], state.nbcs['aligned'])
+    ...     state = BarcodeState(statefile, **kwargs)
+    ...     state.update([lane([refseq])], lanes=[('lane2',)],
+    ...             nreads={'total':1})
+    ...     state.close()
+    ...     print(state.nbcs['too few reads'], state.nbcs['aligned'])
+    ...     print(state.counts[0, CODONS.index('ATG')], state.nreads,
+    ...           state.readsperbc)
+    1 0
+    0 1
+    1 {'total': 2} {2: 1}
+    """
+
+    def __init__(self, statefile, refseq, alignspecs, trims, *, minreads,
+            minconcur, maxmuts, chartype, purgebc=0, seed=1,
+            settings=None):
+        """See main class doc string."""
+        self.statefile = statefile
+        self.refseq = refseq
+        self.alignspecs = alignspecs
+        self.trims = trims
+        self.alignkwargs = {'minreads':minreads, 'minconcur':minconcur,
+                'maxmuts':maxmuts, 'chartype':chartype, 'purgebc':purgebc,
+                'seed':seed}
+        self.chartype = chartype
+        allsettings = {'version':dms_tools2.__version__, 'refseq':refseq,
+                'alignspecs':[tuple(a) for a in alignspecs],
+                'trims':[tuple(t) for t in trims],
+                'settings':settings or {}}
+        allsettings.update(self.alignkwargs)
+        self.db = sqlite3.connect(statefile)
+        self.db.execute('CREATE TABLE IF NOT EXISTS info '
+                '(key TEXT PRIMARY KEY, value BLOB)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS barcodes '
+                '(barcode BLOB PRIMARY KEY, reads BLOB, result BLOB)')
+        info = dict((key, pickle.loads(value)) for (key, value) in
+                self.db.execute('SELECT key, value FROM info'))
+        if info:
+            diffs = [key for key in set(info['settings']) | set(allsettings)
+                    if info['settings'].get(key) != allsettings.get(key)]
+            if diffs:
+                self.db.close()
+                raise ValueError("{0} has different settings for: {1}"
+                        .format(statefile, ', '.join(sorted(diffs))))
+            (self.lanes, self.nreads, self.counts, self.nbcs,
+                    self.readsperbc) = info['totals']
+        else:
+            self.lanes = []
+            self.nreads = {}
+            self.counts = initCounts(refseq, chartype)
+            self.nbcs = {'total':0, 'too few reads':0,
+                    'not alignable':0, 'aligned':0}
+            if purgebc:
+                self.nbcs['purged'] = 0
+            self.readsperbc = {}
+            with self.db:
+                self.db.execute('INSERT INTO info VALUES (?, ?)',
+                        ('settings', pickle.dumps(allsettings)))
+                self._saveTotals()
+
+    def update(self, shards, *, lanes, nreads, ncpus=1, bcinfo=None,
+            chunksize=10000):
+        """Adds reads from new lanes and updates the affected barcodes.
+
+        Args:
+            `shards` (list)
+                Reads for the new lanes grouped by barcode, as a list of
+                dicts or `SpilledBarcodes` like for `alignBarcodeShards`.
+            `lanes` (list)
+                Signatures of the FASTQ files for the new lanes. It is
+                an error if any have already been added.
+            `nreads` (dict)
+                Number of reads in the new lanes with each fate.
+            `ncpus` (int)
+                Number of CPUs used to build and align subamplicons.
+            `bcinfo` (str or `None`)
+                If a filename, write gzipped information on the barcodes
+                that gain reads in the format returned by `bcInfo`.
+            `chunksize` (int)
+                Number of barcodes updated at a time.
+        """
+        duplicated = [lane for lane in lanes if lane in self.lanes]
+        if duplicated:
+            raise ValueError("already added to {0}: {1}".format(
+                    self.statefile, duplicated))
+        # totals are only saved if all barcodes are updated
+        (lanes_orig, nreads_orig) = (list(self.lanes), dict(self.nreads))
+        totals_orig = pickle.dumps((self.counts, self.nbcs, self.readsperbc))
+        func = functools.partial(_alignBarcodeTup, refseq=self.refseq,
+                alignspecs=self.alignspecs, trims=self.trims,
+                **self.alignkwargs)
+        if bcinfo:
+            bcinfofile = gzip.open(bcinfo, 'wt')
+        pool = None
+        try:
+            if ncpus > 1:
+                pool = dms_tools2.batch.Pool(ncpus)
+            items = itertools.chain.from_iterable(
+                    shard.items() for shard in shards)
+            while True:
+                chunk = []
+                for (bc, packedreads) in itertools.islice(items, chunksize):
+                    key = _barcodeKey(bc)
+                    row = self.db.execute('SELECT reads, result FROM '
+                            'barcodes WHERE barcode = ?', (key,)).fetchone()
+                    if row:
+                        addBarcodeResult(pickle.loads(row[1]), self.counts,
+                                self.nbcs, self.readsperbc, self.chartype,
+                                increment=-1)
+                        packedreads = row[0] + packedreads
+                    chunk.append((bc, bytes(packedreads)))
+                if not chunk:
+                    break
+                if pool:
+                    results = pool.map(func, chunk,
+                            chunksize=max(1, len(chunk) // (4 * ncpus)))
+                else:
+                    results = list(map(func, chunk))
+                for ((bc, packedreads), result) in zip(chunk, results):
+                    addBarcodeResult(result, self.counts, self.nbcs,
+                            self.readsperbc, self.chartype)
+                    self.db.execute('INSERT OR REPLACE INTO barcodes '
+                            'VALUES (?, ?, ?)', (_barcodeKey(bc),
+                            packedreads, pickle.dumps(result)))
+                    if bcinfo:
+                        writeBarcodeInfo(bcinfofile, bc, packedreads, result)
+            self.lanes += lanes
+            for (key, val) in nreads.items():
+                self.nreads[key] = self.nreads.get(key, 0) + val
+            self._saveTotals()
+            self.db.commit()
+        except:
+            self.db.rollback()
+            (self.lanes, self.nreads) = (lanes_orig, nreads_orig)
+            (self.counts, self.nbcs, self.readsperbc) = pickle.loads(
+                    totals_orig)
+            raise
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+            if bcinfo:
+                bcinfofile.close()
+
+    def results(self):
+        """Returns `(counts, nbcs, readsperbc)` like `alignBarcodes`."""
+        return (self.counts, self.nbcs, self.readsperbc)
+
+    def close(self):
+        """Closes the database."""
+        self.db.close()
+
+    def _saveTotals(self):
+        """Saves totals to the database, without committing."""
+        self.db.execute('INSERT OR REPLACE INTO info VALUES (?, ?)',
+                ('totals', pickle.dumps((self.lanes, self.nreads,
+                self.counts, self.nbcs, self.readsperbc))))
+
+
+def _barcodeKey(bc):
+    """Key for encoded barcode `bc` in `BarcodeState` database."""
+    return bc.to_bytes((bc.bit_length() + 7) // 8, 'little')
+
+
+def _alignBarcodeTup(bc_tup, refseq, alignspecs, trims, **kwargs):
+    """Calls `alignBarcode` on `bc_tup` of `(bc, packedreads)`."""
+    (bc, packedreads) = bc_tup
+    return alignBarcode(bc, packedreads, refseq, alignspecs, trims,
+            **kwargs)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
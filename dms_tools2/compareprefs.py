@@ -17,6 +17,7 @@ import numpy
 import pandas
 
 import dms_tools2
+import dms_tools2.utils
 
 
 def divJensenShannon(p1, p2):
@@ -206,7 +207,7 @@ def comparePrefs(prefs1, prefs2, sites=None, distmetric='half_sum_abs_diff',
     expectcols = ['site'] + chars
     for (homolog, homologprefs) in enumerate([prefs1, prefs2], 1):
         for (rep, repprefs) in enumerate(homologprefs, 1):
-            iprefs = pandas.read_csv(repprefs)
+            iprefs = dms_tools2.utils.readTable(repprefs)
             iprefs['site'] = iprefs['site'].astype('str')
             assert set(iprefs.columns) <= set(expectcols), \
                     "{0} missing expected columns".format(repprefs)
@@ -9,11 +9,18 @@ Performs operations related to estimating differential selection.
 import os
 import io
 import tempfile
+import warnings
+import logging
+import traceback
+import collections
 
 import natsort
 import numpy
 import pandas
 from dms_tools2 import CODONS, CODON_TO_AA
+import dms_tools2.utils
+import dms_tools2.parseargs
+import dms_tools2.batch
 
 
 def tidyToWide(tidy_df, valuecol):
@@ -107,89 +114,223 @@ def computeMutDiffSel(sel, mock, countcharacters, pseudocount,
         A `pandas.DataFrame` with the mutation differential selection.
         Columns are `site`, `wildtype`, `mutation`, `mutdiffsel`.
     """
-    assert pseudocount > 0
+    return computeMutSelection([sel], mock, countcharacters, pseudocount,
+            translate_to_aa, err, mincount)[0]
+
+
+def computeMutSelection(sels, mock, countcharacters, pseudocount,
+        translate_to_aa, err=None, mincount=0, libfracsurvive=None,
+        aboveavg=False):
+    """Selection on mutations for several samples with the same mock.
+
+    Computes the mutation differential selection (as for
+    `computeMutDiffSel`) and optionally the fraction surviving (as for
+    `dms_tools2.fracsurvive.computeMutFracSurvive`) for many selected
+    samples that share a mock-selected and error-control sample. The
+    counts for the mock and error control are normalized just once,
+    and all selected samples are handled together as arrays.
+
+    Args:
+        `sels` (list)
+            `pandas.DataFrame` of counts for each selected sample.
+            Columns should be `site`, `wildtype`, and every
+            character in `countcharacters`.
+        `mock` (pandas.DataFrame)
+            Like each entry of `sels` but counts for mock-selected sample.
+        `countcharacters` (list)
+            List of all characters (e.g., codons).
+        `pseudocount` (int or float > 0)
+            Pseudocount to add to counts.
+        `translate_to_aa` (bool)
+            Should be `True` if counts are for codons and we are
+            estimating selection for amino acids, `False` otherwise.
+        `err` (pandas.DataFrame or `None`)
+            Optional error-control counts, in same format as `mock`.
+        `mincount` (int >= 0)
+            Report as `NaN` the selection for any mutation in which
+            neither the selected sample nor `mock` has at least this
+            many counts.
+        `libfracsurvive` (`None` or list)
+            To also compute the fraction surviving, the overall fraction
+            of each selected library that survives relative to `mock`.
+        `aboveavg` (bool)
+            Compute fraction surviving above the library average as
+            for `dms_tools2.fracsurvive.computeMutFracSurvive`.
 
-    expectedcols = set(['site', 'wildtype'] + countcharacters)
-    assert set(sel.columns) == expectedcols, "Invalid columns for sel"
-    assert set(mock.columns) == expectedcols, "Invalid columns for sel"
+    Returns:
+        A list with a `pandas.DataFrame` for each entry in `sels`.
+        Columns are `site`, `wildtype`, `mutation`, `mutdiffsel`, and
+        `mutfracsurvive` if `libfracsurvive` is not `None`.
+
+    >>> countchars = ['A', 'C', 'G', 'T']
+    >>> mock = pandas.DataFrame.from_records(
+    ...         [(1, 'A', 95, 95, 95, 95), (2, 'C', 195, 195, 95, 95)],
+    ...         columns=['site', 'wildtype', 'A', 'C', 'G', 'T'])
+    >>> sel1 = pandas.DataFrame.from_records(
+    ...         [(1, 'A', 390, 90, 90, 190), (2, 'C', 390, 190, 390, 190)],
+    ...         columns=['site', 'wildtype', 'A', 'C', 'G', 'T'])
+    >>> sel2 = sel1.assign(G=[190, 190])
+    >>> (sel1sel, sel2sel) = computeMutSelection([sel1, sel2], mock,
+    ...         countchars, 5, False, libfracsurvive=[0.1, 0.1])
+    >>> sel1sel.equals(computeMutDiffSel(sel1, mock, countchars, 5,
+    ...         False).assign(mutfracsurvive=sel1sel['mutfracsurvive']))
+    True
+    >>> numpy.allclose(sel1sel.query('site == 1')['mutfracsurvive'],
+    ...         [0.2, 0.05, 0.05, 0.1])
+    True
+    >>> all(sel1sel['mutdiffsel'] == sel2sel['mutdiffsel'])
+    False
+    """
+    assert pseudocount > 0
+    if libfracsurvive is not None:
+        assert len(libfracsurvive) == len(sels)
+        assert all([0 <= f <= 1 for f in libfracsurvive])
 
-    sel = sel.sort_values('site')
     mock = mock.sort_values('site')
-    assert all(sel['site'] == mock['site']), "Inconsistent sites"
-    assert all(sel['wildtype'] == mock['wildtype']), "Inconsistent wildtype"
+    _checkCounts(mock, mock, countcharacters, 'mock')
+
+    sels = [sel.sort_values('site') for sel in sels]
+    for sel in sels:
+        _checkCounts(sel, mock, countcharacters, 'sel')
 
     if err is not None:
-        assert (set(err.columns) == expectedcols), "Invalid columns for err"
         err = err.sort_values('site')
-        assert all(err['site'] == sel['site']), "Inconsistent sites"
-        assert all(err['wildtype'] == sel['wildtype']), "Inconsistent sites"
+        _checkCounts(err, mock, countcharacters, 'err')
+
+    # counts as aligned arrays of sites by characters, stacked
+    # for the selected samples so that mock and err are used once
+    chars = sorted(countcharacters)
+    sites = mock['site'].values
+    wts = mock['wildtype'].values
+    n = {'sel':numpy.array([sel[chars].values for sel in sels],
+            dtype='float')}
+    for (df, name) in [(mock, 'mock'), (err, 'err')]:
+        if df is not None:
+            n[name] = df[chars].values.astype('float')
+    N = dict([(name, _compensatedSum(ni)[..., None]) for (name, ni) in
+            n.items()])
+    iswt = numpy.asarray(wts)[:, None] == numpy.array(chars)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+
+        # error correction
+        if err is not None:
+            epsilon = n['err'] / N['err']
+            assert all(epsilon[iswt] > 0), "err counts of 0 for wildtype"
+            for name in ['sel', 'mock']:
+                n[name] = numpy.where(iswt,
+                        n[name] / numpy.where(iswt, epsilon, 1),
+                        numpy.maximum(0, N[name] * (n[name] / N[name]
+                        - epsilon)))
+                N[name] = _compensatedSum(n[name])[..., None]
+
+        # convert codon to amino acid counts
+        if translate_to_aa:
+            assert set(countcharacters) == set(CODONS),\
+                    "translate_to_aa specified, but not using codons"
+            aas = sorted(set(CODON_TO_AA.values()))
+            # index codons for each amino acid, padding with an extra
+            # all-NaN column so each amino acid has the same number
+            aacodons = [[i for (i, c) in enumerate(chars) if
+                    CODON_TO_AA[c] == aa] for aa in aas]
+            maxcodons = max(map(len, aacodons))
+            aacodons = numpy.array([icodons + [len(chars)] * (maxcodons -
+                    len(icodons)) for icodons in aacodons])
+            for name in ['sel', 'mock']:
+                n[name] = _compensatedSum(numpy.concatenate([n[name],
+                        numpy.full(n[name].shape[ : -1] + (1,), numpy.nan)],
+                        axis=-1)[..., aacodons])
+            chars = aas
+            wts = numpy.array([CODON_TO_AA[wt] for wt in wts], dtype='object')
+            iswt = wts[:, None] == numpy.array(chars)
+        assert all(iswt.sum(axis=1) == 1), "wildtype not in countcharacters"
+
+        # add pseudocounts
+        nP = {}
+        nP['sel'] = n['sel'] + pseudocount * numpy.maximum(1,
+                N['sel'] / N['mock'])
+        nP['mock'] = n['mock'] + pseudocount * numpy.maximum(1,
+                N['mock'] / N['sel'])
+        belowmincount = ~((n['sel'] >= mincount) | (n['mock'] >= mincount))
+
+        # compute mutdiffsel relative to wildtype counts
+        nPwt = dict([(name, numpy.where(iswt, nP[name], 0).sum(axis=-1,
+                keepdims=True)) for name in ['sel', 'mock']])
+        enrichment = ((nP['sel'] / nPwt['sel']) /
+                (nP['mock'] / nPwt['mock']))
+        enrichment[iswt | belowmincount] = numpy.nan
+        selection = {'mutdiffsel':numpy.log2(enrichment)}
+
+        # compute mutfracsurvive
+        if libfracsurvive is not None:
+            libfracsurvive = numpy.array(libfracsurvive)[:, None, None]
+            NselP = N['sel'] + pseudocount * numpy.maximum(1,
+                    N['sel'] / N['mock']) * len(countcharacters)
+            NmockP = N['mock'] + pseudocount * numpy.maximum(1,
+                    N['mock'] / N['sel']) * len(countcharacters)
+            selection['mutfracsurvive'] = (libfracsurvive *
+                    (nP['sel'] / NselP) / (nP['mock'] / NmockP))
+            selection['mutfracsurvive'][belowmincount] = numpy.nan
+            if aboveavg:
+                selection['mutfracsurvive'] = numpy.maximum(0,
+                        selection['mutfracsurvive'] - libfracsurvive)
+
+    return [pandas.DataFrame(dict([
+                ('site', numpy.repeat(sites, len(chars))),
+                ('wildtype', numpy.repeat(wts, len(chars))),
+                ('mutation', numpy.tile(chars, len(sites))),
+                ] + [(seltype, selection[seltype][i].ravel()) for seltype in
+                sorted(selection)])) for i in range(len(sels))]
+
+
+def _checkCounts(counts, mock, countcharacters, desc):
+    """Checks counts for `computeMutSelection`.
+
+    Asserts that data frame `counts` for the sample described by `desc`
+    has columns for the site, wildtype, and `countcharacters`, and the
+    same sites and wildtypes as `mock`. Both are sorted by site.
+    """
+    expectedcols = set(['site', 'wildtype'] + list(countcharacters))
+    assert set(counts.columns) == expectedcols, \
+            "Invalid columns for {0}".format(desc)
+    assert (len(counts) == len(mock) and
+            all(counts['site'].values == mock['site'].values)), \
+            "Inconsistent sites"
+    assert all(counts['wildtype'].values == mock['wildtype'].values), \
+            "Inconsistent wildtype"
 
-    # make melted dataframe for calculations
-    m = None    
-    for (df, name) in [(sel, 'sel'), (mock, 'mock'), (err, 'err')]:
-        if (name == 'err') and (err is None):
-            continue
-        m_name = (df.melt(id_vars=['site', 'wildtype'],
-                          var_name='mutation', value_name='n')
-                    .sort_values(['site', 'mutation'])
-                    .reset_index(drop=True)
-                    )
-        m_name['N'] = m_name.groupby('site').transform('sum')['n']
-        if m is None:
-            m = m_name[['site', 'wildtype', 'mutation']].copy()
-        assert all([all(m[c] == m_name[c]) for c in 
-                ['site', 'wildtype', 'mutation']])
-        m['n{0}'.format(name)] = m_name['n'].astype('float')
-        m['N{0}'.format(name)] = m_name['N'].astype('float')
-
-    # error correction 
-    if err is not None:
-        m['epsilon'] = m['nerr'] / m['Nerr']
-        wtmask = (m['mutation'] == m['wildtype'])
-        assert all(m[wtmask]['epsilon'] > 0), \
-                "err counts of 0 for wildtype"
-        for name in ['sel', 'mock']:
-            ncol = 'n{0}'.format(name)
-            Ncol = 'N{0}'.format(name)
-            # follow here to set wildtype values without zero division
-            wtval = pandas.Series(0, wtmask.index)
-            wtval.loc[wtmask] = m.loc[wtmask, ncol] / m.loc[wtmask, 'epsilon']
-            m[ncol] = numpy.maximum(0, 
-                    (m[Ncol] * (m[ncol] / m[Ncol] - m['epsilon']))
-                    ).where(~wtmask, wtval)
-            m[Ncol] = m.groupby('site').transform('sum')[ncol]
-        m = m.reset_index()
-   
-    # convert codon to amino acid counts
-    if translate_to_aa:
-        assert set(countcharacters) == set(CODONS),\
-                "translate_to_aa specified, but not using codons"
-        m = (m.replace({'wildtype':CODON_TO_AA, 'mutation':CODON_TO_AA})
-              .groupby(['site', 'wildtype', 'mutation', 'Nsel', 'Nmock'])
-              .sum()
-              .reset_index()
-              )
-
-    # add pseudocounts
-    m['nselP'] = m['nsel'] + pseudocount * numpy.maximum(1,
-            m['Nsel'] / m['Nmock'])
-    m['nmockP'] = m['nmock'] + pseudocount * numpy.maximum(1,
-            m['Nmock'] / m['Nsel'])
-
-    # create columns with wildtype counts
-    m = m.merge(
-            m.query('mutation==wildtype')[['site', 'nselP', 'nmockP']],
-            on='site', suffixes=('', 'wt'))
-
-    # compute mutdiffsel
-    m['enrichment'] = (
-            (m['nselP'] / m['nselPwt']) / (m['nmockP'] / m['nmockPwt'])
-            ).where((m['mutation'] != m['wildtype']) &
-                    ((m['nsel'] >= mincount) | (m['nmock'] >= mincount)),
-                    numpy.nan)
-    m['mutdiffsel'] = numpy.log2(m['enrichment'])
-
-    return m[['site', 'wildtype', 'mutation', 'mutdiffsel']]
+
+def _compensatedSum(x):
+    """Sum over last axis of `x` skipping `NaN` like `pandas` groupby.
+
+    Uses the same order and compensated (Kahan) summation as
+    `pandas.DataFrame.groupby` sums so results are identical.
+
+    >>> _compensatedSum(numpy.array([[0.1, 0.2, numpy.nan], [1, 2, 3]]))
+    array([0.3, 6. ])
+    """
+    total = numpy.zeros(x.shape[ : -1])
+    compensation = numpy.zeros(x.shape[ : -1])
+    for i in range(x.shape[-1]):
+        (total, compensation) = _compensatedAdd(total, compensation,
+                x[..., i])
+    return total
+
+
+def _compensatedAdd(total, compensation, x):
+    """Adds `x` to the compensated sum `total`, skipping `NaN`.
+
+    One step of `_compensatedSum`, so sums can also be accumulated
+    as values are read.
+
+    Returns:
+        The 2-tuple `(total, compensation)` after adding `x`.
+    """
+    y = x - compensation
+    t = total + y
+    isvalue = ~numpy.isnan(x)
+    return (numpy.where(isvalue, t, total),
+            numpy.where(isvalue, t - total - y, compensation))
 
 
 def mutToSiteDiffSel(mutdiffsel):
@@ -260,17 +401,111 @@ def mutToSiteDiffSel(mutdiffsel):
     return sitediffsel
 
 
+def avgMutSelection(selfiles, avgtype, selcol):
+    """Gets mean or median of a mutation selection across files.
+
+    The files are read one at a time and aligned on their `site`,
+    `wildtype`, and `mutation`. The mean is accumulated as a running
+    sum, and for the median just the `selcol` values of each file are
+    kept, so memory does not grow with the full tables. As for a
+    `pandas` groupby, `NaN` values are ignored, and the results are
+    the same.
+
+    Args:
+        `selfiles` (list)
+            Files with columns `site`, `wildtype`, `mutation`, and
+            `selcol`, read with `dms_tools2.utils.readTable`.
+        `avgtype` (str or list)
+            `mean` or `median`, or a list of these to get several
+            averages while reading the files only once.
+        `selcol` (str)
+            Column to average, such as `mutdiffsel`.
+
+    Returns:
+        A `pandas.DataFrame` with columns `site`, `wildtype`,
+        `mutation`, and `selcol` sorted from largest to smallest
+        `selcol`, or a list of these for each entry if `avgtype`
+        is a list.
+
+    >>> tf = tempfile.NamedTemporaryFile
+    >>> with tf(mode='w') as f1, tf(mode='w') as f2:
+    ...     x = f1.write('site,wildtype,mutation,s\\n'
+    ...                  '1,A,C,1.0\\n'
+    ...                  '2,G,T,NaN')
+    ...     f1.flush()
+    ...     x = f2.write('site,wildtype,mutation,s\\n'
+    ...                  '2,G,T,4.0\\n'
+    ...                  '1,A,C,2.0')
+    ...     f2.flush()
+    ...     (mean, median) = avgMutSelection([f1.name, f2.name],
+    ...             ['mean', 'median'], 's')
+    >>> mean
+       site wildtype mutation    s
+    0     2        G        T  4.0
+    1     1        A        C  1.5
+    >>> median.equals(mean)
+    True
+    """
+    avgtypes = [avgtype] if isinstance(avgtype, str) else list(avgtype)
+    for a in avgtypes:
+        if a not in ['mean', 'median']:
+            raise ValueError("invalid avgtype {0}".format(a))
+    assert len(selfiles) >= 1, "no files to average"
+    keycols = ['site', 'wildtype', 'mutation']
+    muts = None
+    values = []
+    for f in selfiles:
+        df = dms_tools2.utils.readTable(f)[keycols + [selcol]].sort_values(
+                keycols)
+        if muts is None:
+            muts = df[keycols].reset_index(drop=True)
+            total = numpy.zeros(len(muts))
+            compensation = numpy.zeros(len(muts))
+            count = numpy.zeros(len(muts))
+        else:
+            assert len(df) == len(muts) and all([(df[c].values ==
+                    muts[c].values).all() for c in keycols]), \
+                    "files do not have same muts"
+        x = df[selcol].values.astype('float')
+        (total, compensation) = _compensatedAdd(total, compensation, x)
+        count += ~numpy.isnan(x)
+        if 'median' in avgtypes:
+            values.append(x)
+
+    avgs = []
+    for a in avgtypes:
+        with warnings.catch_warnings(), numpy.errstate(invalid='ignore'):
+            # muts with no values have averages of `NaN`
+            warnings.simplefilter('ignore', RuntimeWarning)
+            if a == 'mean':
+                avg = total / count
+            else:
+                avg = numpy.nanmedian(numpy.array(values), axis=0)
+        avgs.append(muts.assign(**{selcol:avg})
+                        .sort_values(selcol, ascending=False)
+                        .reset_index(drop=True)
+                        )
+    if isinstance(avgtype, str):
+        return avgs[0]
+    else:
+        return avgs
+
+
 def avgMutDiffSel(mutdiffselfiles, avgtype):
     """Gets mean or median mutation differential selection.
 
+    Calls `avgMutSelection` on the `mutdiffsel` column.
+
     Args:
         `mutdiffselfiles` (list)
             List of CSV files with mutdiffsel as returned by
             ``dms2_diffsel``.
-        `avgtype` (str)
+        `avgtype` (str or list)
             Type of "average" to calculate. Possibilities:
                 - `mean`
                 - `median`
+            Or a list of these, in which case a list of data
+            frames is returned.
 
     Returns:
         A `pandas.DataFrame` containing the mean or median
@@ -309,28 +544,7 @@ def avgMutDiffSel(mutdiffselfiles, avgtype):
     >>> numpy.allclose(median['mutdiffsel'], [6.3, 0.0])
     True
     """
-    diffsels = []
-    cols = ['site', 'wildtype', 'mutation', 'mutdiffsel']
-    for f in mutdiffselfiles:
-        diffsels.append(pandas.read_csv(f)
-                        [cols]
-                        .sort_values(['site', 'wildtype', 'mutation'])
-                        .reset_index()
-                        )
-        assert all([(diffsels[0][c] == diffsels[-1][c]).all() for c in
-                ['site', 'wildtype', 'mutation']]), "files do not have same muts" 
-    avg = pandas.concat(diffsels).groupby(cols[ : -1])
-    if avgtype == 'mean':
-        avg = avg.mean()
-    elif avgtype == 'median':
-        avg = avg.median()
-    else:
-        raise ValueError("invalid avgtype {0}".format(avgtype))
-    return (avg.reset_index()
-               .sort_values('mutdiffsel', ascending=False)
-               [cols]
-               .reset_index(drop=True)
-               )
+    return avgMutSelection(mutdiffselfiles, avgtype, 'mutdiffsel')
 
 
 def df_read_filecols(df, filecols, *, order_sites=True):
@@ -435,7 +649,7 @@ def df_read_filecols(df, filecols, *, order_sites=True):
         row_df = row[1].to_frame().transpose().assign(dummy=1)
         for col in filecols:
             filename = row_df.at[row[0], col]
-            file_df = pandas.read_csv(filename).assign(dummy=1)
+            file_df = dms_tools2.utils.readTable(filename).assign(dummy=1)
             if order_sites and 'site' not in file_df.columns:
                 raise ValueError(f"no `site` column in {filename}")
             sharedcols = set(file_df.columns).intersection(df_cols)
@@ -463,6 +677,230 @@ def df_read_filecols(df, filecols, *, order_sites=True):
 
 
 
+def runMutSelection(sampleargs, seltype='diffsel', prog=None):
+    """Runs ``dms2_diffsel`` or ``dms2_fracsurvive`` on one or more samples.
+
+    Each sample gets the same log, selection table, and manifest files
+    as when ``dms2_diffsel`` or ``dms2_fracsurvive`` is run on it alone,
+    but the selection of all samples with the same mock and error
+    control is computed together with `computeMutSelection`. This is
+    used by both the single-sample and batch programs.
+
+    Args:
+        `sampleargs` (list)
+            For each sample, a dict of the arguments of ``dms2_diffsel``
+            or ``dms2_fracsurvive`` like those parsed from its command line.
+        `seltype` (str)
+            Either ``diffsel`` or ``fracsurvive``.
+        `prog` (str or `None`)
+            Name of the program in the log files, by default ``dms2_``
+            followed by `seltype`.
+
+    Returns:
+        A list with an entry for each sample that is `None` if the
+        selection was written or already up to date, or a str
+        describing the error otherwise.
+    """
+    if seltype == 'diffsel':
+        mutToSite = mutToSiteDiffSel
+        (sitecol, sitedesc) = ('abs_diffsel', 'absolute sitediffsel')
+        mutdesc = 'mutdiffsel'
+    elif seltype == 'fracsurvive':
+        # imported here as `dms_tools2.fracsurvive` imports this module
+        from dms_tools2.fracsurvive import mutToSiteFracSurvive as mutToSite
+        (sitecol, sitedesc) = ('avgfracsurvive', 'avgfracsurvive')
+        mutdesc = 'fracsurvive for each mutation'
+    else:
+        raise ValueError("Invalid seltype {0}".format(seltype))
+    if prog is None:
+        prog = 'dms2_{0}'.format(seltype)
+    (mutcol, sitetable) = ('mut' + seltype, 'site' + seltype)
+    errors = [None] * len(sampleargs)
+    runs = {}
+    closedlogs = {}
+    groups = collections.OrderedDict()
+
+    def closeLog(i):
+        """Closes the log of sample `i`, returns its closed handlers."""
+        logger = runs[i][0]
+        handlers = list(logger.handlers)
+        for handler in handlers:
+            logger.removeHandler(handler)
+            handler.close()
+        return handlers
+
+    def openLog(i):
+        """Re-opens the log of sample `i` if it was closed after setup."""
+        logger = runs[i][0]
+        for handler in closedlogs.pop(i, []):
+            reopened = logging.FileHandler(handler.baseFilename)
+            reopened.setFormatter(handler.formatter)
+            logger.addHandler(reopened)
+
+    def endRun(i, error=None):
+        """Finishes the log and removes outputs if there is `error`."""
+        openLog(i)
+        (logger, files, manifestargs) = runs[i]
+        if error:
+            errors[i] = error
+            logger.error('Terminating {0} with ERROR\n{1}'.format(prog,
+                    error))
+            for (fname, fpath) in files.items():
+                if fname != 'log' and os.path.isfile(fpath):
+                    logger.error("Deleting file {0}".format(fpath))
+                    os.remove(fpath)
+        else:
+            logger.info('Successful completion of {0}'.format(prog))
+        closeLog(i)
+        del runs[i]
+
+    for (i, args) in enumerate(sampleargs):
+        if args['outdir']:
+            if not os.path.isdir(args['outdir']):
+                os.mkdir(args['outdir'])
+        else:
+            args['outdir'] = ''
+        filesuffixes = {
+                'log':'.log',
+                'manifest':'_manifest.json',
+                mutcol:dms_tools2.utils.tableFile('_' + mutcol,
+                        args['outformat']),
+                sitetable:dms_tools2.utils.tableFile('_' + sitetable,
+                        args['outformat']),
+                }
+        files = dict([(f, os.path.join(args['outdir'], '{0}{1}'.format(
+                args['name'], s))) for (f, s) in filesuffixes.items()])
+        manifestargs = dict((arg, val) for (arg, val) in args.items()
+                if arg not in ['ncpus', 'use_existing'])
+        if args['use_existing'] == 'yes' and dms_tools2.utils.manifestMatches(
+                files['manifest'], manifestargs):
+            print("Output files are up to date with the inputs and "
+                  "arguments, and '--use_existing' is 'yes', so exiting "
+                  "with no further action.")
+            continue
+        logger = dms_tools2.utils.initLogger(files['log'], prog, args,
+                loggername='{0}_{1}'.format(prog, args['name']))
+        runs[i] = (logger, files, manifestargs)
+        try:
+            assert dms_tools2.parseargs.checkName(args['name'], 'name')
+            assert args['pseudocount'] > 0
+            for (ftype, f) in files.items():
+                if os.path.isfile(f) and ftype != 'log':
+                    logger.info("Removing existing file {0}".format(f))
+                    os.remove(f)
+            if args['chartype'] == 'codon_to_aa':
+                countcharacters = CODONS
+                translate_to_aa = True
+                countsuffix = '_codoncounts'
+            else:
+                raise ValueError("Bad chartype {0}".format(args['chartype']))
+            if seltype == 'fracsurvive':
+                libfracsurvive = args['libfracsurvive']
+                assert 0 <= libfracsurvive <= 1, \
+                        "`libfracsurvive` not in 0 to 1"
+            else:
+                libfracsurvive = None
+            if args['indir']:
+                assert os.path.isdir(args['indir']), "No --indir {0}".format(
+                        args['indir'])
+            indir = args['indir'] or ''
+            inputs = []
+            for (arg, desc) in [
+                    ('sel', 'selected sample'),
+                    ('mock', 'mock-selected sample'),
+                    ('err', 'error-control sample'),
+                    ]:
+                if arg == 'err' and not args['err']:
+                    continue
+                logger.info("Reading {0} counts from {1}".format(desc,
+                        args[arg]))
+                fname = dms_tools2.utils.findTableFile(os.path.join(
+                        indir, args[arg]), countsuffix)
+                if fname is None:
+                    raise ValueError("Missing file for --{0}:\n{1}".format(
+                            desc, os.path.join(indir, args[arg])))
+                inputs.append(fname)
+            # check counts now so a bad sample does not fail its group
+            counts = [dms_tools2.batch.readCSV(f).sort_values('site') for
+                    f in inputs]
+            for (c, desc) in zip(counts, ['sel', 'mock', 'err']):
+                _checkCounts(c, counts[1], countcharacters, desc)
+            logger.info("Computing {0}...".format(mutdesc))
+            aboveavg = False
+            if seltype == 'fracsurvive':
+                if args['aboveavg'] == 'yes':
+                    logger.info('These are the fracsurvive **above** the '
+                            'library average of {0}'.format(libfracsurvive))
+                    aboveavg = True
+                elif args['aboveavg'] != 'no':
+                    raise ValueError("Invalid aboveavg {0}".format(
+                            args['aboveavg']))
+            groups.setdefault((tuple(map(os.path.realpath, inputs[1 : ])),
+                    tuple(countcharacters), translate_to_aa,
+                    args['pseudocount'], args['mincount'], aboveavg),
+                    []).append((i, inputs, libfracsurvive))
+        except Exception:
+            endRun(i, traceback.format_exc())
+        else:
+            # so a large chunk of samples does not hold a file open each
+            closedlogs[i] = closeLog(i)
+
+    # compute selection for each group of samples with the same controls
+    for ((controls, countcharacters, translate_to_aa, pseudocount,
+            mincount, aboveavg), group) in groups.items():
+        try:
+            (mock, err) = (list(map(dms_tools2.batch.readCSV, controls))
+                    + [None])[ : 2]
+            mutsels = computeMutSelection([dms_tools2.batch.readCSV(
+                    inputs[0]) for (i, inputs, libfracsurvive) in group],
+                    mock, list(countcharacters), pseudocount,
+                    translate_to_aa, err, mincount, None if
+                    seltype == 'diffsel' else [libfracsurvive for (i,
+                    inputs, libfracsurvive) in group], aboveavg)
+        except Exception:
+            error = traceback.format_exc()
+            for (i, inputs, libfracsurvive) in group:
+                endRun(i, error)
+            continue
+        for ((i, inputs, libfracsurvive), mutsel) in zip(group, mutsels):
+            openLog(i)
+            (logger, files, manifestargs) = runs[i]
+            args = sampleargs[i]
+            try:
+                mutsel = mutsel[['site', 'wildtype', 'mutation', mutcol]]
+                if args['excludestop'] == 'yes':
+                    mutsel = mutsel.query(
+                            '(mutation != "*") & (wildtype != "*")')
+                mutsel = mutsel.sort_values(mutcol, ascending=False)
+                logger.info("Mutations with largest {0}:\n{1}\n".format(
+                        mutcol, mutsel.head(10).to_string(index=False,
+                        float_format='{:.2f}'.format)))
+                logger.info("Writing to {0}".format(files[mutcol]))
+                dms_tools2.utils.writeTable(mutsel, files[mutcol],
+                        na_rep='NaN')
+
+                logger.info("Computing {0}...".format(sitetable))
+                sitesel = mutToSite(mutsel).sort_values(sitecol,
+                        ascending=False)
+                logger.info("Sites with largest {0}:\n{1}\n".format(
+                        sitedesc, sitesel.head(10).to_string(index=False,
+                        float_format='{:.2f}'.format)))
+                logger.info("Writing to {0}".format(files[sitetable]))
+                dms_tools2.utils.writeTable(sitesel, files[sitetable],
+                        na_rep='NaN')
+
+                dms_tools2.utils.writeManifest(files['manifest'],
+                        manifestargs, inputs, [f for (ftype, f) in
+                        files.items() if ftype not in ['log', 'manifest']])
+            except Exception:
+                endRun(i, traceback.format_exc())
+            else:
+                endRun(i)
+
+    return errors
+
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
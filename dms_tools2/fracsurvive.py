@@ -11,7 +11,7 @@ import os
 import tempfile
 import numpy
 import pandas
-from dms_tools2 import CODONS, CODON_TO_AA
+import dms_tools2.diffsel
 
 
 def computeMutFracSurvive(libfracsurvive, sel, mock, countcharacters,
@@ -85,94 +85,10 @@ def computeMutFracSurvive(libfracsurvive, sel, mock, countcharacters,
     ...         ['mutfracsurvive'], [0.1, 0, 0, 0])
     True
     """
-    assert pseudocount > 0
-
-    assert 0 <= libfracsurvive <= 1
-
-    expectedcols = set(['site', 'wildtype'] + countcharacters)
-    assert set(sel.columns) == expectedcols, "Invalid columns for sel"
-    assert set(mock.columns) == expectedcols, "Invalid columns for sel"
-
-    sel = sel.sort_values('site')
-    mock = mock.sort_values('site')
-    assert all(sel['site'] == mock['site']), "Inconsistent sites"
-    assert all(sel['wildtype'] == mock['wildtype']), "Inconsistent wildtype"
-
-    if err is not None:
-        assert (set(err.columns) == expectedcols), "Invalid columns for err"
-        err = err.sort_values('site')
-        assert all(err['site'] == sel['site']), "Inconsistent sites"
-        assert all(err['wildtype'] == sel['wildtype']), "Inconsistent sites"
-
-    # make melted dataframe for calculations
-    m = None    
-    for (df, name) in [(sel, 'sel'), (mock, 'mock'), (err, 'err')]:
-        if (name == 'err') and (err is None):
-            continue
-        m_name = (df.melt(id_vars=['site', 'wildtype'],
-                          var_name='mutation', value_name='n')
-                    .sort_values(['site', 'mutation'])
-                    .reset_index(drop=True)
-                    )
-        m_name['N'] = m_name.groupby('site').transform('sum')['n']
-        if m is None:
-            m = m_name[['site', 'wildtype', 'mutation']].copy()
-        assert all([all(m[c] == m_name[c]) for c in 
-                ['site', 'wildtype', 'mutation']])
-        m['n{0}'.format(name)] = m_name['n'].astype('float')
-        m['N{0}'.format(name)] = m_name['N'].astype('float')
-
-    # error correction 
-    if err is not None:
-        m['epsilon'] = m['nerr'] / m['Nerr']
-        wtmask = m['mutation'] == m['wildtype']
-        assert all(m[wtmask]['epsilon'] > 0), \
-                "err counts of 0 for wildtype"
-        for name in ['sel', 'mock']:
-            ncol = 'n{0}'.format(name)
-            Ncol = 'N{0}'.format(name)
-            # follow here to set wildtype values without zero division
-            wtval = pandas.Series(0, wtmask.index)
-            wtval.loc[wtmask] = m.loc[wtmask, ncol] / m.loc[wtmask, 'epsilon']
-            m[ncol] = numpy.maximum(0, 
-                    (m[Ncol] * (m[ncol] / m[Ncol] - m['epsilon']))
-                    ).where(~wtmask, wtval)
-            m[Ncol] = m.groupby('site').transform('sum')[ncol]
-        m = m.reset_index()
-   
-    # convert codon to amino acid counts
-    if translate_to_aa:
-        assert set(countcharacters) == set(CODONS),\
-                "translate_to_aa specified, but not using codons"
-        m = (m.replace({'wildtype':CODON_TO_AA, 'mutation':CODON_TO_AA})
-              .groupby(['site', 'wildtype', 'mutation', 'Nsel', 'Nmock'])
-              .sum()
-              .reset_index()
-              )
-
-    # add pseudocounts
-    m['nselP'] = (m['nsel'] + pseudocount * numpy.maximum(1,
-            m['Nsel'] / m['Nmock']))
-    m['nmockP'] = (m['nmock'] + pseudocount * numpy.maximum(1,
-            m['Nmock'] / m['Nsel']))
-    m['NselP'] = (m['Nsel'] + pseudocount * numpy.maximum(1,
-            m['Nsel'] / m['Nmock']) * len(countcharacters))
-    m['NmockP'] = (m['Nmock'] + pseudocount * numpy.maximum(1,
-            m['Nmock'] / m['Nsel']) * len(countcharacters))
-
-    # compute mutfracsurvive
-    m['mutfracsurvive'] = (libfracsurvive *
-            (m['nselP'] / m['NselP']) / (m['nmockP'] / m['NmockP'])
-            ).where((m['nsel'] >= mincount) | (m['nmock'] >= mincount),
-                    numpy.nan)
-
-    if aboveavg:
-        m['mutfracsurvive'] = (
-                (m['mutfracsurvive'] - libfracsurvive)
-                .clip(lower=0)
-                )
-
-    return m[['site', 'wildtype', 'mutation', 'mutfracsurvive']]
+    return (dms_tools2.diffsel.computeMutSelection([sel], mock,
+            countcharacters, pseudocount, translate_to_aa, err, mincount,
+            [libfracsurvive], aboveavg)[0]
+            [['site', 'wildtype', 'mutation', 'mutfracsurvive']])
 
 
 def mutToSiteFracSurvive(mutfracsurvive):
@@ -235,16 +151,19 @@ def mutToSiteFracSurvive(mutfracsurvive):
 def avgMutFracSurvive(mutfracsurvivefiles, avgtype):
     """Gets mean or median mutation fraction surviving.
 
-    Typically used to get an average across replicates.
+    Typically used to get an average across replicates. Calls
+    `dms_tools2.diffsel.avgMutSelection` on the `mutfracsurvive` column.
 
     Args:
         `mutfracsurvivefiles` (list)
             List of CSV files with mutfracsurvivesel as returned by
             ``dms2_fracsurvive``.
-        `avgtype` (str)
+        `avgtype` (str or list)
             Type of "average" to calculate. Possibilities:
                 - `mean`
                 - `median`
+            Or a list of these, in which case a list of data
+            frames is returned.
 
     Returns:
         A `pandas.DataFrame` containing the mean or median
@@ -285,30 +204,8 @@ def avgMutFracSurvive(mutfracsurvivefiles, avgtype):
     >>> numpy.allclose(median['mutfracsurvive'], [0.9, 0.1])
     True
     """
-    fracsurvives = []
-    cols = ['site', 'wildtype', 'mutation', 'mutfracsurvive']
-    for f in mutfracsurvivefiles:
-        fracsurvives.append(
-                pandas.read_csv(f)
-                [cols]
-                .sort_values(['site', 'wildtype', 'mutation'])
-                .reset_index()
-                )
-        assert all([(fracsurvives[0][c] == fracsurvives[-1][c]).all()
-                for c in ['site', 'wildtype', 'mutation']]),\
-                "files do not have same muts" 
-    avg = pandas.concat(fracsurvives).groupby(cols[ : -1])
-    if avgtype == 'mean':
-        avg = avg.mean()
-    elif avgtype == 'median':
-        avg = avg.median()
-    else:
-        raise ValueError("invalid avgtype {0}".format(avgtype))
-    return (avg.reset_index()
-               .sort_values('mutfracsurvive', ascending=False)
-               [cols]
-               .reset_index(drop=True)
-               )
+    return dms_tools2.diffsel.avgMutSelection(mutfracsurvivefiles, avgtype,
+            'mutfracsurvive')
 
 
 if __name__ == '__main__':
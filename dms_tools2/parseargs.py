@@ -83,7 +83,9 @@ def parentParser():
 
     parser.add_argument('--use_existing', choices=['yes', 'no'],
             default='no', help=('If files with names of expected '
-            'output already exist, do not re-run.'))
+            'output already exist and are up to date with the inputs '
+            'and options recorded in the `*_manifest.json` file, do '
+            'not re-run.'))
 
     parser.add_argument('-v', '--version', action='version', 
             version='%(prog)s {0}'.format(dms_tools2.__version__))
@@ -183,11 +185,43 @@ def bcsubampParentParser():
             help=("Randomly purge barcodes with this probability to "
             "subsample data."))
 
+    parser.add_argument('--seed', type=int, default=1, help=("Random "
+            "number seed for '--purgeread' and '--purgebc'."))
+
+    parser.add_argument('--max_memory', type=float, help=("Hold at most "
+            "about this many megabytes of reads in memory, spilling "
+            "reads sorted by barcode to temporary files in '--outdir' "
+            "when this is exceeded. By default all reads are held in "
+            "memory."))
+
+    parser.add_argument('--checkpoint', type=float, help=("Every this "
+            "many minutes, save progress to files with suffix "
+            "'_checkpoint.pickle' in '--outdir' so the run can be "
+            "continued with '--resume'. These files are removed when "
+            "the run finishes successfully."))
+
+    parser.add_argument('--resume', choices=['yes', 'no'], default='no',
+            help=("Continue from the last checkpoint saved with "
+            "'--checkpoint'. The inputs and options must be unchanged."))
+
+    parser.add_argument('--bcstate', choices=['yes', 'no'], default='no',
+            help=("Keep reads and results for each barcode in file with "
+            "suffix '_bcstate.sqlite' in '--outdir'. If this file exists, "
+            "reads in '--R1' are added to it as new lanes and only "
+            "barcodes that gain reads are rebuilt and realigned. Output "
+            "files then give totals over all lanes added so far."))
+
     parser.set_defaults(bcinfo=False)
     parser.add_argument('--bcinfo', dest='bcinfo', action='store_true', 
             help=("Create file with suffix 'bcinfo.txt.gz' with info "
             "about each barcode."))
 
+    parser.add_argument('--outformat', default='csv',
+            choices=['csv', 'parquet'], help="Format of output counts "
+            "tables. 'parquet' is a binary columnar format that is faster "
+            "to read (requires `pyarrow`). Programs reading these tables "
+            "detect the format.")
+
     return parser
 
 
@@ -243,13 +277,20 @@ def prefsParentParser():
             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     parser.add_argument('--method', default='bayesian', 
-            choices=['ratio', 'bayesian'], help="Method to "
-            "estimate preferences: normalized enrichment ratios "
-            "or Bayesian inference.")
+            choices=['ratio', 'bayesian', 'map'], help="Method to "
+            "estimate preferences: normalized enrichment ratios, "
+            "Bayesian inference by MCMC, or maximum a posteriori "
+            "estimates of the same Bayesian model (much faster).")
 
     parser.add_argument('--indir', help="Input counts files in this "
             "directory.")
 
+    parser.add_argument('--outformat', default='csv',
+            choices=['csv', 'parquet'], help="Format of output preferences "
+            "tables. 'parquet' is a binary columnar format that is faster "
+            "to read (requires `pyarrow`). Programs reading these tables "
+            "detect the format.")
+
     parser.add_argument('--chartype', default='codon_to_aa',
             choices=['codon_to_aa'], help="Characters for which "
             "preferences are estimated. `codon_to_aa` = amino acids "
@@ -261,9 +302,25 @@ def prefsParentParser():
     parser.add_argument('--conc', nargs=3, default=[1, 1, 1],
             type=float, metavar=('Cprefs', 'Cmut', 'Cerr'),
             help="Concentration parameters for priors for "
-            "``--method bayesian``. Priors are over preferences, "
+            "``--method bayesian`` or ``map``. Priors are over preferences, "
             "mutagenesis rate, and error rate(s).")
 
+    parser.add_argument('--sitesperfit', default=10, type=int,
+            help="Number of sites fit jointly in each MCMC for "
+            "``--method bayesian``. Convergence is still assessed "
+            "for each site, and only sites that fail are re-run.")
+
+    parser.add_argument('--sampler', default='stan', choices=['stan',
+            'numpy'], help="MCMC sampler for ``--method bayesian``: "
+            "``pystan``, or Hamiltonian Monte Carlo implemented with "
+            "``numpy`` that does not need ``pystan`` or a C++ compiler.")
+
+    parser.add_argument('--mapfallback', default='yes', choices=['yes', 'no'],
+            help="For ``--method map``, use MCMC as for ``--method "
+            "bayesian`` at sites where the MAP estimate is unreliable "
+            "because the optimizer fails or gives different estimates "
+            "from different starting values?")
+
     parser.add_argument('--pseudocount', default=1,
             help="Pseudocount used with ``--method ratio``.")
 
@@ -329,6 +386,12 @@ def diffselParentParser():
     parser.add_argument('--indir', help="Input counts files in this "
             "directory.")
 
+    parser.add_argument('--outformat', default='csv',
+            choices=['csv', 'parquet'], help="Format of output diffsel "
+            "tables. 'parquet' is a binary columnar format that is faster "
+            "to read (requires `pyarrow`). Programs reading these tables "
+            "detect the format.")
+
     parser.add_argument('--chartype', default='codon_to_aa',
             choices=['codon_to_aa'], help="Characters for which "
             "differential selection is estimated. `codon_to_aa` = amino "
@@ -457,6 +520,12 @@ def fracsurviveParentParser():
     parser.add_argument('--indir', help="Input counts files in this "
             "directory.")
 
+    parser.add_argument('--outformat', default='csv',
+            choices=['csv', 'parquet'], help="Format of output fracsurvive "
+            "tables. 'parquet' is a binary columnar format that is faster "
+            "to read (requires `pyarrow`). Programs reading these tables "
+            "detect the format.")
+
     parser.add_argument('--chartype', default='codon_to_aa',
             choices=['codon_to_aa'], help="Characters for which "
             "fraction surviving selection is estimated. `codon_to_aa` ="
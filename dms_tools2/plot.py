@@ -304,7 +304,7 @@ def plotDepth(names, countsfiles, plotfile, maxcol=4, charlist=CODONS):
     assert os.path.splitext(plotfile)[1].lower() == '.pdf'
 
     counts = pandas.concat(
-            [pandas.read_csv(f)
+            [dms_tools2.utils.readTable(f)
                    .assign(name=name)
                    .assign(ncounts=lambda x: x[charlist].sum(axis=1))
                    .rename(columns={'ncounts':'number of counts'})
@@ -398,14 +398,14 @@ def plotCumulMutCounts(names, countsfiles, plotfile, chartype,
     assert len(names) == len(countsfiles) == len(set(names))
     assert os.path.splitext(plotfile)[1].lower() == '.pdf'
 
-    counts = pandas.concat([pandas.read_csv(f).assign(name=name) for
-            (name, f) in zip(names, countsfiles)], ignore_index=True)
+    counts = pandas.concat([dms_tools2.utils.readTable(f).assign(name=name)
+            for (name, f) in zip(names, countsfiles)], ignore_index=True)
 
     if chartype != 'codon':
         raise ValueError("invalid chartype of {0}".format(chartype))
 
-    codoncounts = pandas.concat([pandas.read_csv(f).assign(name=name)
-            for (name, f) in zip(names, countsfiles)],
+    codoncounts = pandas.concat([dms_tools2.utils.readTable(f)
+            .assign(name=name) for (name, f) in zip(names, countsfiles)],
             ignore_index=True).assign(character='codons')
     assert set(CODONS) <= set(codoncounts.columns)
     codonmelt = codoncounts.melt(id_vars=['name', 'wildtype', 'character'], 
@@ -414,7 +414,7 @@ def plotCumulMutCounts(names, countsfiles, plotfile, chartype,
     codonmelt = codonmelt[codonmelt['codon'] != codonmelt['wildtype']]
 
     aacounts = pandas.concat([dms_tools2.utils.codonToAACounts(
-            pandas.read_csv(f)).assign(name=name)
+            dms_tools2.utils.readTable(f)).assign(name=name)
             for (name, f) in zip(names, countsfiles)],
             ignore_index=True).assign(character='amino acids')
     assert set(AAS_WITHSTOP) <= set(aacounts.columns)
@@ -565,7 +565,7 @@ def plotCorrMatrix(names, infiles, plotfile, datatype,
 
     if datatype == 'prefs':
         # read prefs into dataframe, ensuring all have same characters
-        prefs = [pandas.read_csv(f).assign(name=name) for (name, f) 
+        prefs = [dms_tools2.utils.readTable(f).assign(name=name) for (name, f) 
                 in zip(names, infiles)]
         chars = set(prefs[0].columns)
         sites = set(prefs[0]['site'].values)
@@ -591,7 +591,7 @@ def plotCorrMatrix(names, infiles, plotfile, datatype,
         df.columns = df.columns.get_level_values(1)
 
     elif datatype in ['mutdiffsel', 'mutfracsurvive']:
-        mut_df = [pandas.read_csv(f)
+        mut_df = [dms_tools2.utils.readTable(f)
                         .assign(name=name)
                         .assign(mutname=lambda x: x.wildtype +
                                 x.site.map(str) + x.mutation)
@@ -615,7 +615,7 @@ def plotCorrMatrix(names, infiles, plotfile, datatype,
 
     elif datatype in ['abs_diffsel', 'positive_diffsel', 'max_diffsel',
             'avgfracsurvive', 'maxfracsurvive']:
-        site_df = [pandas.read_csv(f)
+        site_df = [dms_tools2.utils.readTable(f)
                          .assign(name=name)
                          .sort_values('site')
                          [['name', 'site', datatype]]
@@ -736,7 +736,7 @@ def plotSiteDiffSel(names, diffselfiles, plotfile,
     assert len(names) == len(diffselfiles) == len(set(names)) > 0
     assert os.path.splitext(plotfile)[1].lower() == '.pdf'
 
-    diffsels = [pandas.read_csv(f).assign(name=name) for (name, f) 
+    diffsels = [dms_tools2.utils.readTable(f).assign(name=name) for (name, f) 
             in zip(names, diffselfiles)]
     assert all([set(diffsels[0]['site']) == set(df['site']) for df in 
             diffsels]), "diffselfiles not all for same sites"
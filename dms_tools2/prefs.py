@@ -7,15 +7,22 @@ Performs operations related to estimating site-specific amino-acid
 preferences.
 
 Uses `pystan <https://pystan.readthedocs.io/en/latest>`_
-to perform MCMC for Bayesian inferences.
+to perform MCMC for Bayesian inferences, or alternatively a
+Hamiltonian Monte Carlo sampler implemented with `numpy`.
 """
 
 
+import os
+import sys
 import time
 import math
+import fcntl
+import hashlib
 import tempfile
 import pickle
 import random
+import functools
+import traceback
 import collections
 
 import natsort
@@ -23,24 +30,100 @@ import numpy
 import numpy.random
 import pandas
 import Bio.SeqIO
-import pystan
+try:
+    import pystan
+except ImportError:
+    pystan = None # only needed for the ``pystan`` backend
 
 import dms_tools2
+import dms_tools2.utils
+import dms_tools2.parseargs
+import dms_tools2.batch
 
 #: minimum value for Dirichlet prior elements
 PRIOR_MIN_VALUE = 1.0e-7 
 
+#: environment variable giving directory that caches compiled ``pystan``
+#: models, see `compileStanModel`
+STAN_CACHE_ENVVAR = 'DMS_TOOLS2_STAN_CACHE'
+
+
+def compileStanModel(model_code, verbose=False, cachedir=None):
+    """Compiled ``pystan`` model, cached on disk across runs.
+
+    Compiling a ``pystan`` model takes minutes, so compiled models are
+    pickled in `cachedir` keyed by a hash of `model_code` and the
+    ``pystan`` and Python versions. Later calls unpickle the model.
+    A lock file ensures that when several processes need the same model
+    at once, only one compiles it while the others wait to unpickle it.
+
+    Args:
+        `model_code` (str)
+            The ``pystan`` model code.
+        `verbose` (bool)
+            Set to `True` if you want verbose compilation.
+        `cachedir` (str or `None`)
+            Directory that caches compiled models. If `None`, use the
+            value of the environment variable named by
+            `STAN_CACHE_ENVVAR` if set, otherwise ``dms_tools2/stan``
+            in the user's cache directory. If the directory cannot be
+            created or written, the model is compiled without caching.
+
+    Returns:
+        A `pystan.StanModel`.
+    """
+    if pystan is None:
+        raise ImportError("You must install `pystan` to compile models")
+    if cachedir is None:
+        cachedir = os.environ.get(STAN_CACHE_ENVVAR, os.path.join(
+                os.environ.get('XDG_CACHE_HOME', os.path.expanduser(
+                os.path.join('~', '.cache'))), 'dms_tools2', 'stan'))
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+    except OSError:
+        return pystan.StanModel(model_code=model_code, verbose=verbose)
+    key = hashlib.sha256('\n'.join([model_code, pystan.__version__,
+            sys.version]).encode()).hexdigest()
+    modelfile = os.path.join(cachedir, 'stanmodel_{0}.pickle'.format(key))
+    try:
+        lock = open(modelfile + '.lock', 'w')
+    except OSError:
+        return pystan.StanModel(model_code=model_code, verbose=verbose)
+    with lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.isfile(modelfile):
+                try:
+                    with open(modelfile, 'rb') as f:
+                        return pickle.load(f)
+                except Exception:
+                    pass # corrupt or incompatible, so compile again
+            model = pystan.StanModel(model_code=model_code, verbose=verbose)
+            (fd, tmpfile) = tempfile.mkstemp(dir=cachedir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(model, f)
+                os.replace(tmpfile, modelfile)
+            finally:
+                if os.path.isfile(tmpfile):
+                    os.remove(tmpfile)
+            return model
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
 
 class StanModelNoneErr(object):
     """``pystan`` model when `error_model` is `none`.
     
     For use by inferSitePrefs`."""
-    def __init__(self, verbose=False):
-        """Compile ``pystan`` model.
+    def __init__(self, verbose=False, cachedir=None):
+        """Compile ``pystan`` model, or load it from the cache.
 
         Args:
             `verbose` (bool)
                 Set to `True` if you want verbose compilation.
+            `cachedir` (str or `None`)
+                Cache of compiled models, see `compileStanModel`.
         """
         self.pystancode =\
 """
@@ -66,20 +149,22 @@ model {{
     nrpost ~ multinomial(fr);
 }}
 """.format(PRIOR_MIN_VALUE)
-        self.model = pystan.StanModel(model_code=self.pystancode, 
-                verbose=verbose)
+        self.model = compileStanModel(self.pystancode, verbose=verbose,
+                cachedir=cachedir)
 
 
 class StanModelSameErr:
     """``pystan`` model when `error_model` is `same`.
     
     For use by inferSitePrefs`."""
-    def __init__(self, verbose=False):
-        """Compile ``pystan`` model.
+    def __init__(self, verbose=False, cachedir=None):
+        """Compile ``pystan`` model, or load it from the cache.
 
         Args:
             `verbose` (bool)
                 Set to `True` if you want verbose compilation.
+            `cachedir` (str or `None`)
+                Cache of compiled models, see `compileStanModel`.
         """
         self.pystancode =\
 """
@@ -120,20 +205,22 @@ model {{
     nrpost ~ multinomial(fr_plus_err);
 }}
 """.format(PRIOR_MIN_VALUE)
-        self.model = pystan.StanModel(model_code=self.pystancode,
-                verbose=verbose)
+        self.model = compileStanModel(self.pystancode, verbose=verbose,
+                cachedir=cachedir)
 
 
 class StanModelDifferentErr:
     """``pystan`` model when `error_model` is `different`.
     
     For use by inferSitePrefs`."""
-    def __init__(self, verbose=False):
-        """Compile ``pystan`` model.
+    def __init__(self, verbose=False, cachedir=None):
+        """Compile ``pystan`` model, or load it from the cache.
 
         Args:
             `verbose` (bool)
                 Set to `True` if you want verbose compilation.
+            `cachedir` (str or `None`)
+                Cache of compiled models, see `compileStanModel`.
         """
         self.pystancode =\
 """
@@ -179,9 +266,185 @@ model {{
     nrpost ~ multinomial(fr_plus_err);
 }}
 """.format(PRIOR_MIN_VALUE)
-        self.model = pystan.StanModel(model_code=self.pystancode,
-                verbose=verbose)
+        self.model = compileStanModel(self.pystancode, verbose=verbose,
+                cachedir=cachedir)
+
+
+
+class StanModelNoneErrBlock:
+    """``pystan`` model for a block of sites when `error_model` is `none`.
 
+    Same as `StanModelNoneErr`, but fits several sites jointly.
+    For use by `inferBlockPrefs`."""
+    def __init__(self, verbose=False, cachedir=None):
+        """Compile ``pystan`` model, or load it from the cache.
+
+        Args:
+            `verbose` (bool)
+                Set to `True` if you want verbose compilation.
+            `cachedir` (str or `None`)
+                Cache of compiled models, see `compileStanModel`.
+        """
+        self.pystancode =\
+"""
+data {{
+    int<lower=1> Nsite; // number of sites fit jointly
+    int<lower=1> Nchar; // 64 for codons, 20 for amino acids, 4 for nucleotides
+    int<lower=0> nrpre[Nsite, Nchar]; // counts pre-selection
+    int<lower=0> nrpost[Nsite, Nchar]; // counts post-selection
+    vector<lower={0:g}>[Nchar] pir_prior_params[Nsite]; // Dirichlet prior params
+    vector<lower={0:g}>[Nchar] mur_prior_params[Nsite]; // Dirichlet prior params
+}}
+parameters {{
+    simplex[Nchar] pir[Nsite];
+    simplex[Nchar] mur[Nsite];
+}}
+transformed parameters {{
+    simplex[Nchar] fr[Nsite];
+    for (r in 1:Nsite) {{
+        fr[r] = pir[r] .* mur[r] / dot_product(pir[r], mur[r]);
+    }}
+}}
+model {{
+    for (r in 1:Nsite) {{
+        pir[r] ~ dirichlet(pir_prior_params[r]);
+        mur[r] ~ dirichlet(mur_prior_params[r]);
+        nrpre[r] ~ multinomial(mur[r]);
+        nrpost[r] ~ multinomial(fr[r]);
+    }}
+}}
+""".format(PRIOR_MIN_VALUE)
+        self.model = compileStanModel(self.pystancode, verbose=verbose,
+                cachedir=cachedir)
+
+
+class StanModelSameErrBlock:
+    """``pystan`` model for a block of sites when `error_model` is `same`.
+
+    Same as `StanModelSameErr`, but fits several sites jointly.
+    For use by `inferBlockPrefs`."""
+    def __init__(self, verbose=False, cachedir=None):
+        """Compile ``pystan`` model, or load it from the cache.
+
+        Args:
+            `verbose` (bool)
+                Set to `True` if you want verbose compilation.
+            `cachedir` (str or `None`)
+                Cache of compiled models, see `compileStanModel`.
+        """
+        self.pystancode =\
+"""
+data {{
+    int<lower=1> Nsite; // number of sites fit jointly
+    int<lower=1> Nchar; // 64 for codons, 20 for amino acids, 4 for nucleotides
+    int<lower=1, upper=Nchar> iwtchar[Nsite]; // index of wildtype character in 1, ... numbering
+    int<lower=0> nrpre[Nsite, Nchar]; // counts pre-selection
+    int<lower=0> nrpost[Nsite, Nchar]; // counts post-selection
+    int<lower=0> nrerr[Nsite, Nchar]; // counts in error control
+    vector<lower={0:g}>[Nchar] pir_prior_params[Nsite]; // Dirichlet prior params
+    vector<lower={0:g}>[Nchar] mur_prior_params[Nsite]; // Dirichlet prior params
+    vector<lower={0:g}>[Nchar] epsilonr_prior_params[Nsite]; // Dirichlet prior params
+}}
+transformed data {{
+    vector[Nchar] deltar[Nsite];
+    for (r in 1:Nsite) {{
+        deltar[r] = rep_vector(0.0, Nchar);
+        deltar[r][iwtchar[r]] = 1.0;
+    }}
+}}
+parameters {{
+    simplex[Nchar] pir[Nsite];
+    simplex[Nchar] mur[Nsite];
+    simplex[Nchar] epsilonr[Nsite];
+}}
+transformed parameters {{
+    simplex[Nchar] fr_plus_err[Nsite];
+    simplex[Nchar] mur_plus_err[Nsite];
+    for (r in 1:Nsite) {{
+        fr_plus_err[r] = pir[r] .* mur[r] / dot_product(pir[r], mur[r]) + epsilonr[r] - deltar[r];
+        mur_plus_err[r] = mur[r] + epsilonr[r] - deltar[r];
+    }}
+}}
+model {{
+    for (r in 1:Nsite) {{
+        pir[r] ~ dirichlet(pir_prior_params[r]);
+        mur[r] ~ dirichlet(mur_prior_params[r]);
+        epsilonr[r] ~ dirichlet(epsilonr_prior_params[r]);
+        nrerr[r] ~ multinomial(epsilonr[r]);
+        nrpre[r] ~ multinomial(mur_plus_err[r]);
+        nrpost[r] ~ multinomial(fr_plus_err[r]);
+    }}
+}}
+""".format(PRIOR_MIN_VALUE)
+        self.model = compileStanModel(self.pystancode, verbose=verbose,
+                cachedir=cachedir)
+
+
+class StanModelDifferentErrBlock:
+    """``pystan`` model for a block of sites when `error_model` is `different`.
+
+    Same as `StanModelDifferentErr`, but fits several sites jointly.
+    For use by `inferBlockPrefs`."""
+    def __init__(self, verbose=False, cachedir=None):
+        """Compile ``pystan`` model, or load it from the cache.
+
+        Args:
+            `verbose` (bool)
+                Set to `True` if you want verbose compilation.
+            `cachedir` (str or `None`)
+                Cache of compiled models, see `compileStanModel`.
+        """
+        self.pystancode =\
+"""
+data {{
+    int<lower=1> Nsite; // number of sites fit jointly
+    int<lower=1> Nchar; // 64 for codons, 20 for amino acids, 4 for nucleotides
+    int<lower=1, upper=Nchar> iwtchar[Nsite]; // index of wildtype character in 1, ... numbering
+    int<lower=0> nrpre[Nsite, Nchar]; // counts pre-selection
+    int<lower=0> nrpost[Nsite, Nchar]; // counts post-selection
+    int<lower=0> nrerrpre[Nsite, Nchar]; // counts in pre-selection error control
+    int<lower=0> nrerrpost[Nsite, Nchar]; // counts in post-selection error control
+    vector<lower={0:g}>[Nchar] pir_prior_params[Nsite]; // Dirichlet prior params
+    vector<lower={0:g}>[Nchar] mur_prior_params[Nsite]; // Dirichlet prior params
+    vector<lower={0:g}>[Nchar] epsilonr_prior_params[Nsite]; // Dirichlet prior params
+    vector<lower={0:g}>[Nchar] rhor_prior_params[Nsite]; // Dirichlet prior params
+}}
+transformed data {{
+    vector[Nchar] deltar[Nsite];
+    for (r in 1:Nsite) {{
+        deltar[r] = rep_vector(0.0, Nchar);
+        deltar[r][iwtchar[r]] = 1.0;
+    }}
+}}
+parameters {{
+    simplex[Nchar] pir[Nsite];
+    simplex[Nchar] mur[Nsite];
+    simplex[Nchar] epsilonr[Nsite];
+    simplex[Nchar] rhor[Nsite];
+}}
+transformed parameters {{
+    simplex[Nchar] fr_plus_err[Nsite];
+    simplex[Nchar] mur_plus_err[Nsite];
+    for (r in 1:Nsite) {{
+        fr_plus_err[r] = pir[r] .* mur[r] / dot_product(pir[r], mur[r]) + rhor[r] - deltar[r];
+        mur_plus_err[r] = mur[r] + epsilonr[r] - deltar[r];
+    }}
+}}
+model {{
+    for (r in 1:Nsite) {{
+        pir[r] ~ dirichlet(pir_prior_params[r]);
+        mur[r] ~ dirichlet(mur_prior_params[r]);
+        epsilonr[r] ~ dirichlet(epsilonr_prior_params[r]);
+        rhor[r] ~ dirichlet(rhor_prior_params[r]);
+        nrerrpre[r] ~ multinomial(epsilonr[r]);
+        nrerrpost[r] ~ multinomial(rhor[r]);
+        nrpre[r] ~ multinomial(mur_plus_err[r]);
+        nrpost[r] ~ multinomial(fr_plus_err[r]);
+    }}
+}}
+""".format(PRIOR_MIN_VALUE)
+        self.model = compileStanModel(self.pystancode, verbose=verbose,
+                cachedir=cachedir)
 
 def _initialValuePrefs(error_model, nchains, iwtchar, nchars):
     """Gets valid initial values for ``pystan`` preference inference.
@@ -364,16 +627,19 @@ def inferPrefsByRatio(charlist, sites, wts, pre, post, errpre,
             Sites to analyze.
         `wts` (list)
             `wts[r]` is the wildtype character at site `sites[r]`.
-        `pre` (pandas.DataFrame)
+        `pre` (pandas.DataFrame or list)
             Gives pre-selection counts. Should have columns
             with names of 'site' and all characters in `charlist`.
             The rows give the counts of each character at that site.
-        `post` (pandas.DataFrame)
+            Can also be a list of such data frames for several samples,
+            in which case the preferences for all samples are computed
+            together.
+        `post` (pandas.DataFrame or list)
             Like `pre` but for post-selection counts.
-        `errpre` (`None` or pandas.DataFrame)
+        `errpre` (`None`, pandas.DataFrame, or list)
             Like `pre` but for pre-selection error-control counts,
             or `None` if there is no such control.
-        `errpost` (`None` or pandas.DataFrame)
+        `errpost` (`None`, pandas.DataFrame, or list)
             Like `pre` but for post-selection error-control counts,
             or `None` if there is no such control.
         `pseudocount` (float or int)
@@ -383,88 +649,410 @@ def inferPrefsByRatio(charlist, sites, wts, pre, post, errpre,
         A pandas.DataFrame holding the preferences. The columns of
         this dataframe are 'site' and all characters in `charlist`.
         For each site in `sites`, the rows give the preference
-        for that character.
+        for that character. If `pre` is a list, a list of such
+        data frames for each sample.
     """
     assert len(wts) == len(sites) > 0
     assert all([wt in charlist for wt in wts]), "invalid char in wts"
     assert pseudocount > 0, "pseudocount must be greater than zero"
 
-    dfs = {'pre':pre.copy(),
-           'post':post.copy()
-           }
-    if errpre is not None:
-        dfs['errpre'] = errpre.copy()
-    if errpost is not None:
-        dfs['errpost'] = errpost.copy()
-
-    # compute total depth for each sample and sort by sites
-    depths = []
-    for stype in dfs.keys():
-        df = dfs[stype]
-        assert set(list(charlist) + ['site']) <= set(df.columns)
-        assert set(sites) <= set(df['site'])
-        df = df.query('site in @sites')
-        assert len(df.index) == len(wts) == len(sites)
-        df['site'] = pandas.Categorical(df['site'], sites)
-        df = df.sort_values('site').reset_index(drop=True)
-        df['Nr'] = df[charlist].sum(axis=1).astype('float')
-        depths.append(df['Nr'])
-        dfs[stype] = df
-    mindepth = pandas.concat(depths, axis=1).min(axis=1)
-
-    # calculate scaled pseudocounts
-    pseudocounts = dict([(stype,
-            pseudocount * (dfs[stype]['Nr'] / mindepth).fillna(1.0))
-            for stype in dfs.keys()])
-
-    # calculate frequencies
-    for stype in dfs.keys():
-        df = dfs[stype]
-        for c in charlist:
-            df['f{0}'.format(c)] = (df[c] + pseudocounts[stype]) / (
-                    df['Nr'] + len(charlist) * pseudocounts[stype]) 
-            df['delta{0}'.format(c)] = [int(wt == c) for wt in wts]
-        dfs[stype] = df
-
-    # fill values for errpre / errpost if they were None
-    for stype in ['pre', 'post']:
-        err = 'err{0}'.format(stype)
-        if err not in dfs:
-            dfs[err] = pandas.DataFrame(dict([('site', sites)] +
-                    [('f{0}'.format(c), dfs[stype]['delta{0}'.format(c)])
-                    for c in charlist]))
-
-    # compute phi values
-    fr = {}
-    for (key, f, ferr, p) in [
-            ('before', dfs['pre'], dfs['errpre'], pseudocounts['pre']),
-            ('after', dfs['post'], dfs['errpost'], pseudocounts['post']),
-            ]:
-        fr[key] = {'wt':numpy.zeros(len(sites))}
-        for c in charlist:
-            fr[key][c] = numpy.maximum(
-                    p / (f['Nr'].values + len(charlist) * p),
-                    f['f{0}'.format(c)].values 
-                        + f['delta{0}'.format(c)].values 
-                        - ferr['f{0}'.format(c)].values
-                    )
-            fr[key]['wt'] += fr[key][c] * f['delta{0}'.format(c)].values
-    phi = pandas.DataFrame({'site':sites})
-    for c in charlist:
-        phi[c] = ((fr['after'][c] / fr['after']['wt']) /
-                  (fr['before'][c] / fr['before']['wt']))
-    phi['denom'] = phi[charlist].sum(axis=1)
-
-    # normalize phi values to get pi values
-    prefs = phi[charlist].div(phi['denom'], axis=0)
-    prefs.insert(0, 'site', sites)
-
-    return prefs
-    
+    # counts as arrays with rows in the order of `sites`
+    counts = {}
+    for (stype, dfs) in [('pre', pre), ('post', post), ('errpre', errpre),
+            ('errpost', errpost)]:
+        if dfs is None:
+            counts[stype] = None
+            continue
+        counts[stype] = []
+        for df in (dfs if isinstance(dfs, list) else [dfs]):
+            assert set(list(charlist) + ['site']) <= set(df.columns)
+            assert set(sites) <= set(df['site'])
+            df = df.query('site in @sites')
+            assert len(df.index) == len(wts) == len(sites)
+            counts[stype].append(df.set_index('site').loc[list(sites),
+                    list(charlist)].values)
+        counts[stype] = numpy.array(counts[stype])
+
+    prefs = inferPrefsByRatioArray([charlist.index(wt) for wt in wts],
+            counts['pre'], counts['post'], counts['errpre'],
+            counts['errpost'], pseudocount)
+
+    prefs = [pandas.DataFrame(sampleprefs, columns=charlist) for
+            sampleprefs in prefs]
+    for sampleprefs in prefs:
+        sampleprefs.insert(0, 'site', sites)
+    if isinstance(pre, list):
+        return prefs
+    else:
+        return prefs[0]
+
+
+def inferPrefsByRatioArray(iwts, pre, post, errpre, errpost, pseudocount):
+    """Preferences from normalized enrichment ratios for arrays of counts.
+
+    Computes the preferences defined for `inferPrefsByRatio` for
+    all sites (and optionally samples) at once.
+
+    Args:
+        `iwts` (array-like)
+            Index of the wildtype character at each site.
+        `pre` (array-like)
+            Pre-selection counts, with the last two axes being sites
+            and characters. Any leading axes (such as one for samples)
+            are broadcast against the other counts.
+        `post` (array-like)
+            Like `pre` but for post-selection counts.
+        `errpre` (`None` or array-like)
+            Like `pre` but for pre-selection error-control counts,
+            or `None` if there is no such control.
+        `errpost` (`None` or array-like)
+            Like `pre` but for post-selection error-control counts,
+            or `None` if there is no such control.
+        `pseudocount` (float or int)
+            The pseudocount to add to each observation.
+
+    Returns:
+        A `numpy.ndarray` of the preferences with the shape of the
+        broadcast counts.
+
+    >>> pre = [[[90, 5, 5], [10, 10, 80]],
+    ...        [[80, 10, 10], [5, 5, 90]]]
+    >>> post = [[[90, 9, 1], [20, 0, 80]],
+    ...         [[80, 18, 2], [10, 0, 90]]]
+    >>> prefs = inferPrefsByRatioArray([0, 2], pre, post, None, None, 1)
+    >>> prefs.shape
+    (2, 2, 3)
+    >>> numpy.allclose(prefs.sum(axis=-1), 1)
+    True
+    >>> numpy.allclose(prefs[0], inferPrefsByRatioArray([0, 2], pre[0],
+    ...         post[0], None, None, 1))
+    True
+    >>> bool(prefs[0, 0, 1] > prefs[0, 0, 0] > prefs[0, 0, 2])
+    True
+    """
+    assert pseudocount > 0, "pseudocount must be greater than zero"
+    counts = dict([(stype, numpy.asarray(c, dtype='float')) for (stype, c)
+            in [('pre', pre), ('post', post), ('errpre', errpre),
+            ('errpost', errpost)] if c is not None])
+    nchars = counts['pre'].shape[-1]
+    delta = (numpy.arange(nchars) == numpy.asarray(iwts)[:, None]).astype(
+            'float')
+
+    # total depths and scaled pseudocounts
+    depths = dict([(stype, c.sum(axis=-1, keepdims=True)) for (stype, c)
+            in counts.items()])
+    mindepth = functools.reduce(numpy.minimum, depths.values())
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        pseudocounts = dict([(stype, pseudocount * numpy.where(numpy.isnan(
+                depths[stype] / mindepth), 1.0, depths[stype] / mindepth))
+                for stype in counts])
+
+        # error-corrected frequencies before and after selection
+        f = dict([(stype, (counts[stype] + pseudocounts[stype]) / (
+                depths[stype] + nchars * pseudocounts[stype])) for stype in
+                counts])
+        fr = {}
+        for (key, stype) in [('before', 'pre'), ('after', 'post')]:
+            p = pseudocounts[stype]
+            fr[key] = numpy.maximum(p / (depths[stype] + nchars * p),
+                    f[stype] + delta - f.get('err' + stype, delta))
+            fr[key + 'wt'] = (fr[key] * delta).sum(axis=-1, keepdims=True)
+
+        phi = (fr['after'] / fr['afterwt']) / (fr['before'] / fr['beforewt'])
+        return phi / phi.sum(axis=-1, keepdims=True)
+
+
+def prefsFiles(args):
+    """Names of the files written by ``dms2_prefs`` for a sample.
+
+    Args:
+        `args` (dict)
+            Arguments of ``dms2_prefs``. The directory ``outdir`` is
+            created if needed, or set to an empty str if not given.
+
+    Returns:
+        A dict of the file names keyed by type of file.
+    """
+    if args['outdir']:
+        if not os.path.isdir(args['outdir']):
+            os.mkdir(args['outdir'])
+    else:
+        args['outdir'] = ''
+    filesuffixes = {
+            'log':'.log',
+            'manifest':'_manifest.json',
+            'prefs':dms_tools2.utils.tableFile('_prefs', args['outformat']),
+            'partialprefs':'_prefs_partial.csv',
+            'partialmanifest':'_prefs_partial_manifest.json',
+            }
+    return dict([(f, os.path.join(args['outdir'], '{0}{1}'.format(
+            args['name'], s))) for (f, s) in filesuffixes.items()])
+
+
+def readPartialPrefs(partialprefs, charlist):
+    """Reads preferences of sites finished by an incomplete ``dms2_prefs``.
+
+    Only complete rows are kept, which end in a newline and have values
+    for every character in `charlist` that sum to one. So a row cut
+    short when a run is killed while writing it is ignored.
+
+    Args:
+        `partialprefs` (str)
+            File to which preferences are written as each site finishes,
+            with a header of ``site`` followed by `charlist`.
+        `charlist` (list)
+            The characters for the preferences.
+
+    Returns:
+        A dict keyed by the site (as a str) of each complete row, with
+        values dicts of the preferences keyed by character.
+
+    >>> f = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+    >>> _ = f.write('site,A,C\\n1,0.25,0.75\\n2,0.5,nan\\n3,0.5\\n'
+    ...             '4,0.5,0.5\\n5,0.1,0.9')
+    >>> f.close()
+    >>> finished = readPartialPrefs(f.name, ['A', 'C'])
+    >>> finished == {'1':{'A':0.25, 'C':0.75}, '4':{'A':0.5, 'C':0.5}}
+    True
+    >>> os.remove(f.name)
+    """
+    finished = {}
+    with open(partialprefs) as f:
+        if f.readline().rstrip('\n').split(',') != ['site'] + list(charlist):
+            return finished
+        for line in f:
+            if not line.endswith('\n'):
+                break # last row was not completely written
+            row = line.rstrip('\n').split(',')
+            if len(row) != len(charlist) + 1:
+                continue
+            try:
+                pi = dict(zip(charlist, map(float, row[1 : ])))
+            except ValueError:
+                continue
+            if (numpy.isfinite(list(pi.values())).all() and
+                    abs(1 - sum(pi.values())) < 1e-4):
+                finished[row[0]] = pi
+    return finished
+
+
+def readPrefsCounts(args, logger):
+    """Reads the counts for a sample of ``dms2_prefs``.
+
+    Args:
+        `args` (dict)
+            Arguments of ``dms2_prefs``.
+        `logger` (`logging.Logger`)
+            Logs the files read and the sites.
+
+    Returns:
+        The 6-tuple `(counts, inputs, error_model, sites, wts, charlist)`.
+        `counts` is a dict of the counts data frames keyed by ``pre``,
+        ``post``, and ``err`` if `error_model` is ``same`` or ``errpre``
+        and ``errpost`` if it is ``different``. `inputs` lists the files
+        read. `sites` and `wts` are tuples of the sites and wildtype
+        codons in sorted order, excluding a last site that is a stop
+        codon if ``excludestop`` is ``yes``. `charlist` is the list of
+        characters for the preferences.
+    """
+    if not args['indir']:
+        indir = ''
+    else:
+        indir = args['indir']
+        assert os.path.isdir(indir), "No --indir {0}".format(indir)
+    if args['chartype']:
+        countsuffix = '_codoncounts'
+    else:
+        raise ValueError("Invalid chartype")
+    counts = {}
+    inputs = []
+    for ctype in ['pre', 'post']:
+        fname = dms_tools2.utils.findTableFile(os.path.join(indir,
+                args[ctype]), countsuffix)
+        if fname is None:
+            raise ValueError("Missing file for --{0}".format(ctype))
+        logger.info("Reading {0}-selection counts from {1}".format(
+                ctype, fname))
+        counts[ctype] = dms_tools2.batch.readCSV(fname)
+        inputs.append(fname)
+    if args['err']:
+        ferr = {}
+        for (i, ctype) in enumerate(['pre', 'post']):
+            fname = dms_tools2.utils.findTableFile(os.path.join(indir,
+                    args['err'][i]), countsuffix)
+            if fname is None:
+                raise ValueError("Missing file {0} for --err".format(i + 1))
+            ferr[ctype] = fname
+            inputs.append(fname)
+        if len(set(map(os.path.realpath, ferr.values()))) == 1:
+            error_model = 'same'
+            logger.info("Reading error-control counts from {0}"
+                    .format(ferr['pre']))
+            counts['err'] = dms_tools2.batch.readCSV(ferr['pre'])
+        else:
+            error_model = 'different'
+            for (ctype, f) in ferr.items():
+                logger.info("Reading {0}-selection error-control "
+                        "counts from {0}".format(ctype, f))
+                counts['err{0}'.format(ctype)] = dms_tools2.batch.readCSV(f)
+    else:
+        error_model = 'none'
+
+    # get sites and wildtype identities, sorted by site
+    sites = wts = None
+    for c in counts.values():
+        (csites, cwts) = zip(*natsort.realsorted(zip(
+                c['site'].values, c['wildtype'].values)))
+        if sites == wts == None:
+            sites = csites
+            wts = cwts
+        else:
+            assert sites == csites, "different sets of sites"
+            assert wts == cwts, "different wildtype identities"
+    assert len(sites) == len(set(sites)), "non-unique sites"
+    logger.info("Read counts for {0} sites.".format(len(sites)))
+    logger.info("Here are sites and wildtype identities:\n\t{0}\n".format(
+            '\n\t'.join(['{0}\t{1}'.format(r, wt) for (r, wt) in zip(
+            sites, wts)])))
+    if args['excludestop'] == 'yes' and args['chartype'] == 'codon_to_aa':
+        if dms_tools2.CODON_TO_AA[wts[-1]] == '*':
+            sites = sites[ : -1]
+            wts = wts[ : -1]
+            logger.info("Excluding the last site as it a stop codon.\n")
+        assert '*' not in wts, "wildtype of '*' for `--excludestop yes`"
+
+    # get list of characters
+    if args['chartype'] == 'codon_to_aa':
+        if args['excludestop'] == 'yes':
+            charlist = dms_tools2.AAS
+        elif args['excludestop'] == 'no':
+            charlist = dms_tools2.AAS_WITHSTOP
+        else:
+            raise ValueError("Invalid --excludestop")
+    else:
+        raise ValueError("Invalid chartype")
+
+    return (counts, inputs, error_model, sites, wts, charlist)
+
+
+def runRatioPrefs(sampleargs, prog='dms2_prefs'):
+    """Runs ``dms2_prefs --method ratio`` on one or more samples.
+
+    Each sample gets the same log, preferences, and manifest files as
+    when ``dms2_prefs`` is run on it alone, but the preferences of all
+    samples with the same sites are computed together with
+    `inferPrefsByRatioArray`. This is used by both ``dms2_prefs``
+    and ``dms2_batch_prefs``.
+
+    Args:
+        `sampleargs` (list)
+            For each sample, a dict of the arguments of ``dms2_prefs``
+            like those parsed from its command line.
+        `prog` (str)
+            Name of the program in the log files.
+
+    Returns:
+        A list with an entry for each sample that is `None` if the
+        preferences were written or already up to date, or a str
+        describing the error otherwise.
+    """
+    errors = [None] * len(sampleargs)
+    runs = {}
+    groups = collections.OrderedDict()
+
+    def endRun(i, error=None):
+        """Finishes the log and removes outputs if there is `error`."""
+        (logger, files, manifestargs) = runs.pop(i)
+        if error:
+            errors[i] = error
+            logger.error('Terminating {0} with ERROR\n{1}'.format(prog,
+                    error))
+            for (fname, fpath) in files.items():
+                if fname != 'log' and os.path.isfile(fpath):
+                    logger.error("Deleting file {0}".format(fpath))
+                    os.remove(fpath)
+        else:
+            logger.info('Successful completion of {0}'.format(prog))
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+
+    for (i, args) in enumerate(sampleargs):
+        files = prefsFiles(args)
+        manifestargs = dict((arg, val) for (arg, val) in args.items()
+                if arg not in ['ncpus', 'use_existing'])
+        if args['use_existing'] == 'yes' and dms_tools2.utils.manifestMatches(
+                files['manifest'], manifestargs):
+            print("Output files are up to date with the inputs and "
+                  "arguments, and '--use_existing' is 'yes', so exiting "
+                  "with no further action.")
+            continue
+        logger = dms_tools2.utils.initLogger(files['log'], prog, args,
+                loggername='{0}_{1}'.format(prog, args['name']))
+        runs[i] = (logger, files, manifestargs)
+        try:
+            assert dms_tools2.parseargs.checkName(args['name'], 'name')
+            for (ftype, f) in files.items():
+                if os.path.isfile(f) and ftype != 'log':
+                    logger.info("Removing existing file {0}".format(f))
+                    os.remove(f)
+            (counts, inputs, error_model, sites, wts, charlist) = \
+                    readPrefsCounts(args, logger)
+            logger.info("Computing preferences as normalized enrichment "
+                    "ratios...")
+            codon_to_aa = dms_tools2.utils.codonToAAMatrix(charlist)
+            ctypes = {'none':['pre', 'post'],
+                      'same':['pre', 'post', 'err', 'err'],
+                      'different':['pre', 'post', 'errpre', 'errpost'],
+                     }[error_model]
+            aacounts = [counts[ctype].set_index('site').loc[list(sites),
+                    dms_tools2.CODONS].values.dot(codon_to_aa)
+                    for ctype in ctypes]
+            wts = tuple(dms_tools2.CODON_TO_AA[wt] for wt in wts)
+            groups.setdefault((sites, wts, tuple(charlist),
+                    int(args['pseudocount']), len(ctypes)), []).append(
+                    (i, inputs, aacounts))
+        except Exception:
+            endRun(i, traceback.format_exc())
+
+    # compute preferences for each group of samples in one array
+    for ((sites, wts, charlist, pseudocount, nctypes), group) in \
+            groups.items():
+        try:
+            counts = [numpy.array(c) for c in zip(*[aacounts for
+                    (i, inputs, aacounts) in group])]
+            if nctypes == 2:
+                counts += [None, None]
+            prefs = inferPrefsByRatioArray([charlist.index(wt) for wt in
+                    wts], *counts, pseudocount=pseudocount)
+        except Exception:
+            error = traceback.format_exc()
+            for (i, inputs, aacounts) in group:
+                endRun(i, error)
+            continue
+        for ((i, inputs, aacounts), sampleprefs) in zip(group, prefs):
+            (logger, files, manifestargs) = runs[i]
+            try:
+                sampleprefs = pandas.DataFrame(sampleprefs,
+                        columns=list(charlist))
+                sampleprefs.insert(0, 'site', sites)
+                logger.info("Writing preferences to {0}".format(
+                        files['prefs']))
+                dms_tools2.utils.writeTable(sampleprefs, files['prefs'])
+                dms_tools2.utils.writeManifest(files['manifest'],
+                        manifestargs, inputs, [files['prefs']])
+            except Exception:
+                endRun(i, traceback.format_exc())
+            else:
+                endRun(i)
+
+    return errors
+
 
 def inferSitePrefs(charlist, wtchar, error_model, counts, 
         priors, seed=1, niter=10000, increasetries=5, n_jobs=1, 
-        r_max=1.1, neff_min=100, nchains=4, increasefac=2):
+        r_max=1.1, neff_min=100, nchains=4, increasefac=2,
+        backend='pystan'):
     """Infers site-specific preferences by MCMC for a specific site.
 
     Infer the site-specific preferences :math:`\pi_{r,a}` for some site
@@ -530,7 +1118,9 @@ def inferSitePrefs(charlist, wtchar, error_model, counts,
         `counts` (dict)
             Deep sequencing counts. Each string key should specify
             a dict keyed by all characters in `charlist` with
-            the values giving integer counts for that character. The keys:
+            the values giving integer counts for that character,
+            or an array of these counts in the order of `charlist`.
+            The keys:
 
                 - `pre`: :math:`\\boldsymbol{\mathbf{n_r^{\\rm{pre}}}}`
 
@@ -547,7 +1137,8 @@ def inferSitePrefs(charlist, wtchar, error_model, counts,
         `priors` (dict)
             Specifies parameter vectors for Dirichlet priors. Each string
             key should specify a dict keyed by all characters and values
-            giving the prior for that character. Values less than 
+            giving the prior for that character, or an array of these
+            values in the order of `charlist`. Values less than 
             `PRIOR_MIN_VALUE` are set to `PRIOR_MIN_VALUE`. Keys are
 
                 - `pir_prior_params`: :math:`\\boldsymbol{\mathbf{a_{\pi,r}}}`
@@ -578,6 +1169,18 @@ def inferSitePrefs(charlist, wtchar, error_model, counts,
             times to increase the number of iterations. If the effective
             sample size exceeds 3 times `neff_min` then we allow
             R to be `1 + 1.5 (r_max - 1)`.
+        `backend` (str)
+            Sampler used for the MCMC:
+
+              - `pystan`: the No-U-Turn sampler of ``pystan``.
+
+              - `numpy`: Hamiltonian Monte Carlo implemented with `numpy`,
+                which avoids compiling ``pystan`` models. The simplices
+                are parameterized by their log ratios to the last
+                character, and the step size and a diagonal metric are
+                adapted during warmup in the same windows as ``pystan``.
+                The R and effective sample size are computed as by
+                ``pystan``. `n_jobs` is ignored.
 
     Returns:
         The tuple `(converged, pi_means, pi_95credint, logstring)` where:
@@ -588,6 +1191,15 @@ def inferSitePrefs(charlist, wtchar, error_model, counts,
                giving median-centered credible interval for :math:`\pi_{r,a}`.
             - `logstring` is a string describing MCMC run and convergence.
     """
+    if backend == 'numpy':
+        # there is no separate single-site model for this backend
+        return inferBlockPrefs(charlist, [wtchar], _errorModelName(
+                error_model), [counts], [priors], seed=seed, niter=niter,
+                increasetries=increasetries, r_max=r_max,
+                neff_min=neff_min, nchains=nchains, increasefac=increasefac,
+                backend='numpy')[0]
+    elif backend != 'pystan':
+        raise ValueError("Invalid backend {0}".format(backend))
     logstring = ['\tBeginning MCMC at %s' % time.asctime()]
     random.seed(seed)
     numpy.random.seed(seed)
@@ -595,44 +1207,12 @@ def inferSitePrefs(charlist, wtchar, error_model, counts,
     assert niter >= 100, "niter must be at least 100"
     assert len(charlist) == len(set(charlist))
     assert wtchar in charlist
-    data = {'Nchar':len(charlist), 
-            'iwtchar':charlist.index(wtchar) + 1,
-            'nrpre':[counts['pre'][c] for c in charlist],
-            'nrpost':[counts['post'][c] for c in charlist],
-            'pir_prior_params':[max(PRIOR_MIN_VALUE, 
-                    priors['pir_prior_params'][c]) for c in charlist],
-            'mur_prior_params':[max(PRIOR_MIN_VALUE, 
-                    priors['mur_prior_params'][c]) for c in charlist],
-           }
-    if error_model == 'none':
-        sm = StanModelNoneErr().model
-    elif isinstance(error_model, StanModelNoneErr):
-        sm = error_model.model
-        error_model = 'none'
-    elif error_model == 'same' or isinstance(error_model, StanModelSameErr):
-        if error_model == 'same':
-            sm = StanModelSameErr().model
-        else:
-            sm = error_model.model
-            error_model = 'same'
-        data['nrerr'] = [counts['err'][c] for c in charlist]
-        data['epsilonr_prior_params'] = [max(PRIOR_MIN_VALUE, 
-                priors['epsilonr_prior_params'][c]) for c in charlist]
-    elif (error_model == 'different' or 
-            isinstance(error_model, StanModelDifferentErr)):
-        if error_model == 'different':
-            sm = StanModelDifferentErr().model
-        else:
-            sm = error_model.model
-            error_model = 'different'
-        data['nrerrpre'] = [counts['errpre'][c] for c in charlist]
-        data['nrerrpost'] = [counts['errpost'][c] for c in charlist]
-        data['epsilonr_prior_params'] = [max(PRIOR_MIN_VALUE, 
-                priors['epsilonr_prior_params'][c]) for c in charlist]
-        data['rhor_prior_params'] = [max(PRIOR_MIN_VALUE, 
-                priors['rhor_prior_params'][c]) for c in charlist]
-    else:
-        raise ValueError("Invalid error_model {0}".format(error_model))
+    (error_model, sm) = _stanModelForErrorModel(error_model, {
+            'none':StanModelNoneErr,
+            'same':StanModelSameErr,
+            'different':StanModelDifferentErr,
+            })
+    data = _siteData(charlist, wtchar, error_model, counts, priors)
 
     ntry = 0
     while True: # run until converged or tries exhausted
@@ -643,49 +1223,13 @@ def inferSitePrefs(charlist, wtchar, error_model, counts,
         # extract output
         fitsummary = fit.summary()
         rownames = list(fitsummary['summary_rownames'])
-        colnames = list(fitsummary['summary_colnames'])
-        summary = fitsummary['summary']
-        char_row_indices = dict([(c, rownames.index('pir[{0}]'.format(
-                charlist.index(c)))) for c in charlist]) 
-        rindex = colnames.index('Rhat')
-        neffindex = colnames.index('n_eff')
-        rlist = [summary[char_row_indices[c]][rindex] for c in charlist]
-        rhat_is_nan = [rhat for rhat in rlist if math.isnan(rhat)]
-        rlist = [rhat for rhat in rlist if not math.isnan(rhat)]
-        nefflist = [summary[char_row_indices[c]][neffindex] for c in charlist]
-        neffmean = sum(nefflist) / float(len(nefflist))
-        if not rlist:
-            assert len(rhat_is_nan) == len(charlist)
-            rmean = None
-            logstring.append('\tAfter {0} MCMC chains each of {1} steps, '
-                    'mean R = nan and mean Neff = {2}'.format(
-                    nchains, niter, neffmean))
-        else:
-            rmean = sum(rlist) / float(len(rlist))
-            logstring.append('\tAfter {0} MCMC chains each of {1} steps, '
-                    'mean R = {2} and mean Neff = {3}'.format(
-                    nchains, niter, rmean, neffmean))
-        if rhat_is_nan:
-            logstring.append('\t\tThere are {0} characters where R is nan'
-                    .format(len(rhat_is_nan)))
-        # allow convergence with stringent criteria when Rhat is nan
-        # pystan appears to give Rhat of nan for sites with low preference
-        # pystan Rhat values of nan are a bug according to pystan developers
-        if ((len(rhat_is_nan) < 0.25 * len(charlist) and 
-                rmean != None and rmean <= r_max and neffmean >= neff_min) 
-                or (neffmean >= 3.0 * neff_min and ((rmean == None) 
-                or (rmean != None and rmean <= 1.0 + 1.5 * (r_max - 1.0))))):
-            # converged
+        (converged, pi_means, pi_95credint, convergencelog) = \
+                _siteConvergence(fitsummary, [rownames.index('pir[{0}]'
+                .format(i)) for i in range(len(charlist))], charlist,
+                nchains, niter, r_max, neff_min)
+        logstring.append(convergencelog)
+        if converged:
             logstring.append('\tMCMC converged at {0}.'.format(time.asctime()))
-            meanindex = colnames.index('mean')
-            lower95index = colnames.index('2.5%')
-            upper95index = colnames.index('97.5%')
-            pi_means = dict([(c, summary[char_row_indices[c]][meanindex]) 
-                    for c in charlist])
-            pi_95credint = dict([(c, 
-                    (summary[char_row_indices[c]][lower95index], 
-                    summary[char_row_indices[c]][upper95index])) 
-                    for c in charlist])
             return (True, pi_means, pi_95credint, '\n'.join(logstring))
         else:
             # failed to converge
@@ -700,18 +1244,674 @@ def inferSitePrefs(charlist, wtchar, error_model, counts,
                     pickle.dump((counts, init, fitsummary), f_debug)
                 logstring.append("\tMCMC FAILED to converge after "
                         "all attempts at {0}.".format(time.asctime()))
-                meanindex = colnames.index('mean')
-                lower95index = colnames.index('2.5%')
-                upper95index = colnames.index('97.5%')
-                pi_means = dict([(c, summary[char_row_indices[c]][meanindex]) 
-                        for c in charlist])
-                pi_95credint = dict([(c, 
-                        (summary[char_row_indices[c]][lower95index], 
-                        summary[char_row_indices[c]][upper95index])) 
-                        for c in charlist])
                 return (False, pi_means, pi_95credint, '\n'.join(logstring))
 
 
+def inferBlockPrefs(charlist, wtchars, error_model, counts,
+        priors, seed=1, niter=10000, increasetries=5, n_jobs=1,
+        r_max=1.1, neff_min=100, nchains=4, increasefac=2,
+        backend='pystan'):
+    """Infers site-specific preferences by MCMC for a block of sites.
+
+    The sites are conditionally independent, so fitting them jointly
+    in one MCMC gives each site the same posterior as `inferSitePrefs`
+    while only starting the sampler once for the whole block.
+    Convergence is assessed separately for each site using the same
+    criteria as `inferSitePrefs`, and only the sites that fail to
+    converge are run again with more iterations.
+
+    Args:
+        `charlist` (list)
+            List of valid characters (e.g., codons, amino acids, nts).
+        `wtchars` (list)
+            Wildtype character at each site in the block.
+        `error_model` (str or object)
+            Like for `inferSitePrefs`, but objects are instances of
+            `StanModelNoneErrBlock`, `StanModelSameErrBlock`, or
+            `StanModelDifferentErrBlock`.
+        `counts` (list)
+            Counts for each site in the format used by `inferSitePrefs`.
+        `priors` (list)
+            Priors for each site in the format used by `inferSitePrefs`.
+        `seed`, `n_jobs`, `niter`, `increasetries`, `r_max`, `neff_min`, `nchains`, `increasefac`, `backend`
+            Same meaning as for `inferSitePrefs`. With the `numpy`
+            backend, the memory used grows with the number of sites
+            times `niter`, and all sites are sampled at once.
+
+    Returns:
+        A list with an entry for each site that is the tuple
+        `(converged, pi_means, pi_95credint, logstring)` returned
+        by `inferSitePrefs`.
+    """
+    random.seed(seed)
+    numpy.random.seed(seed)
+    assert nchains >= 2, "nchains must be at least two"
+    assert niter >= 100, "niter must be at least 100"
+    assert len(charlist) == len(set(charlist))
+    assert len(wtchars) == len(counts) == len(priors) > 0
+    assert all([wtchar in charlist for wtchar in wtchars])
+    if backend == 'numpy':
+        error_model = _errorModelName(error_model)
+    elif backend == 'pystan':
+        (error_model, sm) = _stanModelForErrorModel(error_model, {
+                'none':StanModelNoneErrBlock,
+                'same':StanModelSameErrBlock,
+                'different':StanModelDifferentErrBlock,
+                })
+    else:
+        raise ValueError("Invalid backend {0}".format(backend))
+    sitedata = [_siteData(charlist, wtchar, error_model, sitecounts,
+            sitepriors) for (wtchar, sitecounts, sitepriors) in
+            zip(wtchars, counts, priors)]
+
+    logstrings = [['\tBeginning MCMC at %s' % time.asctime()]
+            for wtchar in wtchars]
+    results = [None] * len(wtchars)
+    remaining = list(range(len(wtchars)))
+    ntry = 0
+    while remaining: # run until all converged or tries exhausted
+        data = _blockData([sitedata[i] for i in remaining])
+        siteinits = [_initialValuePrefs(error_model, nchains,
+                charlist.index(wtchars[i]), len(charlist))
+                for i in remaining]
+        init = [dict([(par, numpy.array([siteinit[chain][par] for siteinit
+                in siteinits])) for par in siteinits[0][chain]])
+                for chain in range(nchains)]
+        if backend == 'pystan':
+            fit = sm.sampling(data=data, iter=niter, chains=nchains,
+                    seed=seed, n_jobs=n_jobs, refresh=-1, init=init)
+            # extract output
+            fitsummary = fit.summary(pars=['pir'])
+        else:
+            fitsummary = _samplingHMC(error_model, data, niter, init)
+        rowindex = dict([(name, irow) for (irow, name) in
+                enumerate(fitsummary['summary_rownames'])])
+        failed = []
+        for (iblock, i) in enumerate(remaining):
+            (converged, pi_means, pi_95credint, convergencelog) = \
+                    _siteConvergence(fitsummary, [rowindex['pir[{0},{1}]'
+                    .format(iblock, ichar)] for ichar in
+                    range(len(charlist))], charlist, nchains, niter,
+                    r_max, neff_min)
+            logstrings[i].append(convergencelog)
+            if converged:
+                logstrings[i].append('\tMCMC converged at {0}.'.format(
+                        time.asctime()))
+            elif ntry < increasetries:
+                failed.append(i)
+                continue
+            else:
+                logstrings[i].append("\tMCMC FAILED to converge after "
+                        "all attempts at {0}.".format(time.asctime()))
+            results[i] = (converged, pi_means, pi_95credint,
+                    '\n'.join(logstrings[i]))
+        if failed:
+            ntry += 1
+            niter = int(niter * increasefac)
+            for i in failed:
+                logstrings[i].append("\tMCMC failed to converge. Doing "
+                        "retry {0} with {1} iterations per chain.".format(
+                        ntry, niter))
+        elif any([not result[0] for result in results]):
+            with open('_no_converge_prefs_debug.pickle', 'wb') as f_debug:
+                pickle.dump(([counts[i] for i in remaining if not
+                        results[i][0]], init,
+                        fitsummary), f_debug)
+        remaining = failed
+    return results
+
+
+def inferBlockPrefsMAP(charlist, wtchars, error_model, counts,
+        priors, seed=1, nstarts=2, maxdiff=0.01):
+    """Infers site-specific preferences by posterior maximization.
+
+    Finds the maximum a posteriori (MAP) estimates of the preferences
+    for a block of sites under the same model as `inferBlockPrefs`,
+    using the ``pystan`` optimizer rather than MCMC. This is much
+    faster, but gives the posterior mode rather than the mean. The
+    optimization is started from `nstarts` random initial values, and
+    the estimate for a site is considered unreliable if any start fails
+    or if estimates from different starts differ by more than `maxdiff`.
+
+    Args:
+        `charlist`, `wtchars`, `error_model`, `counts`, `priors`
+            Same meaning as for `inferBlockPrefs`.
+        `seed` (int)
+            Random number seed.
+        `nstarts` (int)
+            Number of random starting values for the optimization.
+        `maxdiff` (float)
+            Largest difference in the estimate of any :math:`\pi_{r,a}`
+            between starts for the estimate to be considered reliable.
+
+    Returns:
+        A list with an entry for each site that is the tuple
+        `(reliable, pi_map, logstring)` where:
+            - `reliable` is `True` if the estimate looks reliable,
+              `False` otherwise.
+            - `pi_map` is dict keyed by characters in `charlist` with
+              the value giving the MAP estimate of :math:`\pi_{r,a}`,
+              or `None` if all starts failed.
+            - `logstring` is a string describing the optimization.
+    """
+    random.seed(seed)
+    numpy.random.seed(seed)
+    assert nstarts >= 1, "nstarts must be at least one"
+    assert len(charlist) == len(set(charlist))
+    assert len(wtchars) == len(counts) == len(priors) > 0
+    assert all([wtchar in charlist for wtchar in wtchars])
+    (error_model, sm) = _stanModelForErrorModel(error_model, {
+            'none':StanModelNoneErrBlock,
+            'same':StanModelSameErrBlock,
+            'different':StanModelDifferentErrBlock,
+            })
+    data = _blockData([_siteData(charlist, wtchar, error_model,
+            sitecounts, sitepriors) for (wtchar, sitecounts, sitepriors)
+            in zip(wtchars, counts, priors)])
+    siteinits = [_initialValuePrefs(error_model, nstarts,
+            charlist.index(wtchar), len(charlist)) for wtchar in wtchars]
+
+    estimates = []
+    for istart in range(nstarts):
+        init = dict([(par, numpy.array([siteinit[istart][par] for siteinit
+                in siteinits])) for par in siteinits[0][istart]])
+        try:
+            opt = sm.optimizing(data=data, init=init, seed=seed + istart)
+        except RuntimeError:
+            continue # optimizer failed from this start
+        estimates.append(numpy.reshape(opt['pir'],
+                (len(wtchars), len(charlist))))
+
+    results = []
+    for isite in range(len(wtchars)):
+        if not estimates:
+            results.append((False, None, '\tOptimization FAILED from all '
+                    '{0} starts.'.format(nstarts)))
+            continue
+        siteestimates = numpy.array([est[isite] for est in estimates])
+        pi = siteestimates.mean(axis=0)
+        pi /= pi.sum()
+        diff = (siteestimates.max(axis=0) - siteestimates.min(axis=0)).max()
+        reliable = len(estimates) == nstarts and diff <= maxdiff
+        results.append((reliable, dict(zip(charlist, pi)),
+                '\tMAP estimate from {0} of {1} optimizer starts, with a '
+                'maximum difference between starts of {2:.3g}.'.format(
+                len(estimates), nstarts, diff)))
+    return results
+
+
+def _blockData(sitedata):
+    """Data for block ``pystan`` model from `_siteData` for each site."""
+    data = {'Nsite':len(sitedata), 'Nchar':sitedata[0]['Nchar']}
+    for key in sitedata[0]:
+        if key != 'Nchar':
+            data[key] = [d[key] for d in sitedata]
+    return data
+
+
+def _stanModelForErrorModel(error_model, modelclasses):
+    """Gets ``pystan`` model for `inferSitePrefs` or `inferBlockPrefs`.
+
+    Args:
+        `error_model` (str or object)
+            Name of error model, or instance of one of `modelclasses`.
+        `modelclasses` (dict)
+            Keyed by `none`, `same`, and `different`, values are the
+            model classes for those error models.
+
+    Returns:
+        The 2-tuple `(error_model, sm)` where `error_model` is the
+        name of the error model and `sm` is the compiled model.
+    """
+    for (name, modelclass) in modelclasses.items():
+        if error_model == name:
+            return (name, modelclass().model)
+        elif isinstance(error_model, modelclass):
+            return (name, error_model.model)
+    raise ValueError("Invalid error_model {0}".format(error_model))
+
+
+def _errorModelName(error_model):
+    """Name of `error_model`, which is a name or model instance."""
+    for (name, modelclasses) in [
+            ('none', (StanModelNoneErr, StanModelNoneErrBlock)),
+            ('same', (StanModelSameErr, StanModelSameErrBlock)),
+            ('different', (StanModelDifferentErr,
+                    StanModelDifferentErrBlock)),
+            ]:
+        if error_model == name or isinstance(error_model, modelclasses):
+            return name
+    raise ValueError("Invalid error_model {0}".format(error_model))
+
+
+def _samplingHMC(error_model, data, niter, init, nleapfrog=10,
+        target_accept=0.8):
+    """Samples block ``pystan`` model with `numpy` Hamiltonian Monte Carlo.
+
+    Used for the `numpy` backend of `inferBlockPrefs`. The chains and
+    sites are all sampled at once, each with its own step size and
+    diagonal metric. The first half of the `niter` iterations of each
+    chain are warmup, with adaptation as in ``pystan``. Because the
+    number of leapfrog steps is fixed, the chains start from random
+    values near estimates from the counts rather than far in the tails
+    of the posterior, falling back to `init` where these are invalid.
+
+    Args:
+        `error_model` (str)
+            Name of the error model.
+        `data` (dict)
+            Data for the block ``pystan`` model.
+        `niter` (int)
+            Number of iterations per chain.
+        `init` (list)
+            Initial values for each chain as for the ``pystan`` model,
+            used where those from the counts are invalid.
+        `nleapfrog` (int)
+            Number of leapfrog steps per iteration.
+        `target_accept` (float)
+            Target acceptance probability for step size adaptation.
+
+    Returns:
+        A dict summarizing the samples of `pir` like the summary of
+        a ``pystan`` fit, with columns for the mean, 2.5% and 97.5%
+        quantiles, effective sample size, and split R.
+    """
+    logpgrad = _LogPosteriorHMC(error_model, data)
+    nchains = len(init)
+    nwarmup = niter // 2
+    x0 = numpy.array([[chaininit[par] for par in logpgrad.pars]
+            for chaininit in init], dtype='float').swapaxes(1, 2)
+    z = numpy.log(x0[..., : -1]) - numpy.log(x0[..., -1 : ])
+    inv_metric = numpy.broadcast_to(logpgrad.initialInvMetric(),
+            z.shape).copy()
+    (logp, grad) = logpgrad(z)
+    zcounts = logpgrad.initialValues()
+    for scale in [0.0, 2.0]:
+        ztry = zcounts + scale * numpy.sqrt(inv_metric) * (
+                numpy.random.normal(size=z.shape))
+        (logptry, gradtry) = logpgrad(ztry)
+        valid = numpy.isfinite(logptry)
+        z = numpy.where(valid[:, :, None, None], ztry, z)
+        grad = numpy.where(valid[:, :, None, None], gradtry, grad)
+        logp = numpy.where(valid, logptry, logp)
+    draws = numpy.empty((nchains, niter - nwarmup) + x0.shape[1 : 2] +
+            x0.shape[3 : ], dtype='float')
+
+    def leapfrog(z, p, grad, stepsize, nsteps):
+        """Leapfrog trajectory, returns `(z, p, logp, grad)`."""
+        eps = stepsize[:, :, None, None]
+        diverged = numpy.zeros(stepsize.shape, dtype='bool')
+        for istep in range(nsteps):
+            p = p + 0.5 * eps * grad
+            z = z + eps * inv_metric * p
+            (logp, grad) = logpgrad(z)
+            diverged |= ~numpy.isfinite(logp)
+            grad = numpy.where(numpy.isfinite(grad), grad, 0.0)
+            p = p + 0.5 * eps * grad
+        logp = numpy.where(diverged, -numpy.inf, logp)
+        return (z, p, logp, grad)
+
+    def hamiltonian(logp, p):
+        return -logp + 0.5 * (inv_metric * p**2).sum(axis=(2, 3))
+
+    def momentum():
+        return numpy.random.normal(size=z.shape) / numpy.sqrt(inv_metric)
+
+    def initStepsize(z, logp, grad):
+        """Initial step sizes giving reasonable acceptance."""
+        stepsize = numpy.ones(logp.shape)
+        for itry in range(50):
+            p = momentum()
+            (_, pnew, logpnew, _) = leapfrog(z, p, grad, stepsize, 1)
+            with numpy.errstate(invalid='ignore'):
+                ok = (hamiltonian(logp, p) - hamiltonian(logpnew, pnew) >
+                        math.log(0.5))
+            if ok.all():
+                break
+            stepsize = numpy.where(ok, stepsize, 0.5 * stepsize)
+        return stepsize
+
+    # adaptation windows for metric as in ``pystan``
+    (init_buffer, term_buffer, window) = (75, 50, 25)
+    if init_buffer + term_buffer + window > nwarmup:
+        init_buffer = int(0.15 * nwarmup)
+        term_buffer = int(0.1 * nwarmup)
+        window = nwarmup - init_buffer - term_buffer
+    adapt_metric = nwarmup >= 20
+    next_window_end = init_buffer + window - 1
+    (welford_n, welford_mean, welford_m2) = (0, 0.0, 0.0)
+
+    # dual averaging of step size
+    stepsize = initStepsize(z, logp, grad)
+    (gamma, t0, kappa) = (0.05, 10, 0.75)
+    mu = numpy.log(10 * stepsize)
+    (counter, sbar, xbar) = (0, 0.0, 0.0)
+
+    for iiter in range(niter):
+        p = momentum()
+        jitter = numpy.random.uniform(0.9, 1.1, size=stepsize.shape)
+        (znew, pnew, logpnew, gradnew) = leapfrog(z, p, grad,
+                stepsize * jitter, nleapfrog)
+        with numpy.errstate(invalid='ignore'):
+            logaccept = numpy.minimum(0.0, hamiltonian(logp, p) -
+                    hamiltonian(logpnew, pnew))
+        logaccept = numpy.where(numpy.isnan(logaccept), -numpy.inf,
+                logaccept)
+        accept = numpy.log(numpy.random.uniform(size=logp.shape)) < logaccept
+        z = numpy.where(accept[:, :, None, None], znew, z)
+        grad = numpy.where(accept[:, :, None, None], gradnew, grad)
+        logp = numpy.where(accept, logpnew, logp)
+
+        if iiter < nwarmup:
+            counter += 1
+            eta = 1.0 / (counter + t0)
+            sbar = (1 - eta) * sbar + eta * (target_accept -
+                    numpy.exp(logaccept))
+            x = mu - sbar * math.sqrt(counter) / gamma
+            xeta = counter**(-kappa)
+            xbar = (1 - xeta) * xbar + xeta * x
+            stepsize = numpy.exp(x)
+            if (adapt_metric and init_buffer <= iiter <
+                    nwarmup - term_buffer):
+                welford_n += 1
+                delta = z - welford_mean
+                welford_mean = welford_mean + delta / welford_n
+                welford_m2 = welford_m2 + delta * (z - welford_mean)
+            if adapt_metric and iiter == next_window_end:
+                n = welford_n
+                var = welford_m2 / (n - 1)
+                inv_metric = (n / (n + 5.0)) * var + (5.0 / (n + 5.0)) * (
+                        1e-3 * inv_metric)
+                (welford_n, welford_mean, welford_m2) = (0, 0.0, 0.0)
+                if next_window_end != nwarmup - term_buffer - 1:
+                    window *= 2
+                    next_window_end = iiter + window
+                    if next_window_end + 2 * window >= nwarmup - term_buffer:
+                        next_window_end = nwarmup - term_buffer - 1
+                stepsize = initStepsize(z, logp, grad)
+                mu = numpy.log(10 * stepsize)
+                (counter, sbar, xbar) = (0, 0.0, 0.0)
+            if iiter == nwarmup - 1:
+                stepsize = numpy.exp(xbar)
+        else:
+            draws[:, iiter - nwarmup] = logpgrad.simplex(z[:, :, 0])
+
+    return _summarizeDraws(draws)
+
+
+class _LogPosteriorHMC:
+    """Log posterior and gradient for `_samplingHMC`.
+
+    Each simplex of `Nchar` elements is parameterized by the log ratios
+    of its first `Nchar - 1` elements to its last. Calling an instance
+    on these parameters (shape `(nchains, Nsite, npars, Nchar - 1)`)
+    returns the log posterior (including the Jacobian of the
+    transformation) for each chain and site, and its gradient.
+    """
+
+    def __init__(self, error_model, data):
+        """See main class docstring."""
+        self.error_model = error_model
+        self.pars = {'none':['pir', 'mur'],
+                     'same':['pir', 'mur', 'epsilonr'],
+                     'different':['pir', 'mur', 'epsilonr', 'rhor'],
+                     }[error_model]
+        arr = lambda key: numpy.asarray(data[key], dtype='float')
+        self.nrpre = arr('nrpre')
+        self.nrpost = arr('nrpost')
+        self.nrpostsum = self.nrpost.sum(axis=-1, keepdims=True)
+        self.pir_prior = arr('pir_prior_params')
+        self.mur_prior = arr('mur_prior_params')
+        self.deltar = numpy.zeros(self.nrpre.shape)
+        self.deltar[numpy.arange(data['Nsite']),
+                numpy.asarray(data['iwtchar']) - 1] = 1.0
+        if error_model == 'same':
+            self.nrerrpre = self.nrerrpost = arr('nrerr')
+            self.epsilonr_prior = arr('epsilonr_prior_params')
+        elif error_model == 'different':
+            self.nrerrpre = arr('nrerrpre')
+            self.nrerrpost = arr('nrerrpost')
+            self.epsilonr_prior = arr('epsilonr_prior_params')
+            self.rhor_prior = arr('rhor_prior_params')
+
+    @staticmethod
+    def simplex(z):
+        """Simplex from log ratios `z` along last axis."""
+        z = numpy.concatenate([z, numpy.zeros(z.shape[ : -1] + (1,))],
+                axis=-1)
+        x = numpy.exp(z - z.max(axis=-1, keepdims=True))
+        return x / x.sum(axis=-1, keepdims=True)
+
+    def initialValues(self):
+        """Log-ratio parameters estimated from counts."""
+        freqs = lambda n: (n + 0.5) / (n + 0.5).sum(axis=-1, keepdims=True)
+        if self.error_model == 'none':
+            (epsilonr, rhor) = (self.deltar, self.deltar)
+        else:
+            epsilonr = freqs(self.nrerrpre)
+            rhor = freqs(self.nrerrpost)
+        (fpre, fpost) = (freqs(self.nrpre), freqs(self.nrpost))
+        mur = numpy.maximum(fpre - epsilonr + self.deltar, 0.5 * fpre)
+        mur /= mur.sum(axis=-1, keepdims=True)
+        pir = numpy.maximum(fpost - rhor + self.deltar, 0.5 * fpost) / mur
+        pir /= pir.sum(axis=-1, keepdims=True)
+        x = numpy.stack([pir, mur, epsilonr, rhor][ : len(self.pars)],
+                axis=1)
+        return numpy.log(x[..., : -1]) - numpy.log(x[..., -1 : ])
+
+    def initialInvMetric(self):
+        """Guess of posterior variances of parameters from counts."""
+        counts = [self.nrpre + self.nrpost, self.nrpre]
+        if self.error_model != 'none':
+            counts.append(self.nrerrpre)
+        if self.error_model == 'different':
+            counts.append(self.nrerrpost)
+        var = 1.0 / (1.0 + numpy.array(counts).swapaxes(0, 1))
+        return var[..., : -1] + var[..., -1 : ]
+
+    def __call__(self, z):
+        """Returns `(logp, grad)`, see main class docstring."""
+        # parameters outside the valid region give infinite or nan values
+        with numpy.errstate(all='ignore'):
+            return self._logpGrad(z)
+
+    def _logpGrad(self, z):
+        """Implements `__call__`."""
+        zfull = numpy.concatenate([z, numpy.zeros(z.shape[ : -1] + (1,))],
+                axis=-1)
+        zmax = zfull.max(axis=-1, keepdims=True)
+        logx = zfull - zmax - numpy.log(numpy.exp(zfull - zmax).sum(
+                axis=-1, keepdims=True))
+        x = numpy.exp(logx)
+        (pir, mur) = (x[:, :, 0], x[:, :, 1])
+        pimu = (pir * mur).sum(axis=-1, keepdims=True)
+        fr = pir * mur / pimu
+        if self.error_model == 'none':
+            (m, f) = (mur, fr)
+        else:
+            epsilonr = x[:, :, 2]
+            rhor = x[:, :, 3] if self.error_model == 'different' else epsilonr
+            m = mur + epsilonr - self.deltar
+            f = fr + rhor - self.deltar
+        valid = (m > 0).all(axis=-1) & (f > 0).all(axis=-1)
+        m = numpy.where(m > 0, m, 1.0)
+        f = numpy.where(f > 0, f, 1.0)
+
+        # Dirichlet priors times Jacobian is sum of prior params * log(x)
+        logp = ((self.pir_prior * logx[:, :, 0]).sum(axis=-1) +
+                (self.mur_prior * logx[:, :, 1]).sum(axis=-1) +
+                (self.nrpre * numpy.log(m)).sum(axis=-1) +
+                (self.nrpost * numpy.log(f)).sum(axis=-1))
+        # x times derivative of log posterior with respect to x
+        hr = self.nrpost / f
+        h = fr * (hr - (fr * hr).sum(axis=-1, keepdims=True))
+        xgrad = [self.pir_prior + h, self.mur_prior + mur * self.nrpre / m + h]
+        if self.error_model != 'none':
+            logp += ((self.epsilonr_prior * logx[:, :, 2]).sum(axis=-1) +
+                    (self.nrerrpre * logx[:, :, 2]).sum(axis=-1))
+            xgrad.append(self.epsilonr_prior + self.nrerrpre +
+                    epsilonr * self.nrpre / m)
+            if self.error_model == 'same':
+                xgrad[2] = xgrad[2] + epsilonr * self.nrpost / f
+        if self.error_model == 'different':
+            logp += ((self.rhor_prior * logx[:, :, 3]).sum(axis=-1) +
+                    (self.nrerrpost * logx[:, :, 3]).sum(axis=-1))
+            xgrad.append(self.rhor_prior + self.nrerrpost +
+                    rhor * self.nrpost / f)
+        xgrad = numpy.stack(xgrad, axis=2)
+        grad = xgrad - x * xgrad.sum(axis=-1, keepdims=True)
+        logp = numpy.where(valid, logp, -numpy.inf)
+        return (logp, grad[..., : -1])
+
+
+def _summarizeDraws(draws):
+    """Summary like ``pystan`` of `pir` draws from `_samplingHMC`.
+
+    `draws` has shape `(nchains, ndraws, Nsite, Nchar)`. R is the split
+    R, and the effective sample size is computed from autocorrelations
+    averaged over chains and summed until they become negative, both as
+    in ``pystan``.
+    """
+    (nchains, ndraws, nsites, nchars) = draws.shape
+    rownames = []
+    summary = []
+    for isite in range(nsites):
+        d = draws[:, :, isite]
+        pooled = d.reshape(nchains * ndraws, nchars)
+        (lower, upper) = numpy.percentile(pooled, [2.5, 97.5], axis=0)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            # split R
+            n = ndraws // 2
+            split = numpy.concatenate([d[:, : n], d[:, ndraws - n : ]])
+            w = split.var(axis=1, ddof=1).mean(axis=0)
+            b_over_n = split.mean(axis=1).var(axis=0, ddof=1)
+            rhat = numpy.sqrt(((n - 1.0) / n * w + b_over_n) / w)
+            # effective sample size
+            centered = d - d.mean(axis=1, keepdims=True)
+            nfft = 2**int(math.ceil(math.log2(2 * ndraws)))
+            fft = numpy.fft.rfft(centered, n=nfft, axis=1)
+            acov = numpy.fft.irfft(fft * numpy.conjugate(fft), n=nfft,
+                    axis=1)[:, : ndraws] / ndraws
+            mean_var = (acov[:, 0] * ndraws / (ndraws - 1.0)).mean(axis=0)
+            var_plus = mean_var * (ndraws - 1.0) / ndraws
+            if nchains > 1:
+                var_plus = var_plus + d.mean(axis=1).var(axis=0, ddof=1)
+            rho = (1 - (mean_var - acov.mean(axis=0)) / var_plus)[1 : ]
+            rho = rho * numpy.cumprod(rho >= 0, axis=0)
+            neff = nchains * ndraws / (1 + 2 * rho.sum(axis=0))
+        for ichar in range(nchars):
+            rownames.append('pir[{0},{1}]'.format(isite, ichar))
+            summary.append([pooled[:, ichar].mean(), lower[ichar],
+                    upper[ichar], neff[ichar], rhat[ichar]])
+    return {'summary_rownames':numpy.array(rownames),
+            'summary_colnames':('mean', '2.5%', '97.5%', 'n_eff', 'Rhat'),
+            'summary':numpy.array(summary),
+            }
+
+
+def _siteData(charlist, wtchar, error_model, counts, priors):
+    """Data for ``pystan`` model of a site.
+
+    Args are same as for `inferSitePrefs`, except `error_model`
+    must be the name of the error model.
+    """
+    priorvalues = lambda prior: [max(PRIOR_MIN_VALUE, x) for x in
+            _charValues(priors[prior], charlist)]
+    data = {'Nchar':len(charlist), 
+            'iwtchar':charlist.index(wtchar) + 1,
+            'nrpre':_charValues(counts['pre'], charlist),
+            'nrpost':_charValues(counts['post'], charlist),
+            'pir_prior_params':priorvalues('pir_prior_params'),
+            'mur_prior_params':priorvalues('mur_prior_params'),
+           }
+    if error_model == 'same':
+        data['nrerr'] = _charValues(counts['err'], charlist)
+        data['epsilonr_prior_params'] = priorvalues('epsilonr_prior_params')
+    elif error_model == 'different':
+        data['nrerrpre'] = _charValues(counts['errpre'], charlist)
+        data['nrerrpost'] = _charValues(counts['errpost'], charlist)
+        data['epsilonr_prior_params'] = priorvalues('epsilonr_prior_params')
+        data['rhor_prior_params'] = priorvalues('rhor_prior_params')
+    else:
+        assert error_model == 'none', "Invalid error_model {0}".format(
+                error_model)
+    return data
+
+
+def _charValues(values, charlist):
+    """List of `values` for each character in `charlist`.
+
+    `values` is a dict keyed by character, or the values
+    in the order of `charlist`.
+    """
+    if isinstance(values, dict):
+        return [values[c] for c in charlist]
+    else:
+        assert len(values) == len(charlist), "wrong number of values"
+        return list(values)
+
+
+def _siteConvergence(fitsummary, rows, charlist, nchains, niter,
+        r_max, neff_min):
+    """Checks MCMC convergence for preferences at a site.
+
+    Args:
+        `fitsummary` (dict)
+            Summary of ``pystan`` fit.
+        `rows` (list)
+            Row in summary of :math:`\pi_{r,a}` for each character
+            in `charlist`.
+        `nchains`, `niter`, `r_max`, `neff_min`
+            Same meaning as for `inferSitePrefs`.
+
+    Returns:
+        The tuple `(converged, pi_means, pi_95credint, logstring)`
+        like `inferSitePrefs`, where `logstring` only describes
+        the convergence statistics.
+    """
+    logstring = []
+    colnames = list(fitsummary['summary_colnames'])
+    summary = fitsummary['summary']
+    char_row_indices = dict(zip(charlist, rows))
+    rindex = colnames.index('Rhat')
+    neffindex = colnames.index('n_eff')
+    rlist = [summary[char_row_indices[c]][rindex] for c in charlist]
+    rhat_is_nan = [rhat for rhat in rlist if math.isnan(rhat)]
+    rlist = [rhat for rhat in rlist if not math.isnan(rhat)]
+    nefflist = [summary[char_row_indices[c]][neffindex] for c in charlist]
+    neffmean = sum(nefflist) / float(len(nefflist))
+    if not rlist:
+        assert len(rhat_is_nan) == len(charlist)
+        rmean = None
+        logstring.append('\tAfter {0} MCMC chains each of {1} steps, '
+                'mean R = nan and mean Neff = {2}'.format(
+                nchains, niter, neffmean))
+    else:
+        rmean = sum(rlist) / float(len(rlist))
+        logstring.append('\tAfter {0} MCMC chains each of {1} steps, '
+                'mean R = {2} and mean Neff = {3}'.format(
+                nchains, niter, rmean, neffmean))
+    if rhat_is_nan:
+        logstring.append('\t\tThere are {0} characters where R is nan'
+                .format(len(rhat_is_nan)))
+    # allow convergence with stringent criteria when Rhat is nan
+    # pystan appears to give Rhat of nan for sites with low preference
+    # pystan Rhat values of nan are a bug according to pystan developers
+    converged = ((len(rhat_is_nan) < 0.25 * len(charlist) and 
+            rmean != None and rmean <= r_max and neffmean >= neff_min) 
+            or (neffmean >= 3.0 * neff_min and ((rmean == None) 
+            or (rmean != None and rmean <= 1.0 + 1.5 * (r_max - 1.0)))))
+    meanindex = colnames.index('mean')
+    lower95index = colnames.index('2.5%')
+    upper95index = colnames.index('97.5%')
+    pi_means = dict([(c, summary[char_row_indices[c]][meanindex]) 
+            for c in charlist])
+    pi_95credint = dict([(c, 
+            (summary[char_row_indices[c]][lower95index], 
+            summary[char_row_indices[c]][upper95index])) 
+            for c in charlist])
+    return (converged, pi_means, pi_95credint, '\n'.join(logstring))
+
 def prefsToMutFromWtEffects(prefs, charlist, wts):
     """Converts preferences effects of mutations away from wildtype.
 
@@ -950,7 +2150,7 @@ def avgPrefs(prefsfiles):
     True
     """
     assert len(prefsfiles) >= 1
-    prefs = [pandas.read_csv(f, index_col='site').sort_index()
+    prefs = [dms_tools2.utils.readTable(f, index_col='site').sort_index()
             for f in prefsfiles]
 
     # make sure all have the same columns in the same order
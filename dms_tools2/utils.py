@@ -14,7 +14,14 @@ import time
 import platform
 import importlib
 import logging
+import gzip
+import zlib
+import json
+import hashlib
+import queue
+import threading
 import tempfile
+import functools
 import itertools
 import collections
 import random
@@ -23,7 +30,6 @@ import numpy
 import scipy.misc
 import scipy.special
 import pandas
-import HTSeq
 
 import dms_tools2
 from dms_tools2 import CODONS, CODON_TO_AA, AAS_WITHSTOP, AA_TO_CODONS
@@ -54,7 +60,7 @@ def sessionInfo():
     return '\n'.join(s)
 
 
-def initLogger(logfile, prog, args):
+def initLogger(logfile, prog, args, loggername=None):
     """Initialize output logging for scripts.
 
     Args:
@@ -66,6 +72,10 @@ def initLogger(logfile, prog, args):
             Name of program for which we are logging.
         `args` (dict)
             Program arguments as arg / value pairs.
+        `loggername` (str or `None`)
+            Name of the `logging.Logger`, by default `prog`. Use a
+            different name for each of several runs of a program that
+            are logged at the same time.
 
     Returns:
         If `logfile` is a string giving a file name, returns
@@ -86,7 +96,7 @@ def initLogger(logfile, prog, args):
             os.remove(logfile)
         logging.basicConfig(level=logging.INFO,
                 format='%(asctime)s - %(levelname)s - %(message)s')
-        logger = logging.getLogger(prog)
+        logger = logging.getLogger(loggername or prog)
         logfile_handler = logging.FileHandler(logfile)
         logger.addHandler(logfile_handler)
         formatter = logging.Formatter(
@@ -107,6 +117,209 @@ def initLogger(logfile, prog, args):
         return logger
 
 
+def writeManifest(manifest, args, inputs, outputs):
+    """Records the inputs, arguments, and outputs of a program.
+
+    A program writes this manifest after successfully creating its
+    outputs. A later run with ``--use_existing yes`` then only skips
+    the work if `manifestMatches`, so changed inputs, arguments, or
+    `dms_tools2` version cause it to be re-run.
+
+    Args:
+        `manifest` (str)
+            Name of the JSON file created.
+        `args` (dict)
+            Program arguments that affect the outputs, as arg / value
+            pairs. Must be JSON serializable.
+        `inputs` (list)
+            Names of input files.
+        `outputs` (list)
+            Names of output files, which must already exist.
+
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     (infile, outfile, manifest) = [os.path.join(tmpdir, f) for f in
+    ...             ['in.txt', 'out.txt', 'manifest.json']]
+    ...     for f in [infile, outfile]:
+    ...         with open(f, 'w') as fout:
+    ...             _ = fout.write('original')
+    ...     writeManifest(manifest, {'arg':1}, [infile], [outfile])
+    ...     print(manifestMatches(manifest, {'arg':1}),
+    ...           manifestMatches(manifest, {'arg':2}),
+    ...           manifestMatches(manifest, {'arg':1}, inputs=[outfile]))
+    ...     with open(infile, 'w') as fout:
+    ...         _ = fout.write('original')
+    ...     print(manifestMatches(manifest, {'arg':1}))
+    ...     with open(infile, 'w') as fout:
+    ...         _ = fout.write('changed')
+    ...     print(manifestMatches(manifest, {'arg':1}))
+    True False False
+    True
+    False
+    """
+    contents = {
+            'version':dms_tools2.__version__,
+            'args':json.loads(json.dumps(args, sort_keys=True)),
+            'inputs':{os.path.abspath(f):_fileHash(f) for f in inputs},
+            'outputs':{os.path.abspath(f):_fileHash(f) for f in outputs},
+            }
+    with open(manifest, 'w') as f:
+        json.dump(contents, f, indent=1, sort_keys=True)
+
+
+def manifestMatches(manifest, args, inputs=None):
+    """Are the outputs recorded by `writeManifest` up to date?
+
+    Args:
+        `manifest` (str)
+            Name of the file written by `writeManifest`.
+        `args` (dict)
+            Program arguments as passed to `writeManifest`.
+        `inputs` (list or `None`)
+            If not `None`, the names of the input files must be exactly
+            these, in any order.
+
+    Returns:
+        `True` if `manifest` exists and was written by this version of
+        `dms_tools2` with the same `args`, and all of its inputs and
+        outputs still exist with the same contents. `False` otherwise.
+        Files with the same size and modification time as recorded are
+        assumed unchanged; others are compared by their SHA-256 hash.
+    """
+    try:
+        with open(manifest) as f:
+            contents = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if (contents.get('version') != dms_tools2.__version__ or
+            contents.get('args') != json.loads(json.dumps(args,
+            sort_keys=True))):
+        return False
+    if inputs is not None and (set(contents['inputs']) !=
+            set(map(os.path.abspath, inputs))):
+        return False
+    for files in [contents['inputs'], contents['outputs']]:
+        for (f, recorded) in files.items():
+            if not os.path.isfile(f):
+                return False
+            stat = os.stat(f)
+            if stat.st_size != recorded['size']:
+                return False
+            if (stat.st_mtime_ns != recorded['mtime_ns'] and
+                    _fileHash(f)['sha256'] != recorded['sha256']):
+                return False
+    return True
+
+
+def _fileHash(filename):
+    """Size, modification time, and SHA-256 hash of `filename`."""
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    stat = os.stat(filename)
+    return {'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns,
+            'sha256':sha256.hexdigest()}
+
+
+#: suffix of files for each format of tables written by `writeTable`
+TABLE_SUFFIXES = collections.OrderedDict([
+        ('csv', '.csv'),
+        ('parquet', '.parquet'),
+        ])
+
+#: columns stored as categoricals in binary tables by `writeTable`
+_CATEGORICAL_COLS = ['site', 'wildtype', 'mutation']
+
+
+def tableFile(prefix, outformat):
+    """Name of table file with `prefix` in format `outformat`.
+
+    >>> tableFile('results/sample_mutdiffsel', 'parquet')
+    'results/sample_mutdiffsel.parquet'
+    """
+    return prefix + TABLE_SUFFIXES[outformat]
+
+
+def findTableFile(filename, suffix=''):
+    """Finds existing table file `filename` in any format.
+
+    Args:
+        `filename` (str)
+            Name of file, or its prefix.
+        `suffix` (str)
+            If there is no file `filename`, look for `filename` plus
+            `suffix` plus each of the suffixes in `TABLE_SUFFIXES`.
+
+    Returns:
+        The name of the file found, or `None` if there is none.
+    """
+    for f in [filename] + [tableFile(filename + suffix, outformat) for
+            outformat in TABLE_SUFFIXES]:
+        if os.path.isfile(f):
+            return f
+    return None
+
+
+def writeTable(df, filename, index=False, **kwargs):
+    """Writes `df` to `filename` in the format given by its suffix.
+
+    Files ending in the ``parquet`` suffix of `TABLE_SUFFIXES` are
+    written in the binary columnar Parquet format (this requires
+    ``pyarrow``). Any `site`, `wildtype`, and `mutation` columns are
+    stored as categoricals, and the other columns keep their ``numpy``
+    dtypes, so floats are not rounded. Other files are written as CSV
+    with `pandas.DataFrame.to_csv`, which is passed `kwargs`.
+
+    Tables in either format can be read with `readTable`.
+
+    >>> df = pandas.DataFrame({'site':[1, 2], 'wildtype':['A', 'C'],
+    ...         'mutation':['C', 'C'], 'mutdiffsel':[0.1, numpy.nan]})
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     f = tableFile(os.path.join(tmpdir, 'test'), 'csv')
+    ...     writeTable(df, f, na_rep='NaN')
+    ...     readTable(f).equals(df)
+    True
+    """
+    if filename.endswith(TABLE_SUFFIXES['parquet']):
+        if index:
+            df = df.reset_index()
+        df.assign(**dict([(c, df[c].astype('category')) for c in
+                _CATEGORICAL_COLS if c in df.columns])).to_parquet(
+                filename, index=False)
+    else:
+        df.to_csv(filename, index=index, **kwargs)
+
+
+def readTable(filename, index_col=None, **kwargs):
+    """Reads a table written by `writeTable` in either format.
+
+    Parquet files are recognized by their leading magic bytes whatever
+    their name. Categorical columns are converted back to plain columns,
+    so the data frame is the same as if it were read from CSV. Other
+    files are read with `pandas.read_csv`, which is passed `kwargs`.
+
+    Args:
+        `filename` (str)
+            File to read.
+        `index_col` (`None` or str)
+            Column to use as the index.
+
+    Returns:
+        A `pandas.DataFrame`.
+    """
+    with open(filename, 'rb') as f:
+        isparquet = f.read(4) == b'PAR1'
+    if not isparquet:
+        return pandas.read_csv(filename, index_col=index_col, **kwargs)
+    df = pandas.read_parquet(filename)
+    for c in df.columns:
+        if isinstance(df[c].dtype, pandas.CategoricalDtype):
+            df[c] = df[c].astype(df[c].cat.categories.dtype)
+    if index_col is not None:
+        df = df.set_index(index_col)
+    return df
+
+
 def iteratePairedFASTQ(r1files, r2files, r1trim=None, r2trim=None):
     """Iterates over FASTQ files for single or paired-end sequencing.
 
@@ -189,6 +402,98 @@ def iteratePairedFASTQ(r1files, r2files, r1trim=None, r2trim=None):
     True
     True
 
+    """
+    for (names, r1s, r2s, q1s, q2s, fails) in iteratePairedFASTQBatches(
+            r1files, r2files, r1trim=r1trim, r2trim=r2trim):
+        if r2s is None:
+            r2s = q2s = itertools.repeat(None)
+        yield from zip(names, r1s, r2s, q1s, q2s, fails)
+
+
+#: default size in bytes of blocks read by `iteratePairedFASTQBatches`
+FASTQ_BLOCKSIZE = 2**22
+
+
+def iteratePairedFASTQBatches(r1files, r2files, r1trim=None, r2trim=None,
+        blocksize=FASTQ_BLOCKSIZE, queuesize=4, positions=False,
+        start=None):
+    """Iterates over batches of reads in FASTQ files.
+
+    This function does the parsing for `iteratePairedFASTQ`. It reads
+    the files in large blocks and parses all complete read pairs in
+    each block with compiled code, which is much faster than parsing
+    one record at a time. Use it directly if you can operate on
+    batches of reads.
+
+    The R1 and R2 files are read and decompressed on separate threads,
+    and the reads are parsed on a third thread. These stages are
+    connected by bounded queues, so reading and parsing overlap with
+    whatever the caller does with each batch.
+
+    Args:
+        `r1files`, `r2files`, `r1trim`, `r2trim`
+            Same meaning as for `iteratePairedFASTQ`.
+        `blocksize` (int)
+            Approximate number of bytes read from each file at a time.
+        `queuesize` (int)
+            Maximum number of blocks or batches held in each queue
+            between the reading, parsing, and calling threads.
+        `positions` (bool)
+            Also return the position in the files after each batch.
+        `start` (`None` or 3-tuple)
+            Start at this position as returned when using `positions`
+            rather than at the start of the first file. It is an error
+            if the files are too short or there is not a FASTQ record
+            at this position.
+
+    Returns:
+        Each iteration returns `(names, r1s, r2s, q1s, q2s, fails)`
+        where each entry is a list giving the corresponding values
+        described in `iteratePairedFASTQ` for a batch of reads.
+        If there is no R2, then `r2s` and `q2s` are `None` rather
+        than lists. If `positions` is `True`, there is an additional
+        seventh entry `(ifile, offset1, offset2)` giving the index of
+        the current file pair and the number of decompressed bytes of
+        the R1 and R2 files parsed through the end of the batch.
+
+    >>> n1 = '@DH1DQQN1:933:HMLH5BCXY:1:1101:2165:1984 1:N:0:CGATGT'
+    >>> n2 = '@DH1DQQN1:933:HMLH5BCXY:1:1101:2165:1984 2:Y:0:CGATGT'
+    >>> tf = tempfile.NamedTemporaryFile
+    >>> with tf(mode='w') as r1file, tf(mode='w') as r2file:
+    ...     _ = r1file.write('\\n'.join([n1, 'ATGCA', '+', 'GGGII'] * 5))
+    ...     r1file.flush()
+    ...     _ = r2file.write('\\n'.join([n2, 'CATGC', '+', 'IIGGG'] * 5))
+    ...     r2file.flush()
+    ...     batches = list(iteratePairedFASTQBatches(r1file.name,
+    ...             r2file.name, r1trim=3, blocksize=100))
+    >>> len(batches) > 1
+    True
+    >>> names, r1s, r2s, q1s, q2s, fails = map(list,
+    ...         map(itertools.chain.from_iterable, zip(*batches)))
+    >>> names == [n1.split()[0][1 : ]] * 5
+    True
+    >>> r1s == ['ATG'] * 5 and q1s == ['GGG'] * 5
+    True
+    >>> r2s == ['CATGC'] * 5 and q2s == ['IIGGG'] * 5
+    True
+    >>> fails == [True] * 5
+    True
+
+    Get positions, and then restart after the first batch:
+
+    >>> with tf(mode='w') as r1file, tf(mode='w') as r2file:
+    ...     _ = r1file.write('\\n'.join([n1, 'ATGCA', '+', 'GGGII'] * 5))
+    ...     r1file.flush()
+    ...     _ = r2file.write('\\n'.join([n2, 'CATGC', '+', 'IIGGG'] * 5))
+    ...     r2file.flush()
+    ...     batches = list(iteratePairedFASTQBatches(r1file.name,
+    ...             r2file.name, blocksize=100, positions=True))
+    ...     restarted = list(iteratePairedFASTQBatches(r1file.name,
+    ...             r2file.name, blocksize=100, start=batches[0][-1]))
+    >>> batches[0][-1]
+    (0, 68, 68)
+    >>> sum(len(batch[0]) for batch in restarted) == 5 - len(batches[0][0])
+    True
     """
     if isinstance(r1files, str):
         r1files = [r1files]
@@ -202,50 +507,226 @@ def iteratePairedFASTQ(r1files, r2files, r1trim=None, r2trim=None):
         raise ValueError('`r1files` and `r2files` differ in length')
     elif not all(map(os.path.isfile, r2files)):
         raise ValueError('cannot find all `r2files`')
-    for (r1file, r2file) in zip(r1files, r2files):
-        r1reader = HTSeq.FastqReader(r1file, raw_iterator=True)
-        if r2file is None:
-            read_iterator = r1reader
-        else:
-            r2reader = HTSeq.FastqReader(r2file, raw_iterator=True)
-            read_iterator = zip(r1reader, r2reader)
-        for tup in read_iterator:
-            if r2file is None:
-               r1, id1, q1, qs1 = tup
-               r2 = q2 = None
+    for trim in [r1trim, r2trim]:
+        if (trim is not None) and trim < 0:
+            raise ValueError('read trims must be >= 0')
+    r1trim = -1 if r1trim is None else r1trim
+    r2trim = -1 if r2trim is None else r2trim
+    if blocksize < 1:
+        raise ValueError('`blocksize` must be >= 1')
+    if queuesize < 1:
+        raise ValueError('`queuesize` must be >= 1')
+    if start is None:
+        start = (0, 0, 0)
+    (startfile, startoffsets) = (start[0], start[1 : ])
+    if not (0 <= startfile <= len(r1files) and min(startoffsets) >= 0):
+        raise ValueError('invalid `start` of {0}'.format(start))
+
+    stop = threading.Event()
+    blockqueues = [queue.Queue(queuesize)]
+    if r2files[0] is not None:
+        blockqueues.append(queue.Queue(queuesize))
+    batchqueue = queue.Queue(queuesize)
+    threads = [threading.Thread(target=_readFASTQBlocks,
+                    args=(files[startfile : ], blocksize, q, stop,
+                          skipbytes), daemon=True)
+               for files, q, skipbytes in zip([r1files, r2files],
+                    blockqueues, startoffsets)]
+    threads.append(threading.Thread(target=_parseFASTQBlocks,
+            args=(len(r1files) - startfile, blockqueues, batchqueue,
+                  r1trim, r2trim, blocksize, stop),
+            kwargs={'startfile':startfile, 'startoffsets':startoffsets,
+                    'positions':positions},
+            daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            batch = batchqueue.get()
+            if batch is None:
+                break
+            elif isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+class _PipelineStopped(Exception):
+    """Raised in threads of `iteratePairedFASTQBatches` when stopped."""
+    pass
+
+
+def _queuePut(q, item, stop):
+    """Puts `item` in `q` unless `stop` is set first."""
+    while True:
+        if stop.is_set():
+            raise _PipelineStopped()
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _queueGet(q, stop):
+    """Gets item from `q` unless `stop` is set first, re-raises errors."""
+    while True:
+        if stop.is_set():
+            raise _PipelineStopped()
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+def _readBlocks(f, blocksize):
+    """Yields blocks of bytes of size `blocksize` from file `f`."""
+    with open(f, 'rb') as handle:
+        while True:
+            block = handle.read(blocksize)
+            if not block:
+                break
+            yield block
+
+
+def _gunzipBlocks(f, blocksize):
+    """Yields blocks of decompressed bytes from gzipped file `f`.
+
+    Decompresses large chunks with `zlib` directly rather than via
+    `gzip.GzipFile`, which holds the GIL far less. Handles multi-member
+    files (e.g., concatenated or BGZF). Blocks are at most `blocksize`.
+
+    >>> with tempfile.NamedTemporaryFile(suffix='.gz') as f:
+    ...     for data in [b'ACGT' * 10, b'', b'TTAA' * 3]:
+    ...         with gzip.open(f.name, 'ab') as fout:
+    ...             _ = fout.write(data)
+    ...     b''.join(_gunzipBlocks(f.name, 7)) == b'ACGT' * 10 + b'TTAA' * 3
+    ...     all(len(block) <= 7 for block in _gunzipBlocks(f.name, 7))
+    True
+    True
+    """
+    wbits = zlib.MAX_WBITS | 16
+    decompressor = zlib.decompressobj(wbits)
+    started = False
+    with open(f, 'rb') as handle:
+        while True:
+            data = handle.read(max(1, blocksize // 4))
+            if not data:
+                break
+            while data:
+                if decompressor.eof:
+                    # start of next member, skip any null padding
+                    data = data.lstrip(b'\x00')
+                    if not data:
+                        break
+                    decompressor = zlib.decompressobj(wbits)
+                started = True
+                yield decompressor.decompress(data, blocksize)
+                data = decompressor.unconsumed_tail
+                if decompressor.eof:
+                    data = decompressor.unused_data
+        if started and not decompressor.eof:
+            raise EOFError("Compressed file {0} ended before the "
+                    "end-of-stream marker was reached".format(f))
+
+
+def _readFASTQBlocks(fastqfiles, blocksize, q, stop, skipbytes=0):
+    """Puts blocks of decompressed bytes from `fastqfiles` into `q`.
+
+    Runs in its own thread for `iteratePairedFASTQBatches`. The end
+    of each file is indicated by an empty block. Errors are put in `q`.
+    The first `skipbytes` decompressed bytes of the first file are
+    discarded.
+    """
+    try:
+        for (ifile, f) in enumerate(fastqfiles):
+            if os.path.splitext(f)[1] == '.gz':
+                blocks = _gunzipBlocks(f, blocksize)
+            else:
+                blocks = _readBlocks(f, blocksize)
+            skip = skipbytes if ifile == 0 else 0
+            for block in blocks:
+                if skip:
+                    if len(block) <= skip:
+                        skip -= len(block)
+                        continue
+                    (block, skip) = (block[skip : ], 0)
+                if block:
+                    _queuePut(q, block, stop)
+            if skip:
+                raise ValueError("{0} is shorter than the start position "
+                        "{1}".format(f, skipbytes))
+            _queuePut(q, b'', stop)
+    except _PipelineStopped:
+        pass
+    except Exception as e:
+        try:
+            _queuePut(q, e, stop)
+        except _PipelineStopped:
+            pass
+
+
+def _parseFASTQBlocks(nfiles, blockqueues, batchqueue, r1trim, r2trim,
+        blocksize, stop, startfile=0, startoffsets=(0, 0), positions=False):
+    """Parses blocks from `blockqueues` into batches put in `batchqueue`.
+
+    Runs in its own thread for `iteratePairedFASTQBatches`. After all
+    `nfiles` files are parsed, puts `None` in `batchqueue`. Errors
+    are put in `batchqueue`. If `positions`, each batch includes the
+    position after it, given the first file is `startfile` and starts
+    at `startoffsets`.
+    """
+    try:
+        for ifile in range(startfile, startfile + nfiles):
+            bufs = [b'' for q in blockqueues]
+            eofs = [False for q in blockqueues]
+            if ifile == startfile:
+                offsets = list(startoffsets)
             else:
-                (r1, id1, q1, qs1), (r2, id2, q2, qs2) = tup
-                id2 = id2.split()
-                name2 = id2[0]
-            id1 = id1.split()
-            name1 = id1[0]
-            if r2file is not None:
-                # trims last two chars, need for SRA downloaded files
-                if name1[-2 : ] == '.1' and name2[-2 : ] == '.2':
-                    name1 = name1[ : -2]
-                    name2 = name2[ : -2]
-                if name1 != name2:
-                    raise ValueError(f"name mismatch {name1} vs {name2}")
-            # parse chastity filter assuming CASAVA 1.8 header
-            try:
-                f1 = id1[1][2]
-                if r2file is None:
-                    f2 = 'N'
+                offsets = [0, 0]
+            stalled = False
+            while True:
+                # top up each buffer to at least `blocksize` bytes
+                for i, q in enumerate(blockqueues):
+                    if (not eofs[i]) and (stalled or
+                            len(bufs[i]) < blocksize):
+                        block = _queueGet(q, stop)
+                        eofs[i] = not block
+                        bufs[i] += block
+                final = all(eofs)
+                (names, r1s, r2s, q1s, q2s, fails, n1, n2) = \
+                        dms_tools2._cutils.parseFASTQPairs(bufs[0],
+                        bufs[1] if len(bufs) > 1 else None,
+                        r1trim, r2trim, final)
+                bufs[0] = bufs[0][n1 : ]
+                offsets[0] += n1
+                if len(bufs) > 1:
+                    bufs[1] = bufs[1][n2 : ]
+                    offsets[1] += n2
+                if names:
+                    stalled = False
+                    batch = (names, r1s, r2s, q1s, q2s, fails)
+                    if positions:
+                        batch += ((ifile, offsets[0], offsets[1]),)
+                    _queuePut(batchqueue, batch, stop)
+                elif final:
+                    break
                 else:
-                    f2 = id2[1][2]
-                if f1 == 'N' and f2 == 'N':
-                    fail = False
-                elif f1 in ['N', 'Y'] and f2 in ['N', 'Y']:
-                    fail = True
-            except IndexError:
-                fail = None # header does not specify chastity filter
-            if r1trim is not None:
-                r1 = r1[ : r1trim]
-                q1 = q1[ : r1trim]
-            if (r2trim is not None) and (r2file is not None):
-                r2 = r2[ : r2trim]
-                q2 = q2[ : r2trim]
-            yield (name1, r1, r2, q1, q2, fail)
+                    stalled = True # records longer than buffers
+        _queuePut(batchqueue, None, stop)
+    except _PipelineStopped:
+        pass
+    except Exception as e:
+        try:
+            _queuePut(batchqueue, e, stop)
+        except _PipelineStopped:
+            pass
 
 
 def lowQtoN(r, q, minq, use_cutils=True):
@@ -279,15 +760,323 @@ def lowQtoN(r, q, minq, use_cutils=True):
             for (ri, qi) in zip(r, q)])
 
 
-def buildReadConsensus(reads, minreads, minconcur, use_cutils=True):
+def readsToArray(reads):
+    """Converts reads or Q-score strings to a 2D array of bytes.
+
+    Args:
+        `reads` (list)
+            List of reads (or Q-score strings) as ASCII strings.
+
+    Returns:
+        A 2D `numpy.uint8` array where row `i` holds the characters
+        of `reads[i]`. Reads shorter than the longest one are padded
+        at the 3' end with zeros.
+
+    >>> readsToArray(['ACG', 'T'])
+    array([[65, 67, 71],
+           [84,  0,  0]], dtype=uint8)
+    >>> arrayToReads(readsToArray(['ACG', 'T', ''])) == ['ACG', 'T', '']
+    True
+    """
+    arr = numpy.array(reads, dtype=bytes)
+    return arr.view(numpy.uint8).reshape(len(reads), arr.itemsize)
+
+
+def arrayToReads(arr):
+    """Inverse of `readsToArray`, converts 2D array back to strings."""
+    arr = numpy.ascontiguousarray(arr, dtype=numpy.uint8)
+    if arr.shape[1] == 0:
+        return [''] * arr.shape[0]
+    return (arr.view('S{0}'.format(arr.shape[1])).ravel()
+            .astype(str).tolist())
+
+
+def lowQtoNBatch(reads, quals, minq):
+    """Batch version of `lowQtoN` for many reads at once.
+
+    Args:
+        `reads` (2D `numpy.uint8` array)
+            Reads as returned by `readsToArray`.
+        `quals` (2D `numpy.uint8` array)
+            Q scores in Sanger ASCII encoding, same shape as `reads`.
+        `minq` (length-one string)
+            Replace all positions in `reads` where `quals` is < this.
+
+    Returns:
+        A copy of `reads` where low-quality positions are ``N``, as
+        are characters other than ``A``, ``C``, ``G``, ``T``, and ``N``
+        (such as lowercase, ``.``, or ambiguous nucleotide codes) so
+        that the reads can be packed by `packReadArrays`. Zeros padding
+        short reads are left unchanged.
+
+    >>> r = readsToArray(['ATGCAT', 'GGA'])
+    >>> q = readsToArray(['GB<.0+', '+GG'])
+    >>> arrayToReads(lowQtoNBatch(r, q, '0')) == ['ATGNAN', 'NGA']
+    True
+    >>> r = readsToArray(['AtG.RC', 'GGA'])
+    >>> arrayToReads(lowQtoNBatch(r, q, '0')) == ['ANGNNN', 'NGA']
+    True
+    """
+    if reads.shape != quals.shape:
+        raise ValueError("reads and quals not of same shape")
+    return numpy.where(((quals >= ord(minq)) & _VALID_NT_ARRAY[reads]) |
+            (reads == 0), reads, numpy.uint8(ord('N')))
+
+
+def barcodesFromBatch(r1, r2, bclen1, bclen2, encoded=False):
+    """Extracts barcodes from the start of batches of read pairs.
+
+    Batch version of getting the barcode from a pair of reads as
+    ``r1[ : bclen1] + r2[ : bclen2]``.
+
+    Args:
+        `r1` (2D `numpy.uint8` array)
+            R1 reads as returned by `readsToArray` or `lowQtoNBatch`.
+        `r2` (2D `numpy.uint8` array)
+            R2 reads, same number of rows as `r1`.
+        `bclen1` (int)
+            Length of barcode at start of R1.
+        `bclen2` (int)
+            Length of barcode at start of R2.
+        `encoded` (bool)
+            Return barcodes as integers from `encodeBarcodes` rather
+            than as strings.
+
+    Returns:
+        The 4-tuple `(barcodes, r1, r2, lowq)` where `barcodes` is
+        a list of the barcodes, `r1` and `r2` are views
+        of the read arrays with the barcodes removed, and `lowq`
+        is a boolean array that is `True` for barcodes with ``N``.
+
+    >>> r1 = readsToArray(['ACGTA', 'TTNAC'])
+    >>> r2 = readsToArray(['GGCAT', 'ACCAT'])
+    >>> barcodes, r1, r2, lowq = barcodesFromBatch(r1, r2, 3, 2)
+    >>> barcodes == ['ACGGG', 'TTNAC']
+    True
+    >>> arrayToReads(r1) == ['TA', 'AC'] and arrayToReads(r2) == ['CAT'] * 2
+    True
+    >>> lowq
+    array([False,  True])
+    >>> barcodesFromBatch(readsToArray(['AC', 'A']), readsToArray(['GG'] * 2),
+    ...         3, 2)[0] == ['ACGG', 'AGG']
+    True
+    >>> [decodeBarcode(bc) for bc in barcodesFromBatch(readsToArray(['AC']),
+    ...         readsToArray(['GG']), 3, 2, encoded=True)[0]] == ['ACGG']
+    True
+    """
+    if r1.shape[0] != r2.shape[0]:
+        raise ValueError("r1 and r2 differ in number of reads")
+    bcs = numpy.concatenate([r1[:, : bclen1], r2[:, : bclen2]], axis=1)
+    lowq = (bcs == ord('N')).any(axis=1)
+    if encoded:
+        return (encodeBarcodes(bcs)[0].tolist(), r1[:, bclen1 : ],
+                r2[:, bclen2 : ], lowq)
+    barcodes = arrayToReads(bcs)
+    for i in numpy.flatnonzero((bcs == 0).any(axis=1)):
+        barcodes[i] = barcodes[i].replace('\x00', '') # reads < barcode
+    return (barcodes, r1[:, bclen1 : ], r2[:, bclen2 : ], lowq)
+
+
+#: 2-bit codes of nucleotides in packed reads and encoded barcodes
+PACKED_NT_CODES = {'A':0, 'C':1, 'G':2, 'T':3}
+
+_NT_CODE_ARRAY = numpy.zeros(256, dtype=numpy.uint8)
+_VALID_NT_ARRAY = numpy.zeros(256, dtype='bool')
+for _nt, _code in PACKED_NT_CODES.items():
+    _NT_CODE_ARRAY[ord(_nt)] = _code
+    _VALID_NT_ARRAY[ord(_nt)] = True
+_VALID_NT_ARRAY[ord('N')] = _VALID_NT_ARRAY[0] = True
+
+
+def packReadArrays(*arrays):
+    """Packs reads into a compact 2-bit encoding.
+
+    Each read is packed into a record of 2 bytes giving its length
+    `L` (low 15 bits) and whether it has any ``N`` (high bit), then
+    `(L + 3) // 4` bytes holding the 2-bit code of each nucleotide
+    (see `PACKED_NT_CODES`), then only if the read has any ``N``,
+    `(L + 7) // 8` bytes with a bit set for each ``N``. Concatenated
+    records are packed reads, which can be passed to `buildReadConsensus`
+    or unpacked with `unpackReads`. This uses 1 / 4 to 3 / 8 of a byte per
+    nucleotide, versus over a byte per nucleotide plus object overhead
+    for strings.
+
+    Args:
+        `*arrays` (2D `numpy.uint8` arrays)
+            One or more arrays of reads as returned by `readsToArray`,
+            all with the same number of rows.
+
+    Returns:
+        A list with an entry for each row, which is a `bytes` object
+        of the concatenated records of the read in that row of each of
+        `arrays`. So `packReadArrays(r1, r2)` packs R1 / R2 pairs.
+
+    >>> r1 = readsToArray(['ACGTN', 'GGA'])
+    >>> r2 = readsToArray(['TTAC', 'CCANCCAAGT'])
+    >>> packed = packReadArrays(r1, r2)
+    >>> unpackReads(packed[0]) == ['ACGTN', 'TTAC']
+    True
+    >>> unpackReads(b''.join(packed), start=1, step=2) == ['TTAC', 'CCANCCAAGT']
+    True
+    """
+    nreads = arrays[0].shape[0]
+    if any(arr.shape[0] != nreads for arr in arrays):
+        raise ValueError("arrays differ in number of reads")
+    headers = [] # read length, plus 2**15 if read has N
+    packed = []
+    for arr in arrays:
+        if not _VALID_NT_ARRAY[arr].all():
+            raise ValueError("invalid nt")
+        lengths = (arr != 0).sum(axis=1)
+        if lengths.max(initial=0) >= 2**15:
+            raise ValueError("read too long to pack")
+        ncols = -(-arr.shape[1] // 8) * 8 # pad to multiple of 8
+        padded = numpy.zeros((nreads, ncols), dtype=numpy.uint8)
+        padded[:, : arr.shape[1]] = arr
+        isN = padded == ord('N')
+        headers.append(lengths + 2**15 * isN.any(axis=1))
+        codes = _NT_CODE_ARRAY[padded].reshape(nreads, ncols // 4, 4)
+        packed.append((
+                codes[:, :, 0] | (codes[:, :, 1] << 2) |
+                (codes[:, :, 2] << 4) | (codes[:, :, 3] << 6),
+                numpy.packbits(isN, axis=1, bitorder='little')
+                ))
+    headers = numpy.column_stack(headers)
+
+    # build records for all reads with same headers at once
+    records = [None] * nreads
+    for readheaders in numpy.unique(headers, axis=0):
+        rows = numpy.flatnonzero((headers == readheaders).all(axis=1))
+        columns = []
+        for ((codes, nmask), header) in zip(packed, readheaders):
+            rlen = header % 2**15
+            columns += [
+                    numpy.tile(numpy.array([header & 255, header >> 8],
+                                           dtype=numpy.uint8),
+                               (len(rows), 1)),
+                    codes[rows, : (rlen + 3) // 4],
+                    ]
+            if header >= 2**15:
+                columns.append(nmask[rows, : (rlen + 7) // 8])
+        recs = numpy.concatenate(columns, axis=1)
+        data = recs.tobytes()
+        width = recs.shape[1]
+        for (i, row) in enumerate(rows):
+            records[row] = data[i * width : (i + 1) * width]
+    return records
+
+
+def packReads(reads):
+    """Packs list of reads into packed reads as for `packReadArrays`.
+
+    >>> packed = packReads(['ACGT', 'NNAC', ''])
+    >>> len(packed) == 3 * 2 + 1 + (1 + 1)
+    True
+    >>> unpackReads(packed) == ['ACGT', 'NNAC', '']
+    True
+    """
+    return b''.join(packReadArrays(readsToArray(reads)))
+
+
+def unpackReads(packed, start=0, step=1):
+    """Unpacks reads packed by `packReadArrays` or `packReads`.
+
+    Args:
+        `packed` (bytes or bytearray)
+            Packed reads.
+        `start` (int)
+            Index of first read to unpack.
+        `step` (int)
+            Unpack every `step`-th read beginning with `start`.
+
+    Returns:
+        List of reads as strings.
+
+    >>> unpackReads(packReads(['AC', 'GT', 'TN', 'CA']), 1, 2) == ['GT', 'CA']
+    True
+    """
+    return dms_tools2._cutils.unpackReads(packed, start, step)
+
+
+def countPackedReads(packed):
+    """Number of reads in packed reads.
+
+    >>> countPackedReads(packReads(['ACG', 'TTAN']))
+    2
+    """
+    return dms_tools2._cutils.countPackedReads(packed)
+
+
+def encodeBarcodes(bcs):
+    """Encodes barcodes as integers using 2 bits per nucleotide.
+
+    Nucleotides are encoded with the codes in `PACKED_NT_CODES`, with
+    the first nucleotide in the most significant bits. An extra bit
+    above the most significant nucleotide marks the length, so
+    barcodes of different lengths have different codes and encoded
+    barcodes of the same length sort in the same order as strings.
+    Positions with ``N`` are encoded as ``A`` in the codes and are
+    indicated in a separate mask.
+
+    Args:
+        `bcs` (2D `numpy.uint8` array)
+            Barcodes as returned by `readsToArray`.
+
+    Returns:
+        The 2-tuple `(codes, nmask)` of 1D arrays. `codes` gives the
+        encoded barcodes, and `nmask` has bit `i` set if nucleotide
+        `i` is ``N``. These have `numpy.uint64` type for barcodes of
+        up to 31 nucleotides, and otherwise are arrays of Python ints.
+
+    >>> codes, nmask = encodeBarcodes(readsToArray(['ACGT', 'TTN', 'AC']))
+    >>> [decodeBarcode(code) for code in codes] == ['ACGT', 'TTA', 'AC']
+    True
+    >>> nmask.tolist()
+    [0, 4, 0]
+    >>> codes, nmask = encodeBarcodes(readsToArray(['ACGT' * 10]))
+    >>> decodeBarcode(codes[0]) == 'ACGT' * 10
+    True
+    """
+    if bcs.shape[1] <= 31:
+        (dtype, cast) = (numpy.uint64, numpy.uint64)
+    else:
+        (dtype, cast) = (object, int) # Python ints for long barcodes
+    codes = numpy.ones(bcs.shape[0], dtype=dtype)
+    nmask = numpy.zeros(bcs.shape[0], dtype=dtype)
+    if not _VALID_NT_ARRAY[bcs].all():
+        raise ValueError("invalid nt")
+    for j in range(bcs.shape[1]):
+        inbc = bcs[:, j] != 0
+        codes[inbc] = (codes[inbc] * cast(4) +
+                _NT_CODE_ARRAY[bcs[inbc, j]].astype(dtype))
+        nmask[inbc] += (bcs[inbc, j] == ord('N')).astype(dtype) * (
+                cast(1) << cast(j))
+    return (codes, nmask)
+
+
+def decodeBarcode(code):
+    """Decodes barcode encoded by `encodeBarcodes` to a string.
+
+    >>> decodeBarcode(0b1000110)
+    'ACG'
+    """
+    code = int(code)
+    bclen = (code.bit_length() - 1) // 2
+    return ''.join('ACGT'[(code >> (2 * (bclen - 1 - i))) & 3]
+                   for i in range(bclen))
+
+
+def buildReadConsensus(reads, minreads, minconcur, use_cutils=True,
+        start=0, step=1):
     """Builds consensus sequence of some reads.
 
     You may want to pre-fill low-quality sites with ``N``
     using `lowQtoN`. An ``N`` is considered a non-called identity.
 
     Args:
-        `reads` (list)
-            List of reads as strings. If reads are not all same
+        `reads` (list or bytes)
+            List of reads as strings, or packed reads as returned by
+            `packReads` or `packReadArrays`. If reads are not all same
             length, shorter ones are extended from 3' end with ``N``
             to match maximal length. 
         `minreads` (int)
@@ -298,6 +1087,12 @@ def buildReadConsensus(reads, minreads, minconcur, use_cutils=True):
             identities agree.
         `use_cutils` (bool)
             Use the faster implementation in the `_cutils` module.
+        `start` (int)
+            For packed `reads`, the first read to use.
+        `step` (int)
+            For packed `reads`, use every `step`-th read beginning
+            with `start`. For instance, use `start` of 0 and 1 with
+            `step` of 2 for reads packed as R1 / R2 pairs.
 
     Returns:
         A string giving the consensus sequence. Non-called 
@@ -309,13 +1104,23 @@ def buildReadConsensus(reads, minreads, minconcur, use_cutils=True):
     ...          'NTGNTA']
     >>> buildReadConsensus(reads, 2, 0.75) == 'ATGNNNAN'
     True
+    >>> buildReadConsensus(packReads(reads), 2, 0.75) == 'ATGNNNAN'
+    True
     >>> reads.append('CTGCATAT')
     >>> buildReadConsensus(reads, 2, 0.75) == 'NTGCATAT'
     True
+    >>> buildReadConsensus(packReads(reads), 2, 0.75,
+    ...         use_cutils=False) == 'NTGCATAT'
+    True
+    >>> buildReadConsensus(packReads(reads), 1, 0.75, start=1,
+    ...         step=3) == 'CTGCATAT'
+    True
     """
     if use_cutils:
         return dms_tools2._cutils.buildReadConsensus(reads, 
-                minreads, minconcur)
+                minreads, minconcur, start, step)
+    if not isinstance(reads, list):
+        reads = unpackReads(reads, start, step)
     readlens = list(map(len, reads))
     maxlen = max(readlens)
     consensus = []
@@ -458,11 +1263,12 @@ def alignSubamplicon(refseq, r1, r2, refseqstart, refseqend, maxmuts,
         `refseq` (str)
             Sequence to which we align. if `chartype` is 'codon',
             must be a valid coding (length multiple of 3).
-        `r1` (str)
-            The forward sequence to align.
-        `r2` (str)
+        `r1` (str or bytes)
+            The forward sequence to align, as a string or a packed
+            read as returned by `packReads`.
+        `r2` (str or bytes)
             The reverse sequence to align. When reverse complemented,
-            should read backwards in `refseq`.
+            should read backwards in `refseq`. Also can be packed.
         `refseqstart` (int)
             The nucleotide in `refseq` (1, 2, ... numbering) where the
             first nucleotide in `r1` aligns.
@@ -520,8 +1326,17 @@ def alignSubamplicon(refseq, r1, r2, refseqstart, refseqend, maxmuts,
     >>> s = alignSubamplicon(refseq, 'GGGCTA', 'TTAGCC', 3, 9, 1, 0, 'codon')
     >>> s == False 
     True
+    >>> s = alignSubamplicon(refseq, packReads(['GGGGAT']),
+    ...         packReads(['TATCCC']), 3, 9, 1, 0, 'codon')
+    >>> s == 'GGGGATA'
+    True
     """
-    r2 = reverseComplement(r2)
+    if isinstance(r2, str):
+        r2 = reverseComplement(r2)
+    else:
+        r2 = dms_tools2._cutils.reverseComplement(r2)
+    if not (use_cutils or isinstance(r1, str)):
+        (r1, r2) = (unpackReads(r1)[0], unpackReads(r2)[0])
 
     if use_cutils:
         return dms_tools2._cutils.alignSubamplicon(refseq, r1, r2, 
@@ -585,7 +1400,8 @@ def alignSubamplicon(refseq, r1, r2, refseqstart, refseqend, maxmuts,
     return subamplicon
 
 
-def incrementCounts(refseqstart, subamplicon, chartype, counts):
+def incrementCounts(refseqstart, subamplicon, chartype, counts,
+        increment=1):
     """Increment counts dict based on an aligned subamplicon.
 
     This is designed for keeping track of counts of different
@@ -604,12 +1420,18 @@ def incrementCounts(refseqstart, subamplicon, chartype, counts):
         `chartype` (str)
             Character type for which we are counting mutations.
             Currently, only allowable value is 'codon'.
-        `counts` (dict)
+        `counts` (dict or `numpy.ndarray`)
             Stores counts of identities, and is incremented by
             this function. Is a dict keyed by every possible
             character (e.g., codon), with values lists with
             element `i` holding the counts for position `i`
-            in 0, 1, ... numbering.
+            in 0, 1, ... numbering. Alternatively, an `int64`
+            array with a row for each position and a column for
+            each character in the order of `CODONS`, which is
+            incremented in place by faster compiled code.
+        `increment` (int)
+            Amount added to the counts. Use -1 to remove a
+            subamplicon that was previously added.
 
     Returns:
         On completion, `counts` has been incremented.
@@ -633,7 +1455,25 @@ def incrementCounts(refseqstart, subamplicon, chartype, counts):
     True
     >>> sum([sum(c) for c in counts.values()]) == 6
     True
+    >>> incrementCounts(3, subamplicon2, 'codon', counts, increment=-1)
+    >>> sum([sum(c) for c in counts.values()]) == 3
+    True
+
+    Now increment an array:
+
+    >>> countsarray = numpy.zeros((codonlen, len(CODONS)), dtype='int64')
+    >>> incrementCounts(1, subamplicon1, 'codon', countsarray)
+    >>> all(countsarray[i, CODONS.index(codon)] == counts[codon][i]
+    ...     for codon in CODONS for i in range(codonlen))
+    True
     """
+    if isinstance(counts, numpy.ndarray):
+        if chartype != 'codon':
+            raise ValueError("Invalid chartype")
+        dms_tools2._cutils.incrementCounts(refseqstart, subamplicon,
+                counts, increment)
+        return
+
     if chartype == 'codon':
         if refseqstart % 3 == 1:
             startcodon = (refseqstart + 2) // 3 - 1
@@ -651,7 +1491,40 @@ def incrementCounts(refseqstart, subamplicon, chartype, counts):
     for i in range(len(shiftedsubamplicon) // 3):
         codon = shiftedsubamplicon[3 * i : 3 * i + 3]
         if 'N' not in codon:
-            counts[codon][startcodon + i] += 1
+            counts[codon][startcodon + i] += increment
+
+
+def codonToAAMatrix(charlist=AAS_WITHSTOP):
+    """Matrix mapping codons to the amino acids they encode.
+
+    Multiplying an array of codon counts (with columns in the order
+    of `CODONS`) by this matrix sums the counts for each amino acid.
+
+    Args:
+        `charlist` (list)
+            Amino acids in the order of the columns. Codons encoding
+            amino acids not in `charlist` (such as stop codons if
+            `charlist` is `AAS`) have rows of all zeros.
+
+    Returns:
+        An integer `numpy.ndarray` with a row for each codon in `CODONS`
+        and a column for each amino acid in `charlist`, with element
+        1 if that codon encodes that amino acid and 0 otherwise.
+
+    >>> m = codonToAAMatrix(['M', 'W', '*'])
+    >>> m.shape == (len(CODONS), 3)
+    True
+    >>> m.sum(axis=0).tolist()
+    [1, 1, 3]
+    >>> m[CODONS.index('TGG')].tolist()
+    [0, 1, 0]
+    """
+    m = numpy.zeros((len(CODONS), len(charlist)), dtype='int')
+    for (icodon, codon) in enumerate(CODONS):
+        aa = CODON_TO_AA[codon]
+        if aa in charlist:
+            m[icodon, charlist.index(aa)] = 1
+    return m
 
 
 def codonToAACounts(counts):
@@ -692,16 +1565,15 @@ def codonToAACounts(counts):
     >>> all(aacounts['V'] == [0, 0])
     True
     """
-    d = dict([(key, []) for key in ['site', 'wildtype'] + 
-            AAS_WITHSTOP])
-    for (i, row) in counts.iterrows():
-        d['site'].append(row['site'])
-        d['wildtype'].append(CODON_TO_AA[row['wildtype']])
-        for aa in AAS_WITHSTOP:
-            d[aa].append(0)
-        for c in CODONS:
-            d[CODON_TO_AA[c]][-1] += (row[c])
-    return pandas.DataFrame(d)
+    codoncounts = counts[CODONS].values
+    # floating-point products are faster, and exact for counts < 2**53
+    aacounts = pandas.DataFrame(codoncounts.astype('float').dot(
+            codonToAAMatrix()).astype(codoncounts.dtype),
+            columns=AAS_WITHSTOP)
+    aacounts.insert(0, 'site', counts['site'].values)
+    aacounts.insert(1, 'wildtype', counts['wildtype'].map(
+            CODON_TO_AA).values)
+    return aacounts
 
 
 def annotateCodonCounts(counts):
@@ -717,8 +1589,8 @@ def annotateCodonCounts(counts):
 
     Args:
         `counts` (str)
-            Name of existing codon counts CSV file, or `pandas.DataFrame`
-            holding counts.
+            Name of existing codon counts file (read with `readTable`),
+            or `pandas.DataFrame` holding counts.
 
     Returns:
         `df` (`pandas.DataFrame`)
@@ -785,7 +1657,7 @@ def annotateCodonCounts(counts):
     True
     """
     if isinstance(counts, str):
-        df = pandas.read_csv(counts)
+        df = readTable(counts)
     elif isinstance(counts, pandas.DataFrame):
         df = counts.copy()
     else:
@@ -793,58 +1665,76 @@ def annotateCodonCounts(counts):
     assert set(CODONS) <= set(df.columns), \
             "Did not find counts for all codons".format(counts)
 
-    df['ncounts'] = df[CODONS].sum(axis=1)
+    codoncounts = df[CODONS].values
+    iwt = df['wildtype'].map(dict(zip(CODONS, range(len(CODONS))))).values
+    assert not pandas.isnull(iwt).any(), "invalid wildtype codon"
+    iwt = iwt.astype('int')
+    annotations = collections.OrderedDict()
+
+    ncounts = codoncounts.sum(axis=1)
+    annotations['ncounts'] = ncounts
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        annotations['mutfreq'] = numpy.nan_to_num((ncounts - codoncounts[
+                numpy.arange(len(df)), iwt]) / ncounts.astype('float'))
+
+    # count each type of mutation as the product of the counts with a
+    # matrix classifying mutations from each wildtype codon
+    (mutclasses, ntchanges) = _codonMutationClasses()
+    nmuts = numpy.zeros((len(df), mutclasses.shape[2]),
+            dtype=codoncounts.dtype)
+    for i in numpy.unique(iwt):
+        sites = iwt == i
+        # floating-point products are faster, exact for counts < 2**53
+        nmuts[sites] = codoncounts[sites].astype('float').dot(mutclasses[i])
+    for (i, name) in enumerate(['nstop', 'nsyn', 'nnonsyn', 'n1nt',
+            'n2nt', 'n3nt'] + ntchanges):
+        annotations[name] = nmuts[:, i]
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for nnt in range(3):
+            annotations['mutfreq{0}nt'.format(nnt + 1)] = numpy.nan_to_num(
+                    annotations['n{0}nt'.format(nnt + 1)] /
+                    ncounts.astype('float'))
+
+    if set(annotations) & set(df.columns):
+        for (name, values) in annotations.items():
+            df[name] = values
+    else:
+        df = pandas.concat([df, pandas.DataFrame(annotations,
+                index=df.index)], axis=1)
+    return df
+
 
-    df['mutfreq'] = (((df['ncounts'] - df.lookup(df['wildtype'].index,
-            df['wildtype'].values)) / df['ncounts'].astype('float'))
-            .fillna(0))
+@functools.lru_cache(maxsize=1)
+def _codonMutationClasses():
+    """Classifies mutations from each codon for `annotateCodonCounts`.
 
+    Returns:
+        The tuple `(mutclasses, ntchanges)`. `ntchanges` lists the
+        nucleotide changes such as `AtoC`. Element `[i, j, k]` of the
+        array `mutclasses` is 1 if mutating wildtype codon `CODONS[i]`
+        to `CODONS[j]` is of type `k` and 0 otherwise, where the types
+        are stop, synonymous, nonsynonymous, 1-, 2-, and 3-nucleotide
+        mutations, and then the single-nucleotide mutations in
+        `ntchanges`.
+    """
     ntchanges = ['{0}to{1}'.format(nt1, nt2) for nt1 in dms_tools2.NTS
             for nt2 in dms_tools2.NTS if nt1 != nt2]
-
-    nstoplist = []
-    nsynlist = []
-    nnonsynlist = []
-    nXntlists = dict([(n + 1, []) for n in range(3)])
-    nntchangeslists = dict([(ntchange, []) for ntchange in ntchanges])
-    for (i, row) in df.iterrows():
-        nstop = nsyn = nnonsyn = 0
-        nXnt = dict([(n + 1, 0) for n in range(3)])
-        nntchanges = dict([(ntchange, 0) for ntchange in ntchanges])
-        wt = row['wildtype']
-        wtaa = CODON_TO_AA[wt]
-        for c in CODONS:
-            if c == wt:
-                continue
-            aa = CODON_TO_AA[c]
-            if aa == '*':
-                nstop += row[c]
-            elif aa == wtaa:
-                nsyn += row[c]
-            else:
-                nnonsyn += row[c]
-            ntdiffs = ['{0}to{1}'.format(nt1, nt2) for (nt1, nt2) 
-                    in zip(wt, c) if nt1 != nt2]
-            nXnt[len(ntdiffs)] += row[c]
-            if len(ntdiffs) == 1:
-                nntchanges[ntdiffs[0]] += row[c]
-        nstoplist.append(nstop)
-        nsynlist.append(nsyn)
-        nnonsynlist.append(nnonsyn)
-        for n in range(3):
-            nXntlists[n + 1].append(nXnt[n + 1])
-        for ntchange in ntchanges:
-            nntchangeslists[ntchange].append(nntchanges[ntchange])
-    df = df.assign(nstop=nstoplist, nsyn=nsynlist, nnonsyn=nnonsynlist)
-    df = df.assign(n1nt=nXntlists[1], n2nt=nXntlists[2], n3nt=nXntlists[3])
+    codons = numpy.array([list(c) for c in CODONS])
+    aas = numpy.array([CODON_TO_AA[c] for c in CODONS])
+    # element [i, j] compares wildtype codon i to mutant codon j
+    mutant = ~numpy.eye(len(CODONS), dtype='bool')
+    ntdiffs = codons[:, None, :] != codons[None, :, :]
+    nntdiffs = ntdiffs.sum(axis=2)
+    mutclasses = [mutant & (aas[None, :] == '*'),
+                  mutant & (aas[None, :] != '*') & (aas[:, None] == aas[None, :]),
+                  mutant & (aas[None, :] != '*') & (aas[:, None] != aas[None, :]),
+                  ] + [nntdiffs == n for n in [1, 2, 3]]
     for ntchange in ntchanges:
-        df[ntchange] = nntchangeslists[ntchange]
-
-    for nnt in range(3):
-        df['mutfreq{0}nt'.format(nnt + 1)] = (df['n{0}nt'.format(nnt + 1)]
-            / df['ncounts'].astype('float')).fillna(0)
-
-    return df
+        (nt1, nt2) = ntchange.split('to')
+        mutclasses.append((nntdiffs == 1) & (ntdiffs & (codons[:, None, :] ==
+                nt1) & (codons[None, :, :] == nt2)).any(axis=2))
+    return (numpy.stack(mutclasses, axis=2).astype('int'), ntchanges)
 
 
 def adjustErrorCounts(errcounts, counts, charlist, maxexcess):
@@ -955,7 +1845,9 @@ def renumberSites(renumbfile, infiles, missing='error',
             numbered files regardless of `missing`.
         `infiles` (list)
             List of existing CSV files that we are re-numbering.
-            Each file must have an entry of `site`.
+            Each file must have an entry of `site`. Files in other
+            formats read by `readTable` are renumbered in the same
+            format.
         `missing` (str)
             How to handle sites in `infiles` but not `renumbfile`.
                 - `error`: raise an error
@@ -1019,7 +1911,7 @@ def renumberSites(renumbfile, infiles, missing='error',
             "some in and outfiles the same"
 
     for (fin, fout) in zip(infiles, outfiles):
-        df_in = pandas.read_csv(fin)
+        df_in = readTable(fin)
         assert 'site' in df_in.columns, "no `site` column in {0}".format(fin)
         df_in['site'] = df_in['site'].astype('str')
         if missing == 'error':
@@ -1047,7 +1939,7 @@ def renumberSites(renumbfile, infiles, missing='error',
                       .query('site != "None"')
                       )
 
-        df_in.to_csv(fout, index=False)
+        writeTable(df_in, fout)
 
 
 def codonEvolAccessibility(seqs):
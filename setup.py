@@ -74,7 +74,10 @@ setup(
         'rplot':[
                 'rpy2>=2.9.1',
                 'tzlocal', # required by rpy2 but not auto installed in 2.9.3
-                ]
+                ],
+        'parquet':[
+                'pyarrow>=0.15',
+                ],
         },
     platforms = 'Linux and Mac OS X.',
     packages = ['dms_tools2'],
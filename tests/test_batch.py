@@ -0,0 +1,164 @@
+"""Tests `dms_tools2.batch`.
+
+Runs a small per-sample program with `dms_tools2.batch.runScripts`.
+The program is a file on the ``PATH`` whose ``main`` is `sampleMain`,
+also run through a shell wrapper.
+"""
+
+
+import os
+import sys
+import time
+import shutil
+import functools
+import tempfile
+import unittest
+import dms_tools2.batch
+
+
+def square(x):
+    """Returns `x` squared, raises `ValueError` if `x` is negative."""
+    if x < 0:
+        raise ValueError('negative value {0}'.format(x))
+    return x * x
+
+
+def touch(fname):
+    """Waits a bit then creates empty file `fname`."""
+    time.sleep(0.1)
+    open(fname, 'w').close()
+
+
+def sampleMain():
+    """``main`` of the per-sample program used by the tests.
+
+    Command-line arguments are an output file, and either a list of
+    integers whose squares are summed with `dms_tools2.batch.Pool`,
+    ``skip`` followed by a directory in which many units each create a
+    file after a failing unit, or ``exit`` to run a unit that kills the
+    process running it.
+    """
+    outfile = sys.argv[1]
+    with dms_tools2.batch.Pool(2) as pool:
+        if sys.argv[2] == 'exit':
+            pool.apply_async(os._exit, (1,)).get()
+        if sys.argv[2] == 'skip':
+            failed = pool.apply_async(square, (-1,))
+            for i in range(50):
+                pool.apply_async(touch, (os.path.join(sys.argv[3],
+                        '{0}.txt'.format(i)),))
+            failed.get()
+        completed = dms_tools2.batch.CompletionQueue(pool)
+        for x in map(int, sys.argv[2 : ]):
+            completed.submit(x, square, (x,))
+        total = 0
+        while completed.pending:
+            total += completed.get()[1]
+        # results are not kept once returned by the completion queue
+        if isinstance(pool, dms_tools2.batch._SharedPool):
+            pending = len(pool._tasks) + list(pool._pools.values()
+                    ).count(pool)
+        else:
+            pending = 0
+    with open(outfile, 'w') as f:
+        f.write('{0} {1} {2}'.format(total, pending, type(pool).__name__))
+
+
+class test_runScripts(unittest.TestCase):
+    """Tests `dms_tools2.batch.runScripts` and `dms_tools2.batch.Pool`."""
+
+    PROG = 'dms2_test_batch'
+    WRAPPER = 'dms2_test_batch_wrapper'
+
+    def setUp(self):
+        """Puts the per-sample program and a shell wrapper on the ``PATH``."""
+        self.tmpdir = tempfile.mkdtemp()
+        prog = os.path.join(self.tmpdir, self.PROG)
+        with open(prog, 'w') as f:
+            f.write('import sys\nsys.path.insert(0, {0!r})\n'
+                    'from test_batch import sampleMain as main\n'
+                    'if __name__ == "__main__":\n    main()\n'.format(
+                    os.path.abspath(os.path.dirname(__file__))))
+        with open(os.path.join(self.tmpdir, self.WRAPPER), 'w') as f:
+            f.write('#!/bin/sh\nexec {0} {1} "$@"\n'.format(
+                    sys.executable, prog))
+        for p in [self.PROG, self.WRAPPER]:
+            os.chmod(os.path.join(self.tmpdir, p), 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.tmpdir + os.pathsep + self.path
+
+    def tearDown(self):
+        """Removes the per-sample program."""
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.tmpdir)
+
+    def test_runScripts(self):
+        """Runs samples, one with a failing unit of work."""
+        samples = [[3, 4], [1, 2, 3, 4, 5, 6], [2, -5, 7], [10]]
+        for ncpus in [1, 3]:
+            outfiles = [os.path.join(self.tmpdir, '{0}-{1}.txt'.format(
+                    ncpus, i)) for i in range(len(samples))]
+            argslist = [[self.PROG, outfile] + list(map(str, xs)) for
+                    (outfile, xs) in zip(outfiles, samples)]
+            errors = dms_tools2.batch.runScripts(argslist, ncpus)
+            for (outfile, xs, error) in zip(outfiles, samples, errors):
+                if min(xs) < 0:
+                    self.assertIn('negative value', error)
+                    self.assertFalse(os.path.isfile(outfile))
+                    continue
+                self.assertIsNone(error)
+                with open(outfile) as f:
+                    (total, pending, pooltype) = f.read().split()
+                self.assertEqual(int(total), sum(x * x for x in xs))
+                self.assertEqual(int(pending), 0)
+                self.assertEqual(pooltype, {1:'Pool', 3:'_SharedPool'}[ncpus])
+
+    def test_skipUnits(self):
+        """Units of a sample that has failed are skipped."""
+        markerdir = os.path.join(self.tmpdir, 'markers')
+        os.mkdir(markerdir)
+        outfile = os.path.join(self.tmpdir, 'skip.txt')
+        errors = dms_tools2.batch.runScripts([[self.PROG, outfile, 'skip',
+                markerdir], [self.PROG, outfile + '2', '1']], 2)
+        self.assertIn('negative value', errors[0])
+        self.assertIsNone(errors[1])
+        self.assertLess(len(os.listdir(markerdir)), 50)
+
+    def test_wrapper(self):
+        """Programs that are not Python scripts run as subprocesses."""
+        samples = [[3, 4], [2, -5]]
+        for ncpus in [1, 2]:
+            outfiles = [os.path.join(self.tmpdir, 'wrapper{0}-{1}.txt'
+                    .format(ncpus, i)) for i in range(len(samples))]
+            errors = dms_tools2.batch.runScripts([[self.WRAPPER, outfile] +
+                    list(map(str, xs)) for (outfile, xs) in
+                    zip(outfiles, samples)], ncpus)
+            with open(outfiles[0]) as f:
+                self.assertEqual(f.read().split(), ['25', '0', 'Pool'])
+            self.assertIsNone(errors[0])
+            self.assertIn('exited with status 1', errors[1])
+            self.assertIn('negative value', errors[1])
+            self.assertFalse(os.path.isfile(outfiles[1]))
+
+    def test_workerExit(self):
+        """Samples of a worker process that dies fail rather than hang."""
+        outfiles = [os.path.join(self.tmpdir, 'exit{0}.txt'.format(i))
+                for i in range(2)]
+        errors = dms_tools2.batch.runScripts([
+                functools.partial(os._exit, 1),
+                [self.PROG, outfiles[0], 'exit'],
+                functools.partial(print, 'ok'),
+                [self.PROG, outfiles[1], '3'],
+                ], 2)
+        self.assertIn('exited with code 1', errors[0])
+        self.assertIn('exited with code 1', errors[1])
+        self.assertFalse(os.path.isfile(outfiles[0]))
+        self.assertIsNone(errors[2])
+        self.assertIsNone(errors[3])
+        with open(outfiles[1]) as f:
+            self.assertEqual(f.read().split()[0], '9')
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    unittest.main(testRunner=runner)
@@ -297,6 +297,39 @@ class test_bcsubamp(unittest.TestCase):
             if os.path.isfile(f):
                 os.remove(f)
 
+    def runBcsubamp(self, name, extracmds=(), r1files=None):
+        """Runs ``dms2_bcsubamp`` on test data as sample `name`.
+
+        `extracmds` are added to the command, and `r1files` are the R1
+        files to use (by default all of them).
+        """
+        if r1files is None:
+            r1files = [os.path.basename(self.r1file)]
+        cmds = [
+                'dms2_bcsubamp',
+                '--name', name,
+                '--refseq', self.refseqfile,
+                '--alignspecs'] + self.alignspecs + [
+                '--outdir', self.testdir,
+                '--R1'] + r1files + [
+                '--fastqdir', self.testdir,
+                '--bclen', str(self.bclen),
+                '--maxmuts', str(self.MAXMUTS),
+                '--minfraccall', str(self.MINFRACCALL),
+                '--minconcur', str(self.MINCONCUR),
+               ] + list(extracmds)
+        sys.stderr.write('\nRunning the following command:\n{0}\n'.format(
+                ' '.join(cmds)))
+        subprocess.check_call(cmds)
+
+    def readOutputs(self, name):
+        """Returns dict with contents of output files for sample `name`."""
+        output = {}
+        for f in ['readstats', 'bcstats', 'readsperbc', 'codoncounts']:
+            with open('{0}/{1}_{2}.csv'.format(self.testdir, name, f)) as fin:
+                output[f] = fin.read()
+        return output
+
 
     def test_dms2_bcsubamp(self):
         """Runs ``dms2_bcsubamp`` on test data."""
@@ -377,6 +410,105 @@ class test_bcsubamp_strictminfraccall(test_bcsubamp):
     NAME = 'test-minfraccall'
 
 
+class test_bcsubamp_ncpus(test_bcsubamp):
+    """Tests ``dms2_bcsubamp`` gives same output with different ``--ncpus``."""
+    NAME = 'test-ncpus'
+
+    def test_dms2_bcsubamp(self):
+        """Runs ``dms2_bcsubamp`` with one and several CPUs."""
+        outputs = []
+        for ncpus in ['1', '3']:
+            name = '{0}-{1}'.format(self.NAME, ncpus)
+            self.runBcsubamp(name, ['--ncpus', ncpus])
+            outputs.append(self.readOutputs(name))
+        self.assertEqual(outputs[0], outputs[1])
+
+
+class test_bcsubamp_max_memory(test_bcsubamp):
+    """Tests ``dms2_bcsubamp`` gives same output with ``--max_memory``."""
+    NAME = 'test-max-memory'
+
+    def test_dms2_bcsubamp(self):
+        """Runs ``dms2_bcsubamp`` with reads in memory and spilled."""
+        outputs = []
+        for max_memory in [[], ['--max_memory', '0.005'],
+                ['--max_memory', '0.005', '--ncpus', '3']]:
+            name = '{0}-{1}'.format(self.NAME, len(max_memory))
+            self.runBcsubamp(name, max_memory)
+            outputs.append(self.readOutputs(name))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0], outputs[2])
+        self.assertFalse([f for f in os.listdir(self.testdir)
+                if '_spill' in f], 'did not remove spilled reads')
+
+
+class test_bcsubamp_checkpoint(test_bcsubamp):
+    """Tests ``dms2_bcsubamp`` with ``--checkpoint`` and ``--resume``."""
+    NAME = 'test-checkpoint'
+
+    def test_dms2_bcsubamp(self):
+        """Runs ``dms2_bcsubamp`` normally, with checkpoints, and resumed."""
+        sitemask = os.path.join(self.testdir, self.NAME + '_sitemask.csv')
+        for f in os.listdir(self.testdir):
+            if f.startswith(self.NAME + '_checkpoint') or f == os.path.basename(
+                    sitemask):
+                os.remove(os.path.join(self.testdir, f))
+        outputs = []
+        for (name, extracmds) in [
+                ('plain', []),
+                ('checkpoint', ['--checkpoint', '0', '--max_memory',
+                                '0.005', '--sitemask', sitemask]),
+                ('resume', ['--checkpoint', '0', '--resume', 'yes',
+                            '--max_memory', '0.005', '--sitemask',
+                            sitemask]),
+                ]:
+            self.runBcsubamp(self.NAME, ['--bcinfo'] + extracmds)
+            checkpoints = [f for f in os.listdir(self.testdir) if
+                    f.startswith(self.NAME + '_checkpoint')]
+            if name == 'checkpoint':
+                # fails on missing sitemask after saving checkpoints
+                self.assertTrue(checkpoints, 'no checkpoint files')
+                self.assertFalse(os.path.isfile(self.outfiles['codoncounts']))
+                pandas.DataFrame({'site':range(1, 23)}).to_csv(
+                        sitemask, index=False)
+                continue
+            self.assertFalse(checkpoints, 'did not remove checkpoints')
+            output = self.readOutputs(self.NAME)
+            with gzip.open('{0}/{1}_bcinfo.txt.gz'.format(self.testdir,
+                    self.NAME), 'rt') as fin:
+                # spilled barcodes are in a different order
+                output['bcinfo'] = sorted(fin.read().split('BARCODE: '))
+            outputs.append(output)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertFalse([f for f in os.listdir(self.testdir)
+                if self.NAME + '_spill' in f], 'did not remove spilled reads')
+
+
+class test_bcsubamp_bcstate(test_bcsubamp):
+    """Tests ``dms2_bcsubamp`` adding lanes one at a time with ``--bcstate``."""
+    NAME = 'test-bcstate'
+
+    def test_dms2_bcsubamp(self):
+        """Runs ``dms2_bcsubamp`` on all lanes and lane by lane."""
+        statefile = os.path.join(self.testdir, self.NAME +
+                '-lanes_bcstate.sqlite')
+        if os.path.isfile(statefile):
+            os.remove(statefile)
+        r1files = sorted(f for f in os.listdir(self.testdir) if
+                f.startswith(self.NAME + '_reads_R1'))
+        self.assertTrue(len(r1files) > 1)
+        outputs = []
+        for (name, lanes) in [('all', [r1files]),
+                ('lanes', [[f] for f in r1files])]:
+            name = '{0}-{1}'.format(self.NAME, name)
+            for r1 in lanes:
+                self.runBcsubamp(name, ['--bcstate', 'yes'] if
+                        len(lanes) > 1 else [], r1files=r1)
+            outputs.append(self.readOutputs(name))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertTrue(os.path.isfile(statefile))
+
+
 class test_bcsubamp_trimreads(unittest.TestCase):
     """Tests trim reads feature of ``dms2_bcsubamp``."""
 
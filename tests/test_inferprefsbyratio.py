@@ -131,6 +131,38 @@ class TestInferPrefsByRatio(unittest.TestCase):
                     prefs_err.query('site == @r')[self.charlist],
                     atol=self.ATOL, rtol=self.RTOL))
 
+    def test_inferPrefsByRatio_Stacked(self):
+        """Lists of samples give same prefs as each sample alone."""
+        random.seed(1)
+        numpy.random.seed(1)
+        samples = []
+        for isample in range(3):
+            dfs = {}
+            for ctype in ['pre', 'post', 'errpre', 'errpost']:
+                counts = numpy.random.multinomial(
+                        int(random.uniform(*self.Nr_RANGE)),
+                        numpy.full(self.nchars, 1.0 / self.nchars),
+                        size=self.nsites)
+                dfs[ctype] = pandas.DataFrame(counts, columns=self.charlist)
+                dfs[ctype].insert(0, 'site', self.sites)
+            samples.append(dfs)
+        for err in [True, False]:
+            (errpre, errpost) = [[dfs[ctype] for dfs in samples] if err
+                    else None for ctype in ['errpre', 'errpost']]
+            prefs = dms_tools2.prefs.inferPrefsByRatio(self.charlist,
+                    self.sites, self.wts, [dfs['pre'] for dfs in samples],
+                    [dfs['post'] for dfs in samples], errpre, errpost,
+                    self.pseudocount)
+            self.assertEqual(len(prefs), len(samples))
+            for (dfs, sampleprefs) in zip(samples, prefs):
+                expected = dms_tools2.prefs.inferPrefsByRatio(self.charlist,
+                        self.sites, self.wts, dfs['pre'], dfs['post'],
+                        dfs['errpre'] if err else None,
+                        dfs['errpost'] if err else None, self.pseudocount)
+                self.assertTrue(list(sampleprefs['site']) == self.sites)
+                self.assertTrue(numpy.allclose(sampleprefs[self.charlist],
+                        expected[self.charlist]))
+
 
 
 class TestInferPrefsByRatioDiffDepth(TestInferPrefsByRatio):
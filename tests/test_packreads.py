@@ -0,0 +1,40 @@
+"""Tests packing batches of reads with `dms_tools2.utils`.
+
+Reads with characters other than ``ACGTN`` at high-quality positions
+must still be packed, as when parsing reads in ``dms2_bcsubamp``."""
+
+
+import unittest
+import dms_tools2.utils
+
+
+class test_packReads(unittest.TestCase):
+    """Tests packing reads with invalid characters."""
+
+    def test_invalidCharacters(self):
+        """Invalid characters become ``N`` rather than raising errors."""
+        r1s = ['ACGtACGT', 'GG.AC', 'TTARYKMA']
+        r2s = ['CCGGACT', 'ACGTAC', 'acgtGA']
+        q1s = ['I' * len(r) for r in r1s]
+        q2s = ['I' * len(r) for r in r2s]
+        r1 = dms_tools2.utils.readsToArray(r1s)
+        r2 = dms_tools2.utils.readsToArray(r2s)
+        with self.assertRaises(ValueError):
+            dms_tools2.utils.packReadArrays(r1, r2)
+        r1 = dms_tools2.utils.lowQtoNBatch(r1,
+                dms_tools2.utils.readsToArray(q1s), '5')
+        r2 = dms_tools2.utils.lowQtoNBatch(r2,
+                dms_tools2.utils.readsToArray(q2s), '5')
+        (barcodes, r1, r2, lowq) = dms_tools2.utils.barcodesFromBatch(
+                r1, r2, 2, 2, encoded=True)
+        self.assertEqual([dms_tools2.utils.decodeBarcode(bc) for bc in
+                barcodes], ['ACCC', 'GGAC', 'TTAA'])
+        self.assertEqual(lowq.tolist(), [False, False, True])
+        packed = dms_tools2.utils.packReadArrays(r1, r2)
+        self.assertEqual([dms_tools2.utils.unpackReads(p) for p in packed],
+                [['GNACGT', 'GGACT'], ['NAC', 'GTAC'], ['ANNNNA', 'NNGA']])
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    unittest.main(testRunner=runner)
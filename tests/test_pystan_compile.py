@@ -1,6 +1,8 @@
 """Tests compilation of ``pystan`` models."""
 
 
+import os
+import tempfile
 import unittest
 import dms_tools2.prefs
 
@@ -37,6 +39,22 @@ class test_pyStanModels_Different(test_pyStanModels):
         m = self.MODEL(verbose=True)
         self.assertTrue(m is not None)
 
+
+class test_pyStanModelCache(unittest.TestCase):
+    """Caches compiled ``pystan`` models on disk."""
+
+    def test_pystan_cache(self):
+        """Tests second instantiation loads the cached model."""
+        with tempfile.TemporaryDirectory() as cachedir:
+            m1 = dms_tools2.prefs.StanModelNoneErr(cachedir=cachedir)
+            cached = [f for f in os.listdir(cachedir)
+                    if f.endswith('.pickle')]
+            self.assertEqual(1, len(cached))
+            m2 = dms_tools2.prefs.StanModelNoneErr(cachedir=cachedir)
+            self.assertEqual(m1.model.model_code, m2.model.model_code)
+            self.assertEqual(cached, [f for f in os.listdir(cachedir)
+                    if f.endswith('.pickle')])
+
 if __name__ == '__main__':
     runner = unittest.TextTestRunner()
     unittest.main(testRunner=runner)
@@ -1,4 +1,4 @@
-"""Tests inference of preferences for a site."""
+"""Tests inference of preferences for a site or block of sites."""
 
 
 import sys
@@ -160,6 +160,94 @@ class TestInferSitePreferences(unittest.TestCase):
             self.assertFalse(diffsum < maxdiffsum, 'incorrectly converged')
 
 
+class TestInferBlockPreferences(unittest.TestCase):
+    """Tests joint inference for a block of sites with correct priors."""
+    SEED = 1
+    CHARLIST = NTS
+    NSITES = 3
+
+    def simulateBlock(self):
+        """Simulates block of sites with same errors pre and post.
+
+        Returns `(wtchars, pirs, counts, priors)`."""
+        random.seed(self.SEED)
+        numpy.random.seed(self.SEED)
+        nchars = len(self.CHARLIST)
+        depth = 1e9
+        wtchars = []
+        pirs = []
+        counts = []
+        priors = []
+        for isite in range(self.NSITES):
+            wtchar = random.choice(self.CHARLIST)
+            iwtchar = self.CHARLIST.index(wtchar)
+            deltar = numpy.zeros(nchars)
+            deltar[iwtchar] = 1.0
+            mur = numpy.random.uniform(0.005, 0.025, nchars) / nchars
+            epsilonr = numpy.random.uniform(0.0001, 0.0003, nchars) / nchars
+            for x in [mur, epsilonr]:
+                x[iwtchar] = 0
+                x[iwtchar] = 1.0 - x.sum()
+            pir = numpy.random.uniform(1e-5, 0.6, nchars)
+            pir[iwtchar] = 1.0
+            pir /= pir.sum()
+            nrpre = numpy.random.multinomial(depth, mur + epsilonr - deltar)
+            nrpost = numpy.random.multinomial(depth, mur * pir /
+                    numpy.dot(mur, pir) + epsilonr - deltar)
+            nrerr = numpy.random.multinomial(depth, epsilonr)
+            wtchars.append(wtchar)
+            pirs.append(pir)
+            counts.append(dict([(ctype, dict(zip(self.CHARLIST, n))) for
+                    (ctype, n) in [('pre', nrpre), ('post', nrpost),
+                    ('err', nrerr)]]))
+            priors.append(dict([(prior, dict(zip(self.CHARLIST, x * nchars)))
+                    for (prior, x) in [('pir_prior_params', pir),
+                    ('mur_prior_params', mur),
+                    ('epsilonr_prior_params', epsilonr)]]))
+        return (wtchars, pirs, counts, priors)
+
+    def test_inferBlockPrefs(self):
+        """Inference for block of sites with same errors pre and post."""
+        maxdiffsum = 0.01
+        (wtchars, pirs, counts, priors) = self.simulateBlock()
+        results = dms_tools2.prefs.inferBlockPrefs(self.CHARLIST, wtchars,
+                'same', counts, priors, n_jobs=-1)
+        self.assertEqual(self.NSITES, len(results))
+        for (pir, (converged, pi_means, pi_95credint, logstring)) in zip(
+                pirs, results):
+            self.assertTrue(converged, 'failed to converge')
+            inferred_pi = [pi_means[char] for char in self.CHARLIST]
+            diffsum = sum([abs(x - y) for (x, y) in zip(pir, inferred_pi)])
+            self.assertTrue(diffsum < maxdiffsum, 'wrong preferences')
+
+    def test_inferBlockPrefsNumpy(self):
+        """Inference for block of sites with the `numpy` sampler."""
+        maxdiffsum = 0.01
+        (wtchars, pirs, counts, priors) = self.simulateBlock()
+        results = dms_tools2.prefs.inferBlockPrefs(self.CHARLIST, wtchars,
+                'same', counts, priors, backend='numpy')
+        self.assertEqual(self.NSITES, len(results))
+        for (pir, (converged, pi_means, pi_95credint, logstring)) in zip(
+                pirs, results):
+            self.assertTrue(converged, 'failed to converge')
+            inferred_pi = [pi_means[char] for char in self.CHARLIST]
+            diffsum = sum([abs(x - y) for (x, y) in zip(pir, inferred_pi)])
+            self.assertTrue(diffsum < maxdiffsum, 'wrong preferences')
+
+    def test_inferBlockPrefsMAP(self):
+        """MAP estimates for block of sites with same errors pre and post."""
+        maxdiffsum = 0.01
+        (wtchars, pirs, counts, priors) = self.simulateBlock()
+        results = dms_tools2.prefs.inferBlockPrefsMAP(self.CHARLIST,
+                wtchars, 'same', counts, priors)
+        self.assertEqual(self.NSITES, len(results))
+        for (pir, (reliable, pi_map, logstring)) in zip(pirs, results):
+            self.assertTrue(reliable, 'unreliable MAP estimate')
+            inferred_pi = [pi_map[char] for char in self.CHARLIST]
+            diffsum = sum([abs(x - y) for (x, y) in zip(pir, inferred_pi)])
+            self.assertTrue(diffsum < maxdiffsum, 'wrong preferences')
+
+
 if __name__ == '__main__':
     runner = unittest.TextTestRunner()
     unittest.main(testRunner=runner)
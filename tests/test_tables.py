@@ -0,0 +1,54 @@
+"""Tests writing and reading tables with `dms_tools2.utils`.
+
+The Parquet round trip is skipped if ``pyarrow`` is not installed."""
+
+
+import os
+import tempfile
+import unittest
+import numpy
+import pandas
+import pytest
+import dms_tools2.utils
+
+
+class test_tables(unittest.TestCase):
+    """Tests `writeTable` and `readTable` in each format."""
+
+    def setUp(self):
+        """Data frame with categorical-like and float columns."""
+        self.df = pandas.DataFrame({
+                'site':[1, 2, 2],
+                'wildtype':['A', 'C', 'C'],
+                'mutation':['C', 'A', 'G'],
+                'mutdiffsel':[0.123456789012345, numpy.nan, -2.5],
+                })
+
+    def roundTrip(self, outformat, index=False):
+        """Writes and reads `self.df` in `outformat`."""
+        df = self.df.set_index('site') if index else self.df
+        with tempfile.TemporaryDirectory() as tmpdir:
+            f = dms_tools2.utils.tableFile(os.path.join(tmpdir, 'test'),
+                    outformat)
+            dms_tools2.utils.writeTable(df, f, index=index)
+            return dms_tools2.utils.readTable(f,
+                    index_col='site' if index else None)
+
+    def test_csv(self):
+        """CSV tables read back as written."""
+        pandas.testing.assert_frame_equal(self.roundTrip('csv'), self.df)
+
+    def test_parquet(self):
+        """Parquet tables read back exactly, categoricals converted back."""
+        pytest.importorskip('pyarrow')
+        df = self.roundTrip('parquet')
+        pandas.testing.assert_frame_equal(df, self.df)
+        self.assertEqual(df['mutdiffsel'][0], self.df['mutdiffsel'][0])
+        pandas.testing.assert_frame_equal(
+                self.roundTrip('parquet', index=True),
+                self.df.set_index('site'))
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    unittest.main(testRunner=runner)